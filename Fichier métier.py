@@ -1,11 +1,21 @@
 # gestion_agents.py - VERSION COMPLÈTE AVEC RETOUR DE DONNÉES
 import sqlite3
-import pandas as pd 
+import base64
 import csv
-from datetime import date, timedelta
+import copy
+import functools
+import gzip
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from itertools import groupby
+from pathlib import Path
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from calendar import monthrange
 import os
-from tabulate import tabulate 
 
 # Constantes pour la traduction et la logique
 JOURS_FRANCAIS = {
@@ -16,12 +26,407 @@ JOURS_FRANCAIS = {
 # Date d'affectation fixe demandée par l'utilisateur
 DATE_AFFECTATION_BASE = "2025-11-01"
 
+# Version du schéma, enregistrée dans PRAGMA user_version : à incrémenter à chaque
+# modification de _initialiser_db pour que les bases existantes soient mises à jour
+VERSION_SCHEMA = 1
+
+# Nombre maximal de résultats conservés dans le cache des lectures
+TAILLE_CACHE_DEFAUT = 256
+
+# Écritures concurrentes : essais de BEGIN IMMEDIATE, attente exponentielle avec gigue
+# (plafonnée), et délai d'attente SQLite rétabli ensuite (celui de sqlite3.connect)
+TENTATIVES_VERROU = 12
+ATTENTE_VERROU_BASE_S = 0.005
+ATTENTE_VERROU_MAX_S = 0.5
+DELAI_OCCUPATION_MS = 5000
+
+# Identifiant (et version) du format compact du planning
+FORMAT_PLANNING_COMPACT = 'planning-compact/1'
+
+# Nombres magiques utilisés pour reconnaître la compression d'un planning compact
+MAGIQUE_GZIP = b'\x1f\x8b'
+MAGIQUE_ZSTD = b'\x28\xb5\x2f\xfd'
+
+# Durée de vie (en mois) de chaque article d'habillement avant renouvellement
+DUREES_RENOUVELLEMENT_MOIS = {'chemise': 12, 'jacket': 24, 'pantalon': 12, 'cravate': 24}
+
+TYPES_AVERTISSEMENT = ['ORAL', 'ECRIT', 'MISE_A_PIED']
+
+# Effectif minimal par shift et par jour, tous groupes confondus
+MINIMUMS_COUVERTURE_DEFAUT = {'1': 1, '2': 1, '3': 1}
+
+# Shifts comptés comme absences dans la couverture (congé, maladie, autre)
+SHIFTS_ABSENCE = 'CMA'
+
+# Code d'un caractère de chaque origine de saisie du planning (stockage compact)
+CODES_ORIGINE = {
+    'THEORIQUE': 'T', 'MANUEL': 'M', 'ABSENCE': 'A', 'ECHANGE': 'E',
+    'CONGE_PERIODE': 'C', 'CONGE_DIMANCHE': 'D'
+}
+ORIGINES_PAR_CODE = {code: origine for origine, code in CODES_ORIGINE.items()}
+
+# Enchaînements de shifts interdits d'un jour au suivant (nuit puis matin)
+TRANSITIONS_INTERDITES = {('3', '1')}
+
+# Règles de validation du planning (None désactive une règle)
+REGLES_PLANNING_DEFAUT = {
+    'transitions_interdites': TRANSITIONS_INTERDITES,
+    'max_jours_consecutifs': 6,
+    'max_nuits_consecutives': 3,
+    'repos_hebdomadaire': 1,  # jours non travaillés minimum par semaine ISO complète
+}
+
+
+class CacheResultats:
+    """Cache LRU borné des résultats des API de lecture.
+
+    Chaque entrée est indexée par la méthode, ses arguments et les versions
+    des données dont elle dépend : une écriture incrémente ces versions, ce qui
+    rend les anciennes entrées inaccessibles (elles sortent ensuite par LRU).
+    """
+
+    def __init__(self, taille_max=TAILLE_CACHE_DEFAUT):
+        self.taille_max = taille_max
+        self._entrees = OrderedDict()
+        self._versions = {}
+        self._verrou = threading.RLock()
+        self.nb_succes = 0
+        self.nb_echecs = 0
+        # Dernier changement du journal pris en compte (voir GestionAgents.synchroniser_cache)
+        self.seq_journal = None
+
+    def version(self, dependance):
+        """Retourne la version courante d'une dépendance (0 si jamais modifiée)."""
+        return self._versions.get(dependance, 0)
+
+    def incrementer(self, dependances):
+        """Incrémente la version de chaque dépendance modifiée."""
+        with self._verrou:
+            for dependance in dependances:
+                self._versions[dependance] = self._versions.get(dependance, 0) + 1
+
+    def obtenir(self, cle):
+        """Retourne (trouvé, valeur) et marque l'entrée comme récemment utilisée."""
+        with self._verrou:
+            if cle in self._entrees:
+                self._entrees.move_to_end(cle)
+                self.nb_succes += 1
+                return True, self._entrees[cle]
+            self.nb_echecs += 1
+            return False, None
+
+    def stocker(self, cle, valeur):
+        """Ajoute une entrée et évince les moins récemment utilisées au-delà de la taille max."""
+        with self._verrou:
+            self._entrees[cle] = valeur
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+
+    def vider(self):
+        """Supprime toutes les entrées (les versions et compteurs sont conservés)."""
+        with self._verrou:
+            self._entrees.clear()
+
+    def statistiques(self):
+        """Retourne les compteurs du cache."""
+        with self._verrou:
+            total = self.nb_succes + self.nb_echecs
+            return {
+                'entrees': len(self._entrees),
+                'taille_max': self.taille_max,
+                'succes': self.nb_succes,
+                'echecs': self.nb_echecs,
+                'taux_succes': round(self.nb_succes / total * 100, 1) if total else 0
+            }
+
+
+def _mise_en_cache(dependances):
+    """Décorateur : met en cache le résultat d'une méthode de lecture de GestionAgents.
+
+    `dependances(self, *args, **kwargs)` retourne les clés de version dont dépend le
+    résultat. Les résultats en erreur ne sont pas conservés, et une copie est
+    toujours retournée pour que l'appelant ne puisse pas altérer le cache.
+    Hors transaction, chaque lecture commence par synchroniser le cache sur le journal
+    (une requête quand rien n'a changé) : les écritures des autres processus sont prises
+    en compte. Dans une transaction, le journal peut contenir des lignes non validées.
+    """
+    def decorateur(methode):
+        @functools.wraps(methode)
+        def enveloppe(self, *args, **kwargs):
+            if self._cache is None:
+                return methode(self, *args, **kwargs)
+
+            if not self.conn.in_transaction:
+                self.synchroniser_cache()
+
+            # `format_resultat` (méthodes à colonnes natives) distingue les entrées sans changer les dépendances
+            versions = tuple(
+                (d, self._cache.version(d))
+                for d in dependances(self, *args, **{k: v for k, v in kwargs.items() if k != 'format_resultat'})
+            )
+            cle = (methode.__name__, args, tuple(sorted(kwargs.items())), versions)
+
+            trouve, valeur = self._cache.obtenir(cle)
+            if trouve:
+                return copy.deepcopy(valeur)
+
+            resultat = methode(self, *args, **kwargs)
+            if isinstance(resultat, dict) and 'erreur' not in resultat:
+                self._cache.stocker(cle, copy.deepcopy(resultat))
+            return resultat
+        return enveloppe
+    return decorateur
+
+
+# Format des résultats de lecture : listes de dictionnaires ('lignes', par défaut)
+# ou colonnes (une liste de valeurs par clé), plus compact en mémoire et en JSON.
+FORMATS_RESULTAT = ('lignes', 'colonnes')
+
+
+def en_colonnes(valeur):
+    """Convertit récursivement les listes de dictionnaires d'un résultat au format colonnes.
+
+    Une liste de dictionnaires devient {'__colonnes__': {clé: [valeurs]}} ; les clés
+    absentes de certaines lignes sont complétées par None et listées dans
+    '__absents__' ({clé: [indices]}) pour que `en_lignes` restitue l'original.
+    """
+    if isinstance(valeur, dict):
+        return {cle: en_colonnes(v) for cle, v in valeur.items()}
+    if not isinstance(valeur, list):
+        return valeur
+    if not valeur or not all(isinstance(ligne, dict) for ligne in valeur):
+        return [en_colonnes(v) for v in valeur]
+
+    cles = list(dict.fromkeys(cle for ligne in valeur for cle in ligne))
+    colonnes = {cle: [en_colonnes(ligne.get(cle)) for ligne in valeur] for cle in cles}
+    resultat = {'__colonnes__': colonnes}
+    absents = {cle: [i for i, ligne in enumerate(valeur) if cle not in ligne] for cle in cles}
+    absents = {cle: indices for cle, indices in absents.items() if indices}
+    if absents:
+        resultat['__absents__'] = absents
+    return resultat
+
+
+def en_lignes(valeur):
+    """Inverse de `en_colonnes` : restitue les listes de dictionnaires."""
+    if isinstance(valeur, list):
+        return [en_lignes(v) for v in valeur]
+    if not isinstance(valeur, dict):
+        return valeur
+    if '__colonnes__' not in valeur:
+        return {cle: en_lignes(v) for cle, v in valeur.items()}
+
+    colonnes = valeur['__colonnes__']
+    absents = {cle: set(indices) for cle, indices in valeur.get('__absents__', {}).items()}
+    nb_lignes = len(next(iter(colonnes.values()), []))
+    return [
+        {cle: en_lignes(valeurs[i]) for cle, valeurs in colonnes.items() if i not in absents.get(cle, ())}
+        for i in range(nb_lignes)
+    ]
+
+
+def _lignes_ou_colonnes(colonnes, format_resultat):
+    """Assemble des colonnes {clé: [valeurs]} de même longueur au format demandé.
+
+    En 'colonnes', le résultat est celui qu'aurait produit `en_colonnes` sur les
+    lignes, sans que celles-ci soient jamais construites.
+    """
+    if not next(iter(colonnes.values()), []):
+        return []
+    if format_resultat == 'colonnes':
+        return {'__colonnes__': colonnes}
+    cles = list(colonnes)
+    return [dict(zip(cles, valeurs)) for valeurs in zip(*colonnes.values())]
+
+
+def _colonnes_natives(methode):
+    """Marque une API de lecture qui reçoit `format_resultat` et construit elle-même ses colonnes."""
+    methode.colonnes_natives = True
+    return methode
+
+
+def _format_resultat(methode):
+    """Décorateur : ajoute le paramètre `format_resultat` ('lignes' ou 'colonnes') à une API de lecture.
+
+    Le cache conserve le format lignes ; la conversion se fait à la sortie. Les méthodes
+    marquées par `_colonnes_natives` (plannings et statistiques de tout l'effectif) reçoivent
+    le format et évitent ainsi de matérialiser les lignes avant de les convertir.
+    """
+    natif = getattr(methode, 'colonnes_natives', False)
+
+    @functools.wraps(methode)
+    def enveloppe(self, *args, format_resultat='lignes', **kwargs):
+        if format_resultat not in FORMATS_RESULTAT:
+            return {'erreur': f"Format de résultat inconnu: {format_resultat} ({', '.join(FORMATS_RESULTAT)})."}
+        if natif:
+            return methode(self, *args, format_resultat=format_resultat, **kwargs)
+        resultat = methode(self, *args, **kwargs)
+        if format_resultat == 'colonnes' and isinstance(resultat, dict) and 'erreur' not in resultat:
+            return en_colonnes(resultat)
+        return resultat
+    enveloppe.formats_resultat = FORMATS_RESULTAT
+    return enveloppe
+
+
+def _base_verrouillee(erreur):
+    """Vrai si l'erreur SQLite signale une base occupée par un autre processus (SQLITE_BUSY/LOCKED)."""
+    message = str(erreur).lower()
+    return isinstance(erreur, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def _ecriture_concurrente(methode):
+    """Décorateur : exécute une méthode d'écriture dans `GestionAgents._transaction_immediate`.
+
+    Les lectures de la méthode et ses écritures forment une seule transaction ; si le
+    verrou d'écriture reste indisponible après les reprises, rien n'est écrit et une
+    erreur est retournée.
+    """
+    @functools.wraps(methode)
+    def enveloppe(self, *args, **kwargs):
+        try:
+            with self._transaction_immediate():
+                return methode(self, *args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not _base_verrouillee(e):
+                raise
+            return {'erreur': "Base de données occupée par d'autres écritures, réessayez plus tard."}
+    return enveloppe
+
+
+def _dependances_mois(self, mois, annee):
+    """Dépendances d'un résultat portant sur tout l'effectif pour un mois."""
+    return [('effectif',), ('mois', annee, mois)]
+
+
+def _dependances_groupe_mois(self, code_groupe, mois, annee):
+    """Dépendances d'un résultat portant sur un groupe pour un mois."""
+    return _dependances_mois(self, mois, annee)
+
+
+def _dependances_agent_mois(self, code_agent, mois, annee):
+    """Dépendances d'un résultat portant sur un agent pour un mois."""
+    code_agent = code_agent.upper()
+    return [('agent', code_agent), ('mois_agent', annee, mois, code_agent), ('feries_mois', annee, mois)]
+
+
+def _dependances_feries(self, annee):
+    """Dépendances de la liste des jours fériés d'une année."""
+    return [('feries', annee)]
+
+
+def _dependances_jour_adjacent(self, jour_date):
+    """Dépendances d'un résultat portant sur tout l'effectif pour un jour et ses deux voisins."""
+    jour = date.fromisoformat(jour_date)
+    return [('effectif',)] + [
+        ('mois', annee, mois) for annee, mois in self._mois_periode(
+            (jour - timedelta(days=1)).isoformat(), (jour + timedelta(days=1)).isoformat()
+        )
+    ]
+
+
+def encoder_planning_compact(planning, compression=None):
+    """Sérialise un planning compact en octets (JSON), éventuellement compressé.
+
+    `compression` : None, 'gzip' ou 'zstd' (nécessite le paquet `zstandard`).
+    """
+    corps = json.dumps(planning, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if compression is None:
+        return corps
+    if compression == 'gzip':
+        return gzip.compress(corps, mtime=0)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Compression zstd indisponible : installez le paquet 'zstandard'.")
+        return zstandard.ZstdCompressor().compress(corps)
+    raise ValueError(f"Compression inconnue: {compression}")
+
+
+def decoder_planning_compact(donnees):
+    """Désérialise un planning compact ; la compression est reconnue à son nombre magique."""
+    if donnees.startswith(MAGIQUE_GZIP):
+        donnees = gzip.decompress(donnees)
+    elif donnees.startswith(MAGIQUE_ZSTD):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Décompression zstd indisponible : installez le paquet 'zstandard'.")
+        donnees = zstandard.ZstdDecompressor().decompress(donnees)
+    planning = json.loads(donnees.decode('utf-8'))
+    if planning.get('format') != FORMAT_PLANNING_COMPACT:
+        raise ValueError(f"Format de planning non reconnu: {planning.get('format')}")
+    return planning
+
+
+def developper_planning_compact(planning):
+    """Reconstruit la structure détaillée (jours + agents avec liste de shifts) d'un planning compact."""
+    debut = date.fromisoformat(planning['debut'])
+    masque_feries = int(planning['feries'], 16)
+
+    jours = []
+    for i in range(planning['nb_jours']):
+        jour_date = debut + timedelta(days=i)
+        jours.append({
+            'numero': jour_date.day,
+            'date': jour_date.isoformat(),
+            'jour_semaine': JOURS_FRANCAIS[jour_date.strftime('%a')],
+            'ferie': bool(masque_feries >> i & 1)
+        })
+
+    agents = []
+    for code, nom_complet, groupe, shifts_mois in zip(planning['codes'], planning['noms'], planning['groupes'], planning['shifts']):
+        agents.append({
+            'code': code,
+            'nom_complet': nom_complet,
+            'groupe': groupe,
+            'shifts': list(''.join(shifts_mois))
+        })
+
+    return {'jours': jours, 'agents': agents, 'total_agents': len(agents)}
+
+
+def _encoder_jeton(cle):
+    """Encode la clé de la dernière ligne d'une page en jeton de continuation opaque."""
+    return base64.urlsafe_b64encode(json.dumps(cle).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decoder_jeton(jeton):
+    """Décode un jeton de continuation ; lève ValueError s'il est invalide."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(jeton + '=' * (-len(jeton) % 4)))
+    except ValueError as e:
+        raise ValueError(f"Jeton de continuation invalide: {e}")
+
+
 class GestionAgents:
-    def __init__(self, db_name="planning.db"):
+    def __init__(self, db_name="planning.db", taille_cache=TAILLE_CACHE_DEFAUT, lecture_seule=False):
         self.db_name = db_name
-        self.conn = sqlite3.connect(db_name)
+        # En lecture seule, la base n'est jamais modifiée : le planning théorique
+        # est calculé à la volée au lieu d'être enregistré (rapports, processus parallèles).
+        self.lecture_seule = lecture_seule
+        # check_same_thread=False : une instance peut être utilisée depuis un thread de
+        # travail (fédération multi-sites), à condition de ne pas la partager simultanément.
+        if lecture_seule:
+            self.conn = sqlite3.connect(Path(db_name).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(db_name, check_same_thread=False)
         self.cursor = self.conn.cursor()
-        self._initialiser_db()
+        self._cache = CacheResultats(taille_cache) if taille_cache else None
+        # Schéma déjà à jour : on évite les CREATE ... IF NOT EXISTS et le commit
+        if not lecture_seule and self.conn.execute("PRAGMA user_version").fetchone()[0] != VERSION_SCHEMA:
+            self._initialiser_db()
+        # Stockage du planning : une ligne par agent et par jour, ou par agent et par mois
+        self.stockage_compact = self._table_existe('planning_mensuel')
+        self._archives = None
+        self._archives_attachees = {}
+        # Index cumulatif des statistiques, par année (voir `statistiques_periode`)
+        self._index_cumuls = {}
+        self._seq_index_cumuls = None
+        # Point de départ du cache dans le journal : toute écriture ultérieure sera rejouée
+        if self._cache is not None and self._table_existe('journal_changements'):
+            self._cache.seq_journal = self.dernier_seq_journal()
 
     def _initialiser_db(self):
         """Initialise la base de données avec les tables nécessaires (complètes)."""
@@ -37,15 +442,9 @@ class GestionAgents:
                 statut TEXT DEFAULT 'actif'
             )
         """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS planning (
-                code_agent TEXT,
-                date TEXT,
-                shift TEXT,
-                origine TEXT,
-                PRIMARY KEY (code_agent, date)
-            )
-        """)
+        # Pas de table `planning` une fois la base migrée vers le stockage compact
+        if not self._table_existe('planning_mensuel'):
+            self.cursor.execute(self._SQL_TABLE_PLANNING)
         self.cursor.execute("""
             CREATE TABLE IF NOT EXISTS jours_feries (
                 date TEXT PRIMARY KEY,
@@ -115,27 +514,867 @@ class GestionAgents:
                 FOREIGN KEY (code_agent) REFERENCES agents(code)
             )
         """)
+        # Journal des changements pour la synchronisation incrémentale de la PWA
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS journal_changements (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                horodatage TEXT NOT NULL,
+                entite TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                cle TEXT NOT NULL,
+                donnees TEXT
+            )
+        """)
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_journal_entite_cle ON journal_changements (entite, cle, seq)"
+        )
+        # Années closes déplacées dans des fichiers d'archive (voir archiver_annee)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archives (
+                annee INTEGER PRIMARY KEY,
+                fichier TEXT NOT NULL,
+                stockage TEXT NOT NULL,
+                date_archivage TEXT NOT NULL
+            )
+        """)
+        # Index partiel des attributions radio en cours (au plus une par radio)
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_historique_radio_ouvert ON historique_radio (id_radio) WHERE date_retour IS NULL"
+        )
+        # Index des dates de fourniture (prévision des renouvellements)
+        for article in DUREES_RENOUVELLEMENT_MOIS:
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_habillement_{article}_date ON habillement ({article}_date)"
+            )
+        # Index de la pagination par clé des rapports d'avertissements (l'id suit implicitement)
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_avertissements_date ON avertissements (date_avertissement)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_avertissements_agent ON avertissements (code_agent, date_avertissement)"
+        )
+        # Index des requêtes d'analyse de l'historique radio par période
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_historique_radio_retour ON historique_radio (date_retour, date_attribution)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_historique_radio_radio ON historique_radio (id_radio, date_attribution)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_historique_radio_agent ON historique_radio (code_agent, date_attribution)"
+        )
 
+        self.cursor.execute(f"PRAGMA user_version = {VERSION_SCHEMA}")
         self.conn.commit()
 
     def fermer_connexion(self):
         """Ferme la connexion à la base de données."""
         self.conn.close()
 
+    # =========================================================================
+    # TRANSACTIONS D'ÉCRITURE (PLUSIEURS PROCESSUS SUR LA MÊME BASE)
+    # =========================================================================
+    #
+    # PWA, superviseurs et tâches planifiées écrivent dans le même fichier. Une
+    # transaction différée ne prend le verrou qu'à la première écriture : entre la
+    # lecture (statut d'une radio, shifts à échanger) et l'écriture, un autre
+    # processus peut modifier les mêmes lignes. BEGIN IMMEDIATE prend le verrou
+    # d'écriture d'emblée ; les lectures faites ensuite restent valides jusqu'au commit.
+
+    @contextmanager
+    def _transaction_immediate(self):
+        """Ouvre une transaction BEGIN IMMEDIATE, avec reprises si la base est verrouillée.
+
+        Sans effet dans une transaction déjà ouverte (elle appartient à l'appelant) ou en
+        lecture seule. Les archives (les plus récentes, dans la limite d'ATTACH) sont
+        attachées avant, ATTACH étant impossible ensuite. Ce qui n'a pas été validé à la
+        sortie du bloc est annulé. Lève sqlite3.OperationalError après TENTATIVES_VERROU essais.
+        """
+        if self.conn.in_transaction or self.lecture_seule:
+            yield
+            return
+
+        self._attacher_archives(sorted(self.lister_archives())[-self.MAX_ARCHIVES_ATTACHEES:])
+
+        # Attente gérée ici (gigue) plutôt que par le délai fixe de SQLite
+        self.conn.execute("PRAGMA busy_timeout = 0")
+        try:
+            for tentative in range(TENTATIVES_VERROU):
+                try:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    break
+                except sqlite3.OperationalError as e:
+                    if not _base_verrouillee(e) or tentative + 1 == TENTATIVES_VERROU:
+                        raise
+                    time.sleep(random.uniform(0, min(ATTENTE_VERROU_MAX_S, ATTENTE_VERROU_BASE_S * 2 ** tentative)))
+        finally:
+            self.conn.execute(f"PRAGMA busy_timeout = {DELAI_OCCUPATION_MS}")
+
+        try:
+            yield
+        finally:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+
+    # =========================================================================
+    # CACHE DES LECTURES
+    # =========================================================================
+
+    def statistiques_cache(self):
+        """Retourne les compteurs du cache des lectures (entrées, succès, échecs)."""
+        if self._cache is None:
+            return {'message': "Cache désactivé."}
+        return self._cache.statistiques()
+
+    def vider_cache(self):
+        """Vide le cache des lectures."""
+        if self._cache is not None:
+            self._cache.vider()
+        return {'succes': True, 'message': "Cache des lectures vidé."}
+
+    def _mois_periode(self, date_debut, date_fin):
+        """Retourne la liste des (annee, mois) couverts par une période (dates ISO)."""
+        debut = date.fromisoformat(date_debut)
+        fin = date.fromisoformat(date_fin)
+        liste_mois = []
+        annee, mois = debut.year, debut.month
+        while (annee, mois) <= (fin.year, fin.month):
+            liste_mois.append((annee, mois))
+            annee, mois = (annee + 1, 1) if mois == 12 else (annee, mois + 1)
+        return liste_mois
+
+    def _invalider_cache(self, agents=(), mois=(), effectif=False, feries=(), entites=()):
+        """Incrémente les versions des données touchées par une écriture.
+
+        - agents / mois : cellules de planning modifiées (agents × mois concernés) ;
+        - effectif : la fiche ou la rotation des agents a changé (voir `_propager_modifications_agents`) ;
+        - feries : dates de jours fériés ajoutées ou supprimées ;
+        - entites : tables annexes modifiées ('radio', 'habillement', 'avertissement', 'code_panique').
+        """
+        self._invalider_index_cumuls(agents, mois, effectif, feries)
+        if self._cache is None:
+            return
+
+        agents = list(agents)
+        dependances = []
+        for annee, m in mois:
+            dependances.append(('mois', annee, m))
+            dependances.extend(('mois_agent', annee, m, code) for code in agents)
+
+        if effectif:
+            dependances.append(('effectif',))
+            dependances.extend(('agent', code) for code in agents)
+
+        for jour_date in feries:
+            annee, m = int(jour_date[:4]), int(jour_date[5:7])
+            dependances.extend([('feries', annee), ('feries_mois', annee, m), ('mois', annee, m)])
+
+        dependances.extend(('entite', entite) for entite in entites)
+        self._cache.incrementer(dependances)
+
+    # =========================================================================
+    # STOCKAGE DU PLANNING
+    # =========================================================================
+    #
+    # Deux organisations de la même donnée, choisies par `migrer_stockage_planning` :
+    # - `planning` : une ligne par agent et par jour ;
+    # - `planning_mensuel` (compact) : une ligne par agent et par mois, avec la chaîne
+    #   des shifts et celle des codes d'origine (CODES_ORIGINE), '.' = pas de saisie.
+    # Toutes les lectures et écritures du planning passent par les méthodes ci-dessous.
+
+    _SQL_TABLE_PLANNING = """
+        CREATE TABLE IF NOT EXISTS planning (
+            code_agent TEXT,
+            date TEXT,
+            shift TEXT,
+            origine TEXT,
+            PRIMARY KEY (code_agent, date)
+        )
+    """
+
+    _SQL_TABLE_PLANNING_MENSUEL = """
+        CREATE TABLE IF NOT EXISTS planning_mensuel (
+            code_agent TEXT NOT NULL,
+            mois TEXT NOT NULL,
+            shifts TEXT NOT NULL,
+            origines TEXT NOT NULL,
+            PRIMARY KEY (code_agent, mois)
+        ) WITHOUT ROWID
+    """
+
+    def _table_existe(self, nom):
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (nom,))
+        return self.cursor.fetchone() is not None
+
+    def _lire_planning(self, date_debut=None, date_fin=None, codes=None, origines=None, exclure_origines=None,
+                       archives=True):
+        """Saisies (code, date, shift, origine) enregistrées entre deux dates (bornes incluses, None = illimitée).
+
+        Avec `archives`, les années archivées recoupant la période sont lues aussi ;
+        les lignes de la base principale viennent en dernier.
+        """
+        date_debut, date_fin = date_debut or '0000-01-01', date_fin or '9999-12-31'
+        if codes is not None:
+            codes = list(codes)
+            if not codes:
+                return []
+
+        sources = []
+        if archives:
+            annees = range(int(date_debut[:4]), int(date_fin[:4]) + 1)
+            for schema, stockage in self._attacher_archives(annees):
+                sources.append((schema, stockage == 'compact'))
+        sources.append(('main', self.stockage_compact))
+
+        lignes = []
+        for schema, compact in sources:
+            lignes.extend(self._lire_planning_source(
+                schema, compact, date_debut, date_fin, codes, origines, exclure_origines
+            ))
+        return lignes
+
+    def _lire_planning_source(self, schema, compact, date_debut, date_fin, codes, origines, exclure_origines):
+        """Lecture de `_lire_planning` dans une base (principale ou archive) d'un stockage donné."""
+        conditions, params = [], []
+        if codes is not None:
+            conditions.append(f"code_agent IN ({', '.join('?' * len(codes))})")
+            params.extend(codes)
+
+        if not compact:
+            for filtre, operateur in ((origines, 'IN'), (exclure_origines, 'NOT IN')):
+                if filtre:
+                    conditions.append(f"origine {operateur} ({', '.join('?' * len(filtre))})")
+                    params.extend(filtre)
+            self.cursor.execute(
+                f"SELECT code_agent, date, shift, origine FROM {schema}.planning WHERE date BETWEEN ? AND ?"
+                + ''.join(' AND ' + c for c in conditions),
+                [date_debut, date_fin] + params
+            )
+            return self.cursor.fetchall()
+
+        self.cursor.execute(
+            f"SELECT code_agent, mois, shifts, origines FROM {schema}.planning_mensuel WHERE mois BETWEEN ? AND ?"
+            + ''.join(' AND ' + c for c in conditions),
+            [date_debut[:7], date_fin[:7]] + params
+        )
+        codes_inclus = {CODES_ORIGINE.get(o, o) for o in origines} if origines else None
+        codes_exclus = {CODES_ORIGINE.get(o, o) for o in exclure_origines or ()}
+        lignes = []
+        for code, mois, shifts, codes_origine in self.cursor.fetchall():
+            for i, (shift, code_origine) in enumerate(zip(shifts, codes_origine)):
+                if shift == '.' or code_origine in codes_exclus or (codes_inclus and code_origine not in codes_inclus):
+                    continue
+                jour_date = f"{mois}-{i + 1:02d}"
+                if date_debut <= jour_date <= date_fin:
+                    lignes.append((code, jour_date, shift, ORIGINES_PAR_CODE.get(code_origine, code_origine)))
+        return lignes
+
+    def _modifier_mois_compact(self, cellules, modification):
+        """Applique `modification(shifts, origines, index, valeur)` aux mois compacts touchés par `cellules`.
+
+        `cellules` : liste de ((code, date), valeur) ; les listes du mois sont modifiées en place.
+        """
+        par_mois = {}
+        for (code, jour_date), valeur in cellules:
+            par_mois.setdefault((code, jour_date[:7]), []).append((int(jour_date[8:10]) - 1, valeur))
+
+        ecritures, suppressions = [], []
+        for (code, mois), modifications in par_mois.items():
+            self.cursor.execute(
+                "SELECT shifts, origines FROM planning_mensuel WHERE code_agent=? AND mois=?", (code, mois)
+            )
+            ligne = self.cursor.fetchone()
+            jours_mois = monthrange(int(mois[:4]), int(mois[5:7]))[1]
+            shifts = list(ligne[0]) if ligne else ['.'] * jours_mois
+            origines = list(ligne[1]) if ligne else ['.'] * jours_mois
+            for index, valeur in modifications:
+                modification(shifts, origines, index, valeur)
+            if all(shift == '.' for shift in shifts):
+                if ligne:
+                    suppressions.append((code, mois))
+            else:
+                ecritures.append((code, mois, ''.join(shifts), ''.join(origines)))
+
+        self.cursor.executemany(
+            "INSERT OR REPLACE INTO planning_mensuel (code_agent, mois, shifts, origines) VALUES (?, ?, ?, ?)",
+            ecritures
+        )
+        self.cursor.executemany("DELETE FROM planning_mensuel WHERE code_agent=? AND mois=?", suppressions)
+
+    def _ecrire_planning(self, lignes):
+        """Enregistre (remplace) des saisies (code, date, shift, origine) ; pas de commit."""
+        lignes = list(lignes)
+        if not self.stockage_compact:
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO planning (code_agent, date, shift, origine) VALUES (?, ?, ?, ?)", lignes
+            )
+            return
+
+        def ecrire(shifts, origines, index, valeur):
+            shifts[index], origines[index] = valeur
+        self._modifier_mois_compact(
+            [((code, jour_date), (shift, CODES_ORIGINE.get(origine, '?'))) for code, jour_date, shift, origine in lignes],
+            ecrire
+        )
+
+    def _supprimer_planning(self, cellules, origines=None):
+        """Supprime les saisies des cellules (code, date), seulement celles de `origines` si fourni ; pas de commit."""
+        cellules = list(cellules)
+        if not self.stockage_compact:
+            if origines:
+                filtre = f" AND origine IN ({', '.join('?' * len(origines))})"
+                self.cursor.executemany(
+                    "DELETE FROM planning WHERE code_agent=? AND date=?" + filtre,
+                    [(code, jour_date, *origines) for code, jour_date in cellules]
+                )
+            else:
+                self.cursor.executemany("DELETE FROM planning WHERE code_agent=? AND date=?", cellules)
+            return
+
+        codes_origine = {CODES_ORIGINE.get(o, o) for o in origines} if origines else None
+        def supprimer(shifts, origines_mois, index, _):
+            if codes_origine is None or origines_mois[index] in codes_origine:
+                shifts[index] = origines_mois[index] = '.'
+        self._modifier_mois_compact([(cellule, None) for cellule in cellules], supprimer)
+
+    def migrer_stockage_planning(self, stockage='compact', compacter_fichier=True):
+        """Convertit le planning vers le stockage 'compact' (par agent et par mois) ou 'lignes' (par jour).
+
+        La conversion se fait en une transaction, par lots ; `compacter_fichier` lance
+        ensuite un VACUUM pour rendre l'espace libéré. Les autres connexions ouvertes
+        sur la base doivent être rouvertes après la migration.
+        """
+        if stockage not in ('compact', 'lignes'):
+            return {'erreur': "Stockage inconnu (compact, lignes)."}
+        if self.lecture_seule:
+            return {'erreur': "Base ouverte en lecture seule."}
+        if self.stockage_compact == (stockage == 'compact'):
+            return {'message': f"Le planning utilise déjà le stockage '{stockage}'."}
+
+        lecture = self.conn.cursor()
+        nb_lignes = 0
+        try:
+            if stockage == 'compact':
+                self.cursor.execute(self._SQL_TABLE_PLANNING_MENSUEL)
+                lecture.execute("SELECT code_agent, date, shift, origine FROM planning ORDER BY code_agent, date")
+                lot = []
+                for (code, mois), jours in groupby(lecture, key=lambda ligne: (ligne[0], ligne[1][:7])):
+                    jours_mois = monthrange(int(mois[:4]), int(mois[5:7]))[1]
+                    shifts, origines = ['.'] * jours_mois, ['.'] * jours_mois
+                    for _, jour_date, shift, origine in jours:
+                        index = int(jour_date[8:10]) - 1
+                        shifts[index], origines[index] = shift, CODES_ORIGINE.get(origine, '?')
+                        nb_lignes += 1
+                    lot.append((code, mois, ''.join(shifts), ''.join(origines)))
+                    if len(lot) >= 1000:
+                        self.cursor.executemany("INSERT INTO planning_mensuel VALUES (?, ?, ?, ?)", lot)
+                        lot = []
+                self.cursor.executemany("INSERT INTO planning_mensuel VALUES (?, ?, ?, ?)", lot)
+                self.cursor.execute("DROP TABLE planning")
+            else:
+                self.cursor.execute(self._SQL_TABLE_PLANNING)
+                lecture.execute("SELECT code_agent, mois, shifts, origines FROM planning_mensuel")
+                while True:
+                    mois_lus = lecture.fetchmany(1000)
+                    if not mois_lus:
+                        break
+                    lot = [
+                        (code, f"{mois}-{i + 1:02d}", shift, ORIGINES_PAR_CODE.get(code_origine, code_origine))
+                        for code, mois, shifts, codes_origine in mois_lus
+                        for i, (shift, code_origine) in enumerate(zip(shifts, codes_origine)) if shift != '.'
+                    ]
+                    self.cursor.executemany("INSERT INTO planning VALUES (?, ?, ?, ?)", lot)
+                    nb_lignes += len(lot)
+                self.cursor.execute("DROP TABLE planning_mensuel")
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            return {'erreur': f"Erreur lors de la migration du planning: {e}"}
+
+        self.stockage_compact = stockage == 'compact'
+        if compacter_fichier:
+            self.conn.execute("VACUUM")
+        return {
+            'succes': True,
+            'message': f"Planning migré vers le stockage '{stockage}' ({nb_lignes} saisie(s)).",
+            'saisies': nb_lignes
+        }
+
+    def comparer_stockage_planning(self, mois, annee, repetitions=20):
+        """Compare les deux stockages sur une copie de la base : taille du fichier et lecture d'un mois.
+
+        La base courante n'est pas modifiée ; chaque copie est migrée puis compactée (VACUUM).
+        """
+        _, jours_mois = monthrange(annee, mois)
+        debut, fin = date(annee, mois, 1).isoformat(), date(annee, mois, jours_mois).isoformat()
+        import tempfile
+
+        mesures = {}
+        with tempfile.TemporaryDirectory() as dossier:
+            for stockage in ('lignes', 'compact'):
+                chemin = os.path.join(dossier, f"{stockage}.db")
+                copie = sqlite3.connect(chemin)
+                self.conn.backup(copie)
+                copie.close()
+
+                gestion = type(self)(chemin, taille_cache=0)
+                if gestion.stockage_compact != (stockage == 'compact'):
+                    gestion.migrer_stockage_planning(stockage)
+                else:
+                    gestion.conn.execute("VACUUM")
+                table = 'planning_mensuel' if stockage == 'compact' else 'planning'
+                gestion.cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                nb_lignes = gestion.cursor.fetchone()[0]
+
+                debut_chrono = time.perf_counter()
+                for _ in range(repetitions):
+                    saisies = gestion._lire_planning(debut, fin)
+                duree = (time.perf_counter() - debut_chrono) / repetitions
+                gestion.fermer_connexion()
+
+                mesures[stockage] = {
+                    'lignes_table': nb_lignes,
+                    'saisies_mois': len(saisies),
+                    'octets_fichier': os.path.getsize(chemin),
+                    'lecture_mois_ms': round(duree * 1000, 3)
+                }
+        mesures['ratio_taille'] = round(mesures['lignes']['octets_fichier'] / mesures['compact']['octets_fichier'], 2)
+        return mesures
+
+    # =========================================================================
+    # ARCHIVES ANNUELLES
+    # =========================================================================
+    #
+    # `archiver_annee` déplace une année close du planning, de l'historique radio
+    # (attributions rendues cette année-là) et des avertissements dans un fichier
+    # `<base>_archive_<annee>.db`. Les lectures qui portent sur une année archivée
+    # attachent (ATTACH) son fichier à la demande ; les écritures visent toujours
+    # la base principale.
+
+    # Table archivée -> colonne date qui détermine l'année
+    TABLES_ARCHIVEES = {
+        'historique_radio': 'date_retour',
+        'avertissements': 'date_avertissement',
+    }
+
+    def lister_archives(self):
+        """Retourne {annee: (fichier, stockage du planning)} des années archivées."""
+        if self._archives is None:
+            if self._table_existe('archives'):
+                self.cursor.execute("SELECT annee, fichier, stockage FROM archives")
+                self._archives = {annee: (fichier, stockage) for annee, fichier, stockage in self.cursor.fetchall()}
+            else:
+                self._archives = {}
+        return dict(self._archives)
+
+    def _chemin_archive(self, fichier):
+        return Path(self.db_name).resolve().parent / fichier
+
+    # SQLite limite le nombre de bases attachées (10 par défaut)
+    MAX_ARCHIVES_ATTACHEES = 8
+
+    def _attacher_archives(self, annees=None):
+        """Attache les archives des `annees` (toutes si None) ; retourne [(schéma, stockage)].
+
+        Lève RuntimeError plutôt que de retourner une lecture incomplète : plus de
+        MAX_ARCHIVES_ATTACHEES années demandées, ou archive non attachée alors qu'une
+        transaction est ouverte (SQLite n'autorise pas ATTACH ; voir `_transaction_immediate`).
+        """
+        archives = self.lister_archives()
+        voulues = sorted(archives if annees is None else (a for a in annees if a in archives))
+        if len(voulues) > self.MAX_ARCHIVES_ATTACHEES:
+            raise RuntimeError(
+                f"La période couvre {len(voulues)} années archivées ; au plus {self.MAX_ARCHIVES_ATTACHEES} "
+                "peuvent être lues ensemble. Réduisez la période."
+            )
+        manquantes = [a for a in voulues if a not in self._archives_attachees]
+        if manquantes:
+            if self.conn.in_transaction:
+                raise RuntimeError(
+                    f"Archives {', '.join(map(str, manquantes))} non attachées : ATTACH impossible pendant une transaction."
+                )
+            # On libère les archives qui ne servent pas pour rester sous la limite
+            if len(self._archives_attachees) + len(manquantes) > self.MAX_ARCHIVES_ATTACHEES:
+                for annee in [a for a in self._archives_attachees if a not in voulues]:
+                    self.conn.execute(f"DETACH DATABASE {self._archives_attachees.pop(annee)}")
+            for annee in manquantes:
+                chemin = self._chemin_archive(archives[annee][0])
+                if self.lecture_seule:
+                    self.conn.execute(f"ATTACH DATABASE ? AS archive_{annee}", (chemin.as_uri() + "?mode=ro",))
+                else:
+                    self.conn.execute(f"ATTACH DATABASE ? AS archive_{annee}", (str(chemin),))
+                self._archives_attachees[annee] = f"archive_{annee}"
+        return [(self._archives_attachees[a], archives[a][1]) for a in voulues if a in self._archives_attachees]
+
+    def _annee_archivee(self, jour_date):
+        return int(jour_date[:4]) in self.lister_archives()
+
+    def _erreur_annee_archivee(self, date_debut, date_fin=None):
+        """Erreur à retourner si la période touche une année archivée (planning figé), sinon None."""
+        archivees = [a for a in range(int(date_debut[:4]), int((date_fin or date_debut)[:4]) + 1)
+                     if a in self.lister_archives()]
+        if archivees:
+            return {'erreur': f"L'année {archivees[0]} est archivée : son planning ne peut plus être modifié."}
+        return None
+
+    def _source(self, table, date_debut=None, date_fin=None):
+        """Expression FROM couvrant `table` et ses archives pour la période (toutes si non bornée)."""
+        if date_debut is None:
+            annees = None
+        else:
+            annees = range(int(date_debut[:4]), int((date_fin or '9999')[:4]) + 1)
+        schemas = [schema for schema, _ in self._attacher_archives(annees)]
+        if not schemas:
+            return table
+        return "(" + " UNION ALL ".join(f"SELECT * FROM {schema}.{table}" for schema in ['main'] + schemas) + ")"
+
+    def archiver_annee(self, annee, compacter_fichier=True):
+        """Déplace une année close (antérieure à l'année en cours) dans son fichier d'archive."""
+        annee = int(annee)
+        if self.lecture_seule:
+            return {'erreur': "Base ouverte en lecture seule."}
+        if annee >= date.today().year:
+            return {'erreur': f"L'année {annee} n'est pas close."}
+        if annee in self.lister_archives():
+            return {'erreur': f"L'année {annee} est déjà archivée."}
+
+        fichier = f"{Path(self.db_name).stem}_archive_{annee}.db"
+        chemin = self._chemin_archive(fichier)
+        if chemin.exists():
+            return {'erreur': f"Le fichier d'archive {fichier} existe déjà."}
+
+        debut, fin = f"{annee}-01-01", f"{annee}-12-31"
+        if self.stockage_compact:
+            tables = {'planning_mensuel': ("mois BETWEEN ? AND ?", (debut[:7], fin[:7]))}
+        else:
+            tables = {'planning': ("date BETWEEN ? AND ?", (debut, fin))}
+        for table, colonne in self.TABLES_ARCHIVEES.items():
+            tables[table] = (f"{colonne} BETWEEN ? AND ?", (debut, fin))
+
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.conn.execute("ATTACH DATABASE ? AS archive_nouvelle", (str(chemin),))
+        deplacees = {}
+        try:
+            for table, (condition, params) in tables.items():
+                # Même schéma (table et index) que dans la base principale
+                self.cursor.execute(
+                    "SELECT type, sql FROM sqlite_master WHERE tbl_name=? AND sql IS NOT NULL ORDER BY type DESC",
+                    (table,)
+                )
+                for type_objet, sql in self.cursor.fetchall():
+                    prefixe = 'CREATE TABLE ' if type_objet == 'table' else sql[:sql.index('INDEX ') + 6]
+                    self.cursor.execute(sql.replace(prefixe, prefixe + 'archive_nouvelle.', 1))
+                self.cursor.execute(
+                    f"INSERT INTO archive_nouvelle.{table} SELECT * FROM main.{table} WHERE {condition}", params
+                )
+                deplacees[table] = self.cursor.rowcount
+                self.cursor.execute(f"DELETE FROM main.{table} WHERE {condition}", params)
+            self.cursor.execute(
+                "INSERT INTO archives (annee, fichier, stockage, date_archivage) VALUES (?, ?, ?, ?)",
+                (annee, fichier, 'compact' if self.stockage_compact else 'lignes', date.today().isoformat())
+            )
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.conn.execute("DETACH DATABASE archive_nouvelle")
+            chemin.unlink(missing_ok=True)
+            return {'erreur': f"Erreur lors de l'archivage de {annee}: {e}"}
+        self.conn.execute("DETACH DATABASE archive_nouvelle")
+
+        self._archives = None
+        if compacter_fichier:
+            self.conn.execute("VACUUM")
+        return {
+            'succes': True,
+            'message': f"Année {annee} archivée dans '{fichier}'.",
+            'fichier': fichier,
+            'lignes': deplacees
+        }
+
+    # =========================================================================
+    # INVALIDATION DES DONNÉES DÉRIVÉES
+    # =========================================================================
+    #
+    # Les lignes THEORIQUE de `planning` sont dérivées de :
+    #   - la fiche de l'agent (groupe, date d'entrée, date de sortie) ;
+    #   - pour le groupe E, le rang de l'agent dans l'effectif E actif (trié par code).
+    # Elles ne dépendent PAS des jours fériés : un changement de férié n'invalide
+    # que les agrégats en cache (fériés travaillés, CPA, indicateurs 'ferie').
+
+    def _instantane_dependances(self, codes=()):
+        """Capture les entrées de la rotation avant une écriture sur les agents."""
+        codes = list(codes)
+        fiches = {}
+        if codes:
+            marqueurs = ', '.join('?' * len(codes))
+            self.cursor.execute(
+                f"SELECT code, code_groupe, date_entree, date_sortie FROM agents WHERE code IN ({marqueurs})", codes
+            )
+            fiches = {code: (groupe, entree, sortie) for code, groupe, entree, sortie in self.cursor.fetchall()}
+        for code in codes:
+            fiches.setdefault(code, None)
+
+        self.cursor.execute("SELECT code FROM agents WHERE code_groupe='E' AND date_sortie IS NULL ORDER BY code")
+        roster_e = [code for (code,) in self.cursor.fetchall()]
+        return {'fiches': fiches, 'roster_e': roster_e}
+
+    def _propager_modifications_agents(self, instantane):
+        """Recalcule les lignes dérivées touchées depuis `instantane`, dans la transaction courante.
+
+        Seules les plages agent × dates réellement affectées sont recalculées :
+        - changement de groupe : toutes les dates de l'agent ;
+        - changement de date d'entrée/sortie : à partir de la plus ancienne des deux dates ;
+        - changement de rang dans le groupe E : toutes les dates des agents E dont le rang a bougé.
+        Le commit reste à la charge de l'appelant.
+        """
+        avant = instantane['fiches']
+        apres = self._instantane_dependances(avant.keys())
+        cibles = {}
+
+        for code, fiche_avant in avant.items():
+            fiche_apres = apres['fiches'][code]
+            if fiche_avant == fiche_apres:
+                continue
+            if fiche_avant is None or fiche_apres is None or fiche_avant[0] != fiche_apres[0]:
+                cibles[code] = None
+                continue
+            dates_changees = [
+                d for ancien, nouveau in zip(fiche_avant[1:], fiche_apres[1:]) if ancien != nouveau
+                for d in (ancien, nouveau) if d
+            ]
+            cibles[code] = min(dates_changees) if dates_changees else None
+
+        rang_avant = {code: i for i, code in enumerate(instantane['roster_e'])}
+        rang_apres = {code: i for i, code in enumerate(apres['roster_e'])}
+        for code in set(rang_avant) | set(rang_apres):
+            if rang_avant.get(code) != rang_apres.get(code):
+                cibles[code] = None
+
+        resultat = self._recalculer_theorique(cibles)
+        self._invalider_cache(agents=list(cibles) + [c for c in avant if c not in cibles], effectif=True)
+        return resultat
+
+    def _recalculer_theorique(self, cibles):
+        """Recalcule en lot les lignes THEORIQUE des agents ciblés ({code: date_debut ou None}).
+
+        Les lignes dont le shift change sont mises à jour, celles qui ne sont plus
+        planifiées ('-') sont supprimées ; les saisies manuelles ne sont jamais touchées.
+        """
+        if not cibles:
+            return {'recalcules': 0, 'modifies': 0, 'supprimes': 0}
+
+        fiches, index_e = self._charger_contexte_rotation()
+        recalcules = 0
+        mises_a_jour = []
+        suppressions = []
+        for code, jour_date, shift, _ in self._lire_planning(codes=list(cibles), origines=['THEORIQUE'], archives=False):
+            debut = cibles[code]
+            if debut and jour_date < debut:
+                continue
+            recalcules += 1
+            fiche = fiches.get(code)
+            nouveau = self._rotation_theorique(code, fiche, date.fromisoformat(jour_date), index_e) if fiche else '-'
+            if nouveau == '-':
+                suppressions.append((code, jour_date))
+            elif nouveau != shift:
+                mises_a_jour.append((code, jour_date, nouveau, 'THEORIQUE'))
+
+        self._ecrire_planning(mises_a_jour)
+        self._supprimer_planning(suppressions, origines=['THEORIQUE'])
+        return {'recalcules': recalcules, 'modifies': len(mises_a_jour), 'supprimes': len(suppressions)}
+
+    # =========================================================================
+    # JOURNAL DES CHANGEMENTS (SYNCHRONISATION DE LA PWA)
+    # =========================================================================
+    #
+    # Chaque écriture ajoute, dans sa propre transaction, une entrée portant l'état
+    # COMPLET de la ligne touchée (ou sa suppression). Une entrée remplace donc
+    # toutes les précédentes de même (entite, cle) : le journal peut être compacté
+    # sans empêcher un client de reprendre depuis n'importe quel numéro de séquence.
+    #
+    # Planning : clé 'AGENT|AAAA-MM', donnée = chaîne des saisies du mois
+    # ('.' = pas de saisie, le client applique la rotation théorique).
+
+    def _journaliser(self, entite, cle, donnees=None, operation='maj'):
+        """Ajoute une entrée au journal ; à appeler avant le commit de l'écriture."""
+        self.cursor.execute(
+            "INSERT INTO journal_changements (horodatage, entite, operation, cle, donnees) VALUES (?, ?, ?, ?, ?)",
+            (
+                datetime.now().isoformat(timespec='seconds'), entite, operation, cle,
+                json.dumps(donnees, ensure_ascii=False, separators=(',', ':')) if donnees is not None else None
+            )
+        )
+
+    def _journaliser_agent(self, code_agent):
+        """Journalise la fiche courante d'un agent."""
+        self.cursor.execute(
+            "SELECT nom, prenom, code_groupe, date_entree, date_sortie FROM agents WHERE code=?", (code_agent,)
+        )
+        fiche = self.cursor.fetchone()
+        if fiche is None:
+            self._journaliser('agent', code_agent, operation='suppression')
+            return
+        nom, prenom, groupe, date_entree, date_sortie = fiche
+        self._journaliser('agent', code_agent, {
+            'nom': nom, 'prenom': prenom, 'groupe': groupe,
+            'date_entree': date_entree, 'date_sortie': date_sortie
+        })
+
+    def _journaliser_planning(self, code_agent, liste_mois):
+        """Journalise les saisies (hors THEORIQUE) d'un agent pour chaque (annee, mois) touché."""
+        for annee, mois in liste_mois:
+            _, jours_mois = monthrange(annee, mois)
+            saisies = self._lire_planning(
+                date(annee, mois, 1).isoformat(), date(annee, mois, jours_mois).isoformat(),
+                codes=[code_agent], exclure_origines=['THEORIQUE'], archives=False
+            )
+            shifts = ['.'] * jours_mois
+            for _, jour_date, shift, _ in saisies:
+                shifts[int(jour_date[8:10]) - 1] = shift
+            self._journaliser('planning', f"{code_agent}|{annee}-{mois:02d}", {'shifts': ''.join(shifts)})
+
+    def _journaliser_radio(self, id_radio):
+        """Journalise l'état courant d'une radio (statut et agent détenteur)."""
+        self.cursor.execute("""
+            SELECT r.modele, r.statut, h.code_agent
+            FROM radios r
+            LEFT JOIN historique_radio h ON r.id_radio = h.id_radio AND h.date_retour IS NULL
+            WHERE r.id_radio=?
+        """, (id_radio,))
+        radio = self.cursor.fetchone()
+        if radio is None:
+            self._journaliser('radio', id_radio, operation='suppression')
+            return
+        modele, statut, code_agent = radio
+        self._journaliser('radio', id_radio, {'modele': modele, 'statut': statut, 'attribue_a': code_agent})
+
+    def changements_depuis(self, seq=0, limite=500):
+        """Retourne au plus `limite` changements postérieurs à `seq`, du plus ancien au plus récent.
+
+        Le client rejoue les entrées dans l'ordre et repart de 'dernier_seq' ;
+        'suite' indique qu'il reste des changements à récupérer.
+        """
+        self.cursor.execute(
+            "SELECT seq, entite, operation, cle, donnees FROM journal_changements WHERE seq > ? ORDER BY seq LIMIT ?",
+            (seq, limite + 1)
+        )
+        lignes = self.cursor.fetchall()
+        suite = len(lignes) > limite
+        lignes = lignes[:limite]
+
+        changements = []
+        for num_seq, entite, operation, cle, donnees in lignes:
+            changements.append({
+                'seq': num_seq,
+                'entite': entite,
+                'operation': operation,
+                'cle': cle,
+                'donnees': json.loads(donnees) if donnees else None
+            })
+
+        return {
+            'changements': changements,
+            'dernier_seq': lignes[-1][0] if lignes else seq,
+            'suite': suite
+        }
+
+    def synchroniser_cache(self):
+        """Invalide le cache d'après les changements journalisés depuis la dernière synchronisation.
+
+        Utile quand d'autres processus écrivent dans la même base (PWA, superviseurs,
+        tâches planifiées) : seules les versions des données touchées sont incrémentées.
+        """
+        if self._cache is None:
+            return 0
+        with self._cache._verrou:
+            try:
+                dernier = self.dernier_seq_journal()
+            except sqlite3.OperationalError:
+                # Base antérieure au journal (ouverte en lecture seule) : rien à rejouer
+                return 0
+            if self._cache.seq_journal is None:
+                # Cache sans point de départ connu dans le journal : ses entrées ne
+                # peuvent pas être validées, elles sont abandonnées
+                self._cache.vider()
+                self._cache.seq_journal = dernier
+                return 0
+
+            nb_changements = 0
+            while self._cache.seq_journal < dernier:
+                lot = self.changements_depuis(self._cache.seq_journal, limite=1000)
+                self._invalider_cache_depuis_journal(lot['changements'])
+                nb_changements += len(lot['changements'])
+                self._cache.seq_journal = lot['dernier_seq']
+                if not lot['suite']:
+                    break
+            return nb_changements
+
+    def _invalider_cache_depuis_journal(self, changements):
+        """Traduit des entrées du journal en invalidations du cache."""
+        for changement in changements:
+            entite, cle = changement['entite'], changement['cle']
+            if entite == 'planning':
+                code_agent, mois = cle.split('|')
+                self._invalider_cache(agents=[code_agent], mois=[(int(mois[:4]), int(mois[5:7]))])
+            elif entite == 'agent':
+                # Le rang des agents E peut avoir changé : leurs rotations sont aussi invalidées
+                self.cursor.execute("SELECT code FROM agents WHERE code_groupe='E'")
+                agents_e = [code for (code,) in self.cursor.fetchall()]
+                self._invalider_cache(agents=[cle] + agents_e, effectif=True)
+            elif entite == 'jour_ferie':
+                self._invalider_cache(feries=[cle])
+            elif entite != 'conge':
+                # Les congés sont aussi journalisés sous forme de lignes de planning
+                self._invalider_cache(entites=[entite])
+
+    def dernier_seq_journal(self):
+        """Retourne le numéro de séquence du dernier changement journalisé (0 si aucun)."""
+        self.cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM journal_changements")
+        return self.cursor.fetchone()[0]
+
+    @_ecriture_concurrente
+    def compacter_journal(self, jusqua_seq=None):
+        """Supprime les entrées (seq <= jusqua_seq) remplacées par une entrée plus récente de même clé."""
+        if jusqua_seq is None:
+            jusqua_seq = self.dernier_seq_journal()
+        try:
+            self.cursor.execute("""
+                DELETE FROM journal_changements
+                WHERE seq <= ? AND seq NOT IN (
+                    SELECT MAX(seq) FROM journal_changements GROUP BY entite, cle
+                )
+            """, (jusqua_seq,))
+            supprimees = self.cursor.rowcount
+            self.conn.commit()
+            return {
+                'succes': True,
+                'message': f"{supprimees} entrée(s) du journal compactée(s).",
+                'supprimees': supprimees
+            }
+        except Exception as e:
+            return {'erreur': f"Erreur lors du compactage du journal: {e}"}
+
     # =========================================================================
     # IMPORTATION EXCEL CLEANCO - MÉTHODE CORRIGÉE
     # =========================================================================
 
     def importer_agents_excel(self, nom_fichier):
-        """Importe les agents directement depuis un fichier Excel CleanCo - VERSION CORRIGÉE"""
+        """Importe les agents directement depuis un fichier Excel CleanCo - VERSION CORRIGÉE
+
+        Le classeur est lu et validé avant d'ouvrir la transaction d'écriture : les autres
+        écritures ne sont bloquées que pendant l'enregistrement des agents.
+        """
         try:
             if not os.path.exists(nom_fichier):
                 return {'erreur': f"Le fichier '{nom_fichier}' est introuvable.", 'conseil': "Vérifiez le nom du fichier et son emplacement."}
             
             resultats = {'importes': 0, 'ignores': 0, 'erreurs': []}
+            agents_valides = []
             
             # Lecture du fichier Excel avec gestion d'erreurs améliorée
             try:
+                import pandas as pd
                 df = pd.read_excel(nom_fichier)
             except Exception as e:
                 return {'erreur': f"ERREUR LECTURE EXCEL: {e}"}
@@ -170,6 +1409,30 @@ class GestionAgents:
                         resultats['ignores'] += 1
                         continue
                     
+                    agents_valides.append((index, code, nom, prenom, groupe))
+                    
+                except Exception as e:
+                    resultats['erreurs'].append(f"Ligne {index+1}: {str(e)}")
+                    resultats['ignores'] += 1
+                    continue
+            
+            return self._enregistrer_agents_importes(agents_valides, resultats)
+            
+        except PermissionError:
+            return {'erreur': f"Permission refusée pour le fichier '{nom_fichier}'!", 'conseil': "Fermez le fichier Excel s'il est ouvert dans un autre programme."}
+        except Exception as e:
+            return {'erreur': f"ERREUR CRITIQUE lors de l'import Excel: {e}"}
+
+    @_ecriture_concurrente
+    def _enregistrer_agents_importes(self, agents_valides, resultats):
+        """Écrit les agents validés d'un import Excel en une transaction et complète `resultats`."""
+        try:
+            codes_importes = []
+            # Capturer les fiches existantes pour ne recalculer que les rotations modifiées
+            instantane = self._instantane_dependances([code for _, code, _, _, _ in agents_valides])
+            
+            for index, code, nom, prenom, groupe in agents_valides:
+                try:
                     # Vérifier si l'agent existe déjà
                     self.cursor.execute("SELECT code FROM agents WHERE code=?", (code,))
                     existe = self.cursor.fetchone()
@@ -189,19 +1452,21 @@ class GestionAgents:
                         ''', (code, nom, prenom, groupe, DATE_AFFECTATION_BASE))
                     
                     resultats['importes'] += 1
+                    codes_importes.append(code)
                     
                 except Exception as e:
                     resultats['erreurs'].append(f"Ligne {index+1}: {str(e)}")
                     resultats['ignores'] += 1
                     continue
             
-            # Sauvegarder les changements
+            # Recalculer les rotations touchées et sauvegarder les changements
+            self._propager_modifications_agents(instantane)
+            for code in codes_importes:
+                self._journaliser_agent(code)
             self.conn.commit()
             
             return resultats
             
-        except PermissionError:
-            return {'erreur': f"Permission refusée pour le fichier '{nom_fichier}'!", 'conseil': "Fermez le fichier Excel s'il est ouvert dans un autre programme."}
         except Exception as e:
             return {'erreur': f"ERREUR CRITIQUE lors de l'import Excel: {e}"}
 
@@ -228,10 +1493,8 @@ class GestionAgents:
 
     def _cycle_c_diff(self, jour_date: date, code_agent):
         """Définit le cycle E (5/7) avec seulement les shifts 1 et 2."""
-        jour_semaine = jour_date.weekday()
-        
         # Weekend = repos
-        if jour_semaine >= 5: 
+        if jour_date.weekday() >= 5: 
             return 'R'
             
         self.cursor.execute("SELECT code FROM agents WHERE code_groupe='E' AND date_sortie IS NULL ORDER BY code")
@@ -242,6 +1505,14 @@ class GestionAgents:
         except ValueError:
             return 'R'
 
+        return self._cycle_e(jour_date, index_agent)
+
+    def _cycle_e(self, jour_date: date, index_agent):
+        """Shift du cycle E pour l'agent de rang `index_agent` dans le groupe E actif (None = hors effectif)."""
+        jour_semaine = jour_date.weekday()
+        if jour_semaine >= 5 or index_agent is None:
+            return 'R'
+
         num_semaine = jour_date.isocalendar()[1]
         jour_pair = (jour_semaine % 2 == 0)
         
@@ -271,11 +1542,40 @@ class GestionAgents:
             return '-'
 
         code_groupe, date_entree_str, date_sortie_str = agent_info
-        
-        if date_sortie_str and jour_date >= date.fromisoformat(date_sortie_str):
+        fiche = (
+            code_groupe,
+            date.fromisoformat(date_entree_str),
+            date.fromisoformat(date_sortie_str) if date_sortie_str else None
+        )
+        return self._rotation_theorique(code_agent, fiche, jour_date)
+
+    def _charger_contexte_rotation(self):
+        """Précharge les fiches des agents et les rangs du groupe E (rotation sans requête par cellule)."""
+        self.cursor.execute("SELECT code, code_groupe, date_entree, date_sortie FROM agents")
+        fiches = {}
+        for code, code_groupe, date_entree_str, date_sortie_str in self.cursor.fetchall():
+            if not date_entree_str:
+                continue
+            fiches[code] = (
+                code_groupe,
+                date.fromisoformat(date_entree_str),
+                date.fromisoformat(date_sortie_str) if date_sortie_str else None
+            )
+
+        self.cursor.execute("SELECT code FROM agents WHERE code_groupe='E' AND date_sortie IS NULL ORDER BY code")
+        index_e = {code: i for i, (code,) in enumerate(self.cursor.fetchall())}
+        return fiches, index_e
+
+    def _rotation_theorique(self, code_agent, fiche, jour_date: date, index_e=None):
+        """Calcule le shift de rotation à partir d'une fiche (groupe, entrée, sortie).
+
+        `index_e` (rangs du groupe E) évite la requête sur l'effectif E quand il est préchargé.
+        """
+        code_groupe, date_entree, date_sortie = fiche
+
+        if date_sortie and jour_date >= date_sortie:
              return '-' 
         
-        date_entree = date.fromisoformat(date_entree_str)
         if jour_date < date_entree:
              return '-' 
         
@@ -283,7 +1583,9 @@ class GestionAgents:
         jour_cycle_base = delta_jours
 
         if code_groupe == 'E':
-            return self._cycle_c_diff(jour_date, code_agent)
+            if index_e is None:
+                return self._cycle_c_diff(jour_date, code_agent)
+            return self._cycle_e(jour_date, index_e.get(code_agent))
         
         elif code_groupe in ['A', 'B', 'C', 'D']:
             decalage = self._get_decalage_standard(code_groupe)
@@ -297,6 +1599,7 @@ class GestionAgents:
     # GESTION DES CONGÉS PAR PÉRIODE
     # =========================================================================
 
+    @_ecriture_concurrente
     def ajouter_conge_periode(self, code_agent, date_debut, date_fin):
         """Ajoute un congé sur une période donnée, les dimanches restent en repos."""
         code_agent = code_agent.upper()
@@ -312,6 +1615,9 @@ class GestionAgents:
             
             if date_debut_obj > date_fin_obj:
                 return {'erreur': "La date de début doit être avant la date de fin."}
+            erreur = self._erreur_annee_archivee(date_debut, date_fin)
+            if erreur:
+                return erreur
 
             # Enregistrer la période de congé
             date_creation = date.today().isoformat()
@@ -323,6 +1629,7 @@ class GestionAgents:
             # Appliquer les congés jour par jour
             current_date = date_debut_obj
             jours_conges = 0
+            saisies = []
             
             while current_date <= date_fin_obj:
                 jour_date_str = current_date.isoformat()
@@ -330,21 +1637,21 @@ class GestionAgents:
                 # Vérifier si c'est un dimanche (weekday() = 6)
                 if current_date.weekday() == 6:
                     # Dimanche = repos forcé
-                    self.cursor.execute(
-                        "INSERT OR REPLACE INTO planning (code_agent, date, shift, origine) VALUES (?, ?, ?, 'CONGE_DIMANCHE')",
-                        (code_agent, jour_date_str, 'R')
-                    )
+                    saisies.append((code_agent, jour_date_str, 'R', 'CONGE_DIMANCHE'))
                 else:
                     # Jour de semaine = congé
-                    self.cursor.execute(
-                        "INSERT OR REPLACE INTO planning (code_agent, date, shift, origine) VALUES (?, ?, ?, 'CONGE_PERIODE')",
-                        (code_agent, jour_date_str, 'C')
-                    )
+                    saisies.append((code_agent, jour_date_str, 'C', 'CONGE_PERIODE'))
                     jours_conges += 1
                 
                 current_date += timedelta(days=1)
+            self._ecrire_planning(saisies)
 
+            self._journaliser('conge', f"{code_agent}|{date_debut}|{date_fin}", {
+                'code_agent': code_agent, 'debut': date_debut, 'fin': date_fin, 'creation': date_creation
+            })
+            self._journaliser_planning(code_agent, self._mois_periode(date_debut, date_fin))
             self.conn.commit()
+            self._invalider_cache(agents=[code_agent], mois=self._mois_periode(date_debut, date_fin))
             return {
                 'succes': True,
                 'message': f"Congé enregistré pour {code_agent} du {date_debut} au {date_fin}",
@@ -355,6 +1662,7 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'ajout du congé: {e}"}
 
+    @_ecriture_concurrente
     def supprimer_conge_periode(self, code_agent, date_debut, date_fin):
         """Supprime un congé sur une période donnée et rétablit le planning théorique."""
         code_agent = code_agent.upper()
@@ -372,26 +1680,20 @@ class GestionAgents:
             # Supprimer les shifts de congé dans la période
             current_date = date_debut_obj
             jours_supprimes = 0
+            cellules = []
             
             while current_date <= date_fin_obj:
-                jour_date_str = current_date.isoformat()
-                
-                # Supprimer les enregistrements de congé
-                self.cursor.execute(
-                    "DELETE FROM planning WHERE code_agent=? AND date=? AND origine IN ('CONGE_PERIODE', 'CONGE_DIMANCHE')",
-                    (code_agent, jour_date_str)
-                )
-                
-                # Supprimer aussi le shift théorique pour forcer le recalcul
-                self.cursor.execute(
-                    "DELETE FROM planning WHERE code_agent=? AND date=? AND origine='THEORIQUE'",
-                    (code_agent, jour_date_str)
-                )
-                
+                cellules.append((code_agent, current_date.isoformat()))
                 jours_supprimes += 1
                 current_date += timedelta(days=1)
 
+            # Enregistrements de congé, et shifts théoriques pour forcer le recalcul
+            self._supprimer_planning(cellules, origines=['CONGE_PERIODE', 'CONGE_DIMANCHE', 'THEORIQUE'])
+
+            self._journaliser('conge', f"{code_agent}|{date_debut}|{date_fin}", operation='suppression')
+            self._journaliser_planning(code_agent, self._mois_periode(date_debut, date_fin))
             self.conn.commit()
+            self._invalider_cache(agents=[code_agent], mois=self._mois_periode(date_debut, date_fin))
             return {
                 'succes': True,
                 'message': f"Congé supprimé pour {code_agent} du {date_debut} au {date_fin}",
@@ -432,6 +1734,7 @@ class GestionAgents:
     # GESTION DES AGENTS (AVEC DATE FIXE)
     # =========================================================================
 
+    @_ecriture_concurrente
     def ajouter_agent(self, code, nom, prenom, code_groupe):
         """Ajoute un nouvel agent à la base de données avec une date d'entrée fixe."""
         code = code.upper()
@@ -443,10 +1746,13 @@ class GestionAgents:
              return {'erreur': "Code de groupe invalide. Utilisez A, B, C, D ou E."}
              
         try:
+            instantane = self._instantane_dependances([code])
             self.cursor.execute(
                 "INSERT OR REPLACE INTO agents (code, nom, prenom, code_groupe, date_entree, date_sortie) VALUES (?, ?, ?, ?, ?, NULL)",
                 (code, nom, prenom, code_groupe, date_entree)
             )
+            self._propager_modifications_agents(instantane)
+            self._journaliser_agent(code)
             self.conn.commit()
             return {
                 'succes': True,
@@ -457,6 +1763,7 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'ajout de l'agent {code}: {e}"}
 
+    @_ecriture_concurrente
     def modifier_agent(self, code_agent, nom, prenom, code_groupe, date_entree):
         """Modifie les informations d'un agent existant."""
         code_agent = code_agent.upper()
@@ -476,19 +1783,21 @@ class GestionAgents:
             return {'erreur': "Nouveau code de groupe invalide. Modification annulée."}
             
         try:
+            instantane = self._instantane_dependances([code_agent])
             self.cursor.execute(
                 """UPDATE agents SET nom=?, prenom=?, code_groupe=?, date_entree=? 
                    WHERE code=?""",
                 (nom_new, prenom_new, code_groupe_new, date_entree_new, code_agent)
             )
+            recalcul = self._propager_modifications_agents(instantane)
+            self._journaliser_agent(code_agent)
             self.conn.commit()
             
             if code_groupe_new != agent_info[2] or date_entree_new != agent_info[3]:
-                 self.cursor.execute("DELETE FROM planning WHERE code_agent=? AND origine='THEORIQUE'", (code_agent,))
-                 self.conn.commit()
                  return {
                      'succes': True,
-                     'message': f"Agent {code_agent} modifié avec succès. Planning théorique effacé pour forcer la regénération."
+                     'message': f"Agent {code_agent} modifié avec succès. Planning théorique recalculé ({recalcul['modifies']} jour(s) modifié(s)).",
+                     'recalcul': recalcul
                  }
             else:
                 return {
@@ -499,11 +1808,13 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de la modification de l'agent: {e}"}
 
+    @_ecriture_concurrente
     def supprimer_agent(self, code_agent):
         """Marque un agent comme sorti (date_sortie)."""
         code_agent = code_agent.upper()
         try:
             date_sortie = date.today().isoformat()
+            instantane = self._instantane_dependances([code_agent])
             self.cursor.execute(
                 "UPDATE agents SET date_sortie = ? WHERE code = ? AND date_sortie IS NULL",
                 (date_sortie, code_agent)
@@ -511,10 +1822,15 @@ class GestionAgents:
             
             if self.cursor.rowcount > 0:
                 date_debut_suppression = (date.today() + timedelta(days=1)).isoformat()
-                self.cursor.execute(
-                    "DELETE FROM planning WHERE code_agent = ? AND date >= ?",
-                    (code_agent, date_debut_suppression)
-                )
+                futur = self._lire_planning(date_debut_suppression, codes=[code_agent], archives=False)
+                mois_saisis = sorted({
+                    (int(jour_date[:4]), int(jour_date[5:7])) for _, jour_date, _, origine in futur
+                    if origine != 'THEORIQUE'
+                })
+                self._supprimer_planning([(code, jour_date) for code, jour_date, _, _ in futur])
+                self._propager_modifications_agents(instantane)
+                self._journaliser_agent(code_agent)
+                self._journaliser_planning(code_agent, mois_saisis)
                 self.conn.commit()
                 return {
                     'succes': True,
@@ -544,22 +1860,24 @@ class GestionAgents:
         return {'agents': liste_agents}
 
     def importer_agents_csv(self, nom_fichier):
-        """Importe les agents à partir d'un fichier CSV."""
+        """Importe les agents à partir d'un fichier CSV.
+
+        Le fichier est lu entièrement avant la première écriture : aucune transaction
+        n'est ouverte pendant sa lecture.
+        """
         try:
             with open(nom_fichier, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                agents_importes = 0
-                for row in reader:
-                    code = row.get('code', '').upper()
-                    nom = row.get('nom', '')
-                    prenom = row.get('prenom', '')
-                    code_groupe = row.get('code_groupe', '').upper()
-                    date_entree = row.get('date_entree', DATE_AFFECTATION_BASE) 
-                    
-                    if code and nom and code_groupe:
-                        result = self.ajouter_agent(code, nom, prenom, code_groupe)
-                        if result.get('succes', False):
-                            agents_importes += 1
+                lignes = [
+                    ((row.get('code') or '').upper(), row.get('nom') or '', row.get('prenom') or '',
+                     (row.get('code_groupe') or '').upper())
+                    for row in csv.DictReader(f)
+                ]
+            agents_importes = 0
+            for code, nom, prenom, code_groupe in lignes:
+                if code and nom and code_groupe:
+                    result = self.ajouter_agent(code, nom, prenom, code_groupe)
+                    if result.get('succes', False):
+                        agents_importes += 1
             return {
                 'succes': True,
                 'message': f"{agents_importes} agent(s) importé(s) ou mis(s) à jour avec succès."
@@ -599,76 +1917,196 @@ class GestionAgents:
     def _get_shift_effectif(self, code_agent, jour_date: str):
         """Récupère le shift enregistré ou calcule le shift théorique, et l'enregistre."""
         
-        self.cursor.execute("SELECT shift FROM planning WHERE code_agent=? AND date=?", (code_agent, jour_date))
-        result = self.cursor.fetchone()
+        result = self._lire_planning(jour_date, jour_date, codes=[code_agent])
         
         if result:
-            return result[0]
+            return result[-1][2]
 
         # Si pas d'enregistrement manuel, on calcule le théorique
         date_obj = date.fromisoformat(jour_date)
         shift_theorique = self._get_shift_theorique_rotation(code_agent, date_obj) 
         
-        if shift_theorique == '-':
-             return '-' 
-             
-        self.cursor.execute(
-            "INSERT OR REPLACE INTO planning (code_agent, date, shift, origine) VALUES (?, ?, ?, 'THEORIQUE')",
-            (code_agent, jour_date, shift_theorique)
-        )
-        self.conn.commit()
+        # Rien n'est enregistré dans une année archivée (close)
+        if shift_theorique == '-' or self.lecture_seule or self._annee_archivee(jour_date):
+             return shift_theorique
+
+        # Relecture sous verrou : une saisie écrite entre-temps par un autre processus
+        # ne doit pas être remplacée par la ligne théorique
+        proprietaire = not self.conn.in_transaction
+        try:
+            with self._transaction_immediate():
+                result = self._lire_planning(jour_date, jour_date, codes=[code_agent], archives=False)
+                if result:
+                    return result[-1][2]
+                self._ecrire_planning([(code_agent, jour_date, shift_theorique, 'THEORIQUE')])
+                if proprietaire:
+                    self.conn.commit()
+        except sqlite3.OperationalError as e:
+            # Base occupée : la valeur théorique reste exacte, elle sera enregistrée plus tard
+            if not _base_verrouillee(e):
+                raise
         return shift_theorique
 
-    def obtenir_planning_mensuel(self, mois, annee):
-        """Retourne le planning mensuel global sous forme de données structurées."""
+    def _rotation_theorique_periode(self, code_agent, fiche, date_debut: date, nb_jours, index_e):
+        """Chaîne des shifts théoriques d'un agent sur `nb_jours` à partir de `date_debut`."""
+        code_groupe, date_entree, date_sortie = fiche
+
+        if code_groupe in ['A', 'B', 'C', 'D']:
+            # Cycle de 8 jours : découpage d'une répétition du motif au bon décalage
+            depart = ((date_debut - date_entree).days + self._get_decalage_standard(code_groupe)) % 8
+            motif = ''.join(self._cycle_standard_8j(i) for i in range(8))
+            shifts = (motif * (nb_jours // 8 + 2))[depart:depart + nb_jours]
+        elif code_groupe == 'E':
+            rang = index_e.get(code_agent)
+            shifts = ''.join(self._cycle_e(date_debut + timedelta(days=i), rang) for i in range(nb_jours))
+        else:
+            shifts = 'R' * nb_jours
+
+        # Hors affectation : avant la date d'entrée et à partir de la date de sortie
+        avant_entree = min(max((date_entree - date_debut).days, 0), nb_jours)
+        apres_sortie = nb_jours
+        if date_sortie:
+            apres_sortie = min(max((date_sortie - date_debut).days, 0), nb_jours)
+        apres_sortie = max(apres_sortie, avant_entree)
+        return '-' * avant_entree + shifts[avant_entree:apres_sortie] + '-' * (nb_jours - apres_sortie)
+
+    def _shifts_periode(self, date_debut, date_fin, codes=None):
+        """Calcule les shifts effectifs de plusieurs agents sur une période, sans rien écrire.
+
+        Retourne {code: chaîne d'un caractère par jour}. Les lignes enregistrées priment
+        sur la rotation théorique comme dans `_get_shift_effectif`, mais une seule
+        requête et un calcul en mémoire remplacent les requêtes jour par jour.
+        Par défaut : agents actifs triés par groupe puis code.
+        """
+        debut = date.fromisoformat(date_debut)
+        nb_jours = (date.fromisoformat(date_fin) - debut).days + 1
+        if nb_jours <= 0:
+            return {}
+
+        fiches, index_e = self._charger_contexte_rotation()
+        if codes is None:
+            self.cursor.execute("SELECT code FROM agents WHERE date_sortie IS NULL ORDER BY code_groupe, code")
+            codes = [code for (code,) in self.cursor.fetchall()]
+
+        matrice = {}
+        for code in codes:
+            fiche = fiches.get(code)
+            shifts = self._rotation_theorique_periode(code, fiche, debut, nb_jours, index_e) if fiche else '-' * nb_jours
+            matrice[code] = list(shifts)
+
+        # Peu d'agents : lecture ciblée plutôt que tout le planning de la période
+        filtre = list(matrice) if len(matrice) <= 500 else None
+        for code, jour_date, shift, _ in self._lire_planning(date_debut, date_fin, codes=filtre):
+            if code in matrice:
+                matrice[code][(date.fromisoformat(jour_date) - debut).days] = shift
+
+        return {code: ''.join(shifts) for code, shifts in matrice.items()}
+
+    @_ecriture_concurrente
+    def generer_planning(self, date_debut, date_fin, groupes=None):
+        """Enregistre le planning théorique d'une période en une seule transaction.
+
+        Seules les cellules vides reçoivent une ligne THEORIQUE : les saisies existantes
+        (manuelles, absences, échanges, congés ou théoriques déjà figées) sont conservées.
+        Les jours hors affectation et les années archivées ne sont pas écrits.
+        """
+        if self.lecture_seule:
+            return {'erreur': "Base ouverte en lecture seule."}
+        try:
+            debut = date.fromisoformat(date_debut)
+            nb_jours = (date.fromisoformat(date_fin) - debut).days + 1
+        except (TypeError, ValueError):
+            return {'erreur': "Format de date invalide. Utilisez AAAA-MM-JJ."}
+        if nb_jours <= 0:
+            return {'erreur': "La date de fin doit être postérieure ou égale à la date de début."}
+
+        fiches, index_e = self._charger_contexte_rotation()
+        if groupes:
+            groupes = [g.upper() for g in groupes]
+            codes = [code for code, fiche in fiches.items() if fiche[0] in groupes]
+        else:
+            codes = list(fiches)
+        if not codes:
+            return {'erreur': "Aucun agent trouvé pour ces groupes."}
+
+        jours = [(debut + timedelta(days=i)).isoformat() for i in range(nb_jours)]
+        annees_archivees = {annee for annee in {jour[:4] for jour in jours} if self._annee_archivee(f"{annee}-01-01")}
+        existantes = {(code, jour_date) for code, jour_date, _, _ in
+                      self._lire_planning(date_debut, date_fin, codes=codes, archives=False)}
+
+        lignes = []
+        for code in codes:
+            shifts = self._rotation_theorique_periode(code, fiches[code], debut, nb_jours, index_e)
+            for jour_date, shift in zip(jours, shifts):
+                if shift != '-' and jour_date[:4] not in annees_archivees and (code, jour_date) not in existantes:
+                    lignes.append((code, jour_date, shift, 'THEORIQUE'))
+
+        try:
+            self._ecrire_planning(lignes)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return {'erreur': f"Erreur lors de l'enregistrement du planning: {e}"}
+
+        return {
+            'succes': True,
+            'message': f"{len(lignes)} cellule(s) théorique(s) enregistrée(s) pour {len(codes)} agent(s), "
+                       f"{len(existantes)} saisie(s) existante(s) conservée(s).",
+            'agents': len(codes),
+            'jours': nb_jours,
+            'cellules_ecrites': len(lignes),
+            'cellules_conservees': len(existantes),
+            'annees_archivees_ignorees': sorted(int(a) for a in annees_archivees)
+        }
+
+    def _colonnes_jours_mois(self, mois, annee):
+        """Colonnes 'numero', 'date', 'jour_semaine', 'ferie' des jours d'un mois."""
         _, jours_mois = monthrange(annee, mois)
-        
+        jours = [date(annee, mois, i) for i in range(1, jours_mois + 1)]
+        return {
+            'numero': [jour.day for jour in jours],
+            'date': [jour.isoformat() for jour in jours],
+            'jour_semaine': [JOURS_FRANCAIS[jour.strftime('%a')] for jour in jours],
+            'ferie': [self._est_jour_ferie(jour.isoformat()) for jour in jours]
+        }
+
+    @_format_resultat
+    @_mise_en_cache(_dependances_mois)
+    @_colonnes_natives
+    def obtenir_planning_mensuel(self, mois, annee, format_resultat='lignes'):
+        """Retourne le planning mensuel global sous forme de données structurées."""
         self.cursor.execute("SELECT code, nom, prenom, code_groupe FROM agents WHERE date_sortie IS NULL ORDER BY code_groupe, code")
         agents_info = self.cursor.fetchall()
         
         if not agents_info:
-            return {'erreur': 'Aucun agent actif trouvé.'}
-        
-        # Préparer les données
-        planning_data = []
-        jours_info = []
-        
-        # Informations sur les jours
-        for i in range(1, jours_mois + 1):
-            jour_date_obj = date(annee, mois, i)
-            jour_date_str = jour_date_obj.isoformat()
-            jours_info.append({
-                'numero': i,
-                'date': jour_date_str,
-                'jour_semaine': JOURS_FRANCAIS[jour_date_obj.strftime('%a')],
-                'ferie': self._est_jour_ferie(jour_date_str)
-            })
-        
-        # Données par agent
-        for code, nom, prenom, groupe in agents_info:
-            agent_row = {
-                'code': code,
-                'nom_complet': f"{nom} {prenom}",
-                'groupe': groupe,
-                'shifts': []
-            }
-            
-            for i in range(1, jours_mois + 1):
-                jour_date = date(annee, mois, i).isoformat()
-                shift = self._get_shift_effectif(code, jour_date)
-                agent_row['shifts'].append(shift)
-            
-            planning_data.append(agent_row)
+            return {'erreur': 'Aucun agent actif trouvé.'}
+        
+        # Informations sur les jours
+        jours_info = self._colonnes_jours_mois(mois, annee)
+        
+        # Données par agent, assemblées en colonnes
+        agents = {
+            'code': [code for code, _, _, _ in agents_info],
+            'nom_complet': [f"{nom} {prenom}" for _, nom, prenom, _ in agents_info],
+            'groupe': [groupe for _, _, _, groupe in agents_info],
+            'shifts': [
+                [self._get_shift_effectif(code, jour_date) for jour_date in jours_info['date']]
+                for code, _, _, _ in agents_info
+            ]
+        }
         
         return {
             'mois': mois,
             'annee': annee,
-            'jours': jours_info,
-            'agents': planning_data,
+            'jours': _lignes_ou_colonnes(jours_info, format_resultat),
+            'agents': _lignes_ou_colonnes(agents, format_resultat),
             'total_agents': len(agents_info)
         }
 
-    def obtenir_planning_groupe(self, code_groupe, mois, annee):
+    @_format_resultat
+    @_mise_en_cache(_dependances_groupe_mois)
+    @_colonnes_natives
+    def obtenir_planning_groupe(self, code_groupe, mois, annee, format_resultat='lignes'):
         """Retourne le planning d'un groupe spécifique."""
         code_groupe = code_groupe.upper()
         
@@ -678,45 +2116,28 @@ class GestionAgents:
         if not agents_info:
             return {'erreur': f"Aucun agent actif trouvé dans le groupe {code_groupe}."}
 
-        _, jours_mois = monthrange(annee, mois)
-        
-        # Préparer les données
-        planning_data = []
-        jours_info = []
-        
-        for i in range(1, jours_mois + 1):
-            jour_date_obj = date(annee, mois, i)
-            jour_date_str = jour_date_obj.isoformat()
-            jours_info.append({
-                'numero': i,
-                'date': jour_date_str,
-                'jour_semaine': JOURS_FRANCAIS[jour_date_obj.strftime('%a')],
-                'ferie': self._est_jour_ferie(jour_date_str)
-            })
+        jours_info = self._colonnes_jours_mois(mois, annee)
         
-        for code, nom, prenom in agents_info:
-            agent_row = {
-                'code': code,
-                'nom_complet': f"{nom} {prenom}",
-                'shifts': []
-            }
-            
-            for i in range(1, jours_mois + 1):
-                jour_date = date(annee, mois, i).isoformat()
-                shift = self._get_shift_effectif(code, jour_date)
-                agent_row['shifts'].append(shift)
-            
-            planning_data.append(agent_row)
+        agents = {
+            'code': [code for code, _, _ in agents_info],
+            'nom_complet': [f"{nom} {prenom}" for _, nom, prenom in agents_info],
+            'shifts': [
+                [self._get_shift_effectif(code, jour_date) for jour_date in jours_info['date']]
+                for code, _, _ in agents_info
+            ]
+        }
             
         return {
             'groupe': code_groupe,
             'mois': mois,
             'annee': annee,
-            'jours': jours_info,
-            'agents': planning_data,
+            'jours': _lignes_ou_colonnes(jours_info, format_resultat),
+            'agents': _lignes_ou_colonnes(agents, format_resultat),
             'total_agents': len(agents_info)
         }
 
+    @_format_resultat
+    @_mise_en_cache(_dependances_agent_mois)
     def obtenir_planning_agent(self, code_agent, mois, annee):
         """Retourne le planning d'un agent spécifique."""
         code_agent = code_agent.upper()
@@ -759,6 +2180,7 @@ class GestionAgents:
             'statistiques': stats_data.get('statistiques', []) if 'statistiques' in stats_data else []
         }
 
+    @_format_resultat
     def obtenir_planning_trimestriel(self, mois_debut, annee):
         """Retourne le planning trimestriel (3 mois)."""
         resultats = []
@@ -790,21 +2212,10 @@ class GestionAgents:
 
         for i in range(1, jours_mois + 1):
             jour_date_str = date(annee, mois, i).isoformat()
-            self._get_shift_effectif(code_agent, jour_date_str)
-
-        date_debut = date(annee, mois, 1).isoformat()
-        date_fin = date(annee, mois, jours_mois).isoformat()
-        
-        self.cursor.execute("""
-            SELECT shift, date FROM planning 
-            WHERE code_agent=? AND date BETWEEN ? AND ?
-        """, (code_agent, date_debut, date_fin))
-        
-        planning_records = self.cursor.fetchall()
+            shift_effectif = self._get_shift_effectif(code_agent, jour_date_str)
 
-        for shift_effectif, jour_date_str in planning_records:
-            
-            if shift_effectif in stats:
+            # Les jours hors affectation ('-') ne sont pas comptabilisés
+            if shift_effectif != '-' and shift_effectif in stats:
                 stats[shift_effectif] += 1
                 
                 if shift_effectif in ['1', '2', '3']:
@@ -843,6 +2254,8 @@ class GestionAgents:
 
         return stats_globales, total_feries_global, total_shifts_global, total_operationnels_global
 
+    @_format_resultat
+    @_mise_en_cache(_dependances_agent_mois)
     def obtenir_statistiques_agent(self, code_agent, mois, annee):
         """Retourne les statistiques d'un agent sous forme structurée."""
         code_agent = code_agent.upper()
@@ -887,6 +2300,8 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f'Erreur de calcul: {str(e)}'}
 
+    @_format_resultat
+    @_mise_en_cache(_dependances_mois)
     def obtenir_statistiques_globales(self, mois, annee):
         """Retourne les statistiques globales sous forme structurée."""
         try:
@@ -926,10 +2341,508 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f'Erreur de calcul: {str(e)}'}
 
+    # =========================================================================
+    # INDEX CUMULATIF DES STATISTIQUES (PÉRIODES QUELCONQUES)
+    # =========================================================================
+    #
+    # Pour chaque année et chaque agent, un tableau numpy (jours + 1) × COLONNES_CUMULS
+    # contient les totaux cumulés depuis le 1er janvier : ligne j = comptes des j premiers
+    # jours. Les comptes d'une période [debut, fin] d'une même année valent donc
+    # cumuls[fin + 1] - cumuls[debut] : deux lectures par agent, quelle que soit la durée.
+    # L'index est construit à la demande ; seules les lignes touchées sont recalculées.
+    # Chaque ligne retient les versions du cache dont elle dépend (fiches, mois de l'agent,
+    # fériés de l'année) : des instances partageant un même cache (PoolConnexions) voient
+    # donc les écritures synchronisées par l'une d'elles. Sans cache, `_invalider_cache`
+    # marque les lignes périmées et le journal est relu par l'index lui-même.
+
+    COLONNES_CUMULS = ('1', '2', '3', 'R', 'C', 'M', 'A', '-', 'F')  # F = férié travaillé
+
+    def _invalider_index_cumuls(self, agents=(), mois=(), effectif=False, feries=()):
+        """Marque périmées les lignes de l'index touchées par une écriture."""
+        agents = list(agents)
+        annees = {annee for annee, _ in mois}
+        for jour_date in feries:
+            self._index_cumuls.pop(int(jour_date[:4]), None)
+        if (annees or effectif) and not agents:
+            # Écriture sans liste d'agents : tout l'index des années concernées est à refaire
+            for annee in (list(self._index_cumuls) if effectif else annees):
+                self._index_cumuls.pop(annee, None)
+            return
+        for annee, index in self._index_cumuls.items():
+            if effectif or annee in annees:
+                index['perimes'].update(code for code in agents if code in index['lignes'])
+
+    def _synchroniser_index_cumuls(self):
+        """Prend en compte les écritures des autres processus avant de lire l'index."""
+        if self._cache is not None:
+            self.synchroniser_cache()
+            return
+        dernier = self.dernier_seq_journal()
+        if self._seq_index_cumuls is None:
+            self._seq_index_cumuls = dernier
+            self._index_cumuls.clear()
+            return
+        while self._seq_index_cumuls < dernier:
+            lot = self.changements_depuis(self._seq_index_cumuls, limite=1000)
+            self._invalider_cache_depuis_journal(lot['changements'])
+            self._seq_index_cumuls = lot['dernier_seq']
+            if not lot['suite']:
+                break
+
+    def _versions_index_cumuls(self, annee, code):
+        """Versions du cache dont dépend la ligne d'un agent pour une année (None sans cache)."""
+        if self._cache is None:
+            return None
+        return (self._cache.version(('effectif',)),) + tuple(
+            self._cache.version(('mois_agent', annee, mois, code)) for mois in range(1, 13)
+        )
+
+    def _index_cumuls_annee(self, annee, codes):
+        """Index cumulatif de l'année, complété ou rafraîchi pour les agents `codes`."""
+        import numpy as np
+
+        index = self._index_cumuls.get(annee)
+        version_feries = self._cache.version(('feries', annee)) if self._cache is not None else None
+        if index is not None and index['version_feries'] != version_feries:
+            index = None
+        if index is None:
+            debut, fin = f"{annee}-01-01", f"{annee}-12-31"
+            jours = [(date(annee, 1, 1) + timedelta(days=i)).isoformat() for i in range(date(annee, 12, 31).timetuple().tm_yday)]
+            feries = self._dates_feries(debut, fin)
+            index = self._index_cumuls[annee] = {
+                'lignes': {},
+                'cumuls': np.zeros((0, len(jours) + 1, len(self.COLONNES_CUMULS)), dtype=np.int16),
+                'feries': np.array([jour in feries for jour in jours]),
+                'version_feries': version_feries,
+                'versions': {},
+                'perimes': set()
+            }
+
+        versions = {code: self._versions_index_cumuls(annee, code) for code in codes}
+        a_calculer = [code for code in codes if code not in index['lignes'] or code in index['perimes']
+                      or index['versions'][code] != versions[code]]
+        if not a_calculer:
+            return index
+
+        shifts = self._shifts_periode(f"{annee}-01-01", f"{annee}-12-31", codes=a_calculer)
+        grille = np.frombuffer(
+            ''.join(shifts[code] for code in a_calculer).encode('ascii', 'replace'), dtype=np.uint8
+        ).reshape(len(a_calculer), -1)
+        comptes = np.empty(grille.shape + (len(self.COLONNES_CUMULS),), dtype=np.int16)
+        for k, colonne in enumerate(self.COLONNES_CUMULS[:-1]):
+            comptes[:, :, k] = grille == ord(colonne)
+        comptes[:, :, -1] = np.isin(grille, np.frombuffer(b'123', dtype=np.uint8)) & index['feries']
+        cumuls = np.zeros((len(a_calculer), grille.shape[1] + 1, len(self.COLONNES_CUMULS)), dtype=np.int16)
+        np.cumsum(comptes, axis=1, out=cumuls[:, 1:])
+
+        nouveaux = [code for code in a_calculer if code not in index['lignes']]
+        if nouveaux:
+            premiere = len(index['lignes'])
+            index['lignes'].update((code, premiere + i) for i, code in enumerate(nouveaux))
+            index['cumuls'] = np.concatenate([index['cumuls'], np.zeros((len(nouveaux),) + cumuls.shape[1:], dtype=np.int16)])
+        index['cumuls'][[index['lignes'][code] for code in a_calculer]] = cumuls
+        index['versions'].update((code, versions[code]) for code in a_calculer)
+        index['perimes'].difference_update(a_calculer)
+        return index
+
+    @_format_resultat
+    @_colonnes_natives
+    def statistiques_periode(self, date_debut, date_fin, codes=None, groupe=None, format_resultat='lignes'):
+        """Comptes de shifts, fériés travaillés et CPA de chaque agent entre deux dates incluses.
+
+        Mêmes règles que les statistiques mensuelles (CPA = shifts 1/2/3 + fériés travaillés,
+        sans les fériés pour le groupe E), mais pour une période quelconque, lue dans
+        l'index cumulatif. Par défaut : agents actifs (d'un groupe si `groupe`).
+        """
+        import numpy as np
+
+        try:
+            debut, fin = date.fromisoformat(date_debut), date.fromisoformat(date_fin)
+        except (TypeError, ValueError):
+            return {'erreur': "Format de date invalide. Utilisez AAAA-MM-JJ."}
+        if fin < debut:
+            return {'erreur': "La date de fin doit être postérieure ou égale à la date de début."}
+
+        if codes is None:
+            requete = "SELECT code, code_groupe FROM agents WHERE date_sortie IS NULL"
+            params = []
+            if groupe:
+                requete += " AND code_groupe=?"
+                params.append(groupe.upper())
+            self.cursor.execute(requete + " ORDER BY code_groupe, code", params)
+        else:
+            codes = [code.upper() for code in codes]
+            self.cursor.execute(
+                f"SELECT code, code_groupe FROM agents WHERE code IN ({', '.join('?' * len(codes))}) ORDER BY code_groupe, code",
+                codes
+            )
+        agents = self.cursor.fetchall()
+        if not agents:
+            return {'erreur': "Aucun agent trouvé."}
+        codes = [code for code, _ in agents]
+
+        self._synchroniser_index_cumuls()
+        totaux = np.zeros((len(codes), len(self.COLONNES_CUMULS)), dtype=np.int64)
+        for annee in range(debut.year, fin.year + 1):
+            index = self._index_cumuls_annee(annee, codes)
+            lignes = [index['lignes'][code] for code in codes]
+            i_debut = (max(debut, date(annee, 1, 1)) - date(annee, 1, 1)).days
+            i_fin = (min(fin, date(annee, 12, 31)) - date(annee, 1, 1)).days + 1
+            totaux += index['cumuls'][lignes, i_fin] - index['cumuls'][lignes, i_debut]
+
+        par_agent = {cle: [] for cle in ('code', 'groupe', 'shifts', 'feries_travailles', 'total_shifts', 'cpa')}
+        total = dict.fromkeys(self.COLONNES_CUMULS[:-1], 0)
+        total.update(feries_travailles=0, total_shifts=0, cpa=0)
+        for (code, code_groupe), ligne in zip(agents, totaux.tolist()):
+            comptes = dict(zip(self.COLONNES_CUMULS[:-1], ligne[:-1]))
+            total_shifts = comptes['1'] + comptes['2'] + comptes['3']
+            feries_travailles = ligne[-1]
+            cpa = total_shifts if code_groupe == 'E' else total_shifts + feries_travailles
+            par_agent['code'].append(code)
+            par_agent['groupe'].append(code_groupe)
+            par_agent['shifts'].append(comptes)
+            par_agent['feries_travailles'].append(feries_travailles)
+            par_agent['total_shifts'].append(total_shifts)
+            par_agent['cpa'].append(cpa)
+            for cle, valeur in comptes.items():
+                total[cle] += valeur
+            total['feries_travailles'] += feries_travailles
+            total['total_shifts'] += total_shifts
+            total['cpa'] += cpa
+
+        return {
+            'periode': {'debut': date_debut, 'fin': date_fin, 'nb_jours': (fin - debut).days + 1},
+            'agents': _lignes_ou_colonnes(par_agent, format_resultat),
+            'total': total
+        }
+
+    # =========================================================================
+    # EXPORT COMPACT DU PLANNING (TÉLÉCHARGEMENT EN MASSE PAR LA PWA)
+    # =========================================================================
+
+    def exporter_planning_compact(self, date_debut, date_fin, codes=None):
+        """Retourne le planning de tous les agents sur une période au format compact.
+
+        - axe des jours partagé : 'debut', 'nb_jours', 'mois' (AAAA-MM et nombre de jours couverts) ;
+        - 'feries' : masque hexadécimal des jours fériés (bit i = i-ème jour) ;
+        - colonnes agents : 'codes', 'noms', 'groupes' (un caractère par agent) ;
+        - 'shifts' : pour chaque agent, une chaîne par mois couvert (un caractère par jour).
+        Voir `developper_planning_compact` pour revenir à la structure détaillée.
+        """
+        try:
+            debut = date.fromisoformat(date_debut)
+            fin = date.fromisoformat(date_fin)
+        except ValueError as e:
+            return {'erreur': f"Date invalide: {e}"}
+        if debut > fin:
+            return {'erreur': "La date de début doit être avant la date de fin."}
+
+        shifts_agents = self._shifts_periode(date_debut, date_fin, codes)
+        if not shifts_agents:
+            return {'erreur': 'Aucun agent actif trouvé.'}
+
+        # Découpage de l'axe des jours par mois
+        segments = []
+        for annee, mois in self._mois_periode(date_debut, date_fin):
+            premier = max(debut, date(annee, mois, 1))
+            dernier = min(fin, date(annee, mois, monthrange(annee, mois)[1]))
+            segments.append((f"{annee}-{mois:02d}", (premier - debut).days, (dernier - premier).days + 1))
+
+        feries = self._dates_feries(date_debut, date_fin)
+        masque_feries = 0
+        for jour_date in feries:
+            masque_feries |= 1 << (date.fromisoformat(jour_date) - debut).days
+
+        marqueurs = ', '.join('?' * len(shifts_agents))
+        self.cursor.execute(
+            f"SELECT code, nom, prenom, code_groupe FROM agents WHERE code IN ({marqueurs})", list(shifts_agents)
+        )
+        fiches = {code: (f"{nom} {prenom}", groupe) for code, nom, prenom, groupe in self.cursor.fetchall()}
+
+        return {
+            'format': FORMAT_PLANNING_COMPACT,
+            'debut': date_debut,
+            'nb_jours': (fin - debut).days + 1,
+            'mois': [[mois, nb] for mois, _, nb in segments],
+            'feries': format(masque_feries, 'x'),
+            'codes': list(shifts_agents),
+            'noms': [fiches[code][0] for code in shifts_agents],
+            'groupes': ''.join(fiches[code][1] for code in shifts_agents),
+            'shifts': [
+                [shifts[depart:depart + nb] for _, depart, nb in segments]
+                for shifts in shifts_agents.values()
+            ]
+        }
+
+    def comparer_planning_compact(self, date_debut, date_fin):
+        """Compare taille et latence du format compact avec les plannings mensuels détaillés.
+
+        Les plannings détaillés sont recalculés sans passer par le cache des lectures.
+        """
+        import inspect
+        obtenir_mensuel = inspect.unwrap(type(self).obtenir_planning_mensuel)
+
+        debut_chrono = time.perf_counter()
+        detaille = [obtenir_mensuel(self, mois, annee) for annee, mois in self._mois_periode(date_debut, date_fin)]
+        duree_detaille = time.perf_counter() - debut_chrono
+        json_detaille = json.dumps(detaille, ensure_ascii=False).encode('utf-8')
+
+        debut_chrono = time.perf_counter()
+        compact = self.exporter_planning_compact(date_debut, date_fin)
+        duree_compact = time.perf_counter() - debut_chrono
+        if 'erreur' in compact:
+            return compact
+
+        mesures = {
+            'detaille': {
+                'octets_json': len(json_detaille),
+                'octets_gzip': len(gzip.compress(json_detaille)),
+                'duree_ms': round(duree_detaille * 1000, 1)
+            },
+            'compact': {'duree_ms': round(duree_compact * 1000, 1)}
+        }
+        for compression in (None, 'gzip', 'zstd'):
+            try:
+                debut_chrono = time.perf_counter()
+                donnees = encoder_planning_compact(compact, compression)
+                duree_encodage = time.perf_counter() - debut_chrono
+                debut_chrono = time.perf_counter()
+                decoder_planning_compact(donnees)
+                duree_decodage = time.perf_counter() - debut_chrono
+            except ValueError:
+                continue
+            mesures['compact'][compression or 'json'] = {
+                'octets': len(donnees),
+                'encodage_ms': round(duree_encodage * 1000, 2),
+                'decodage_ms': round(duree_decodage * 1000, 2)
+            }
+
+        mesures['ratio_json'] = round(len(json_detaille) / mesures['compact']['json']['octets'], 1)
+        return mesures
+
+    # =========================================================================
+    # COUVERTURE DES SHIFTS
+    # =========================================================================
+
+    def obtenir_couverture(self, date_debut, date_fin, par_groupe=False, minimums=None, minimums_groupes=None):
+        """Effectif par jour et par shift (1/2/3) sur une période, avec détection de sous-couverture.
+
+        Les shifts effectifs (congés, maladies et échanges compris) sont lus en une passe
+        par `_shifts_periode`, puis comptés d'un bloc avec numpy.
+        `minimums` : {shift: effectif} pour le total (MINIMUMS_COUVERTURE_DEFAUT par défaut) ;
+        `minimums_groupes` : {groupe: {shift: effectif}}, vérifié avec `par_groupe`.
+        """
+        import numpy as np
+
+        try:
+            debut = date.fromisoformat(date_debut)
+            nb_jours = (date.fromisoformat(date_fin) - debut).days + 1
+        except ValueError as e:
+            return {'erreur': f"Date invalide: {e}"}
+        if nb_jours <= 0:
+            return {'erreur': "La date de début doit être avant la date de fin."}
+
+        # Agents affectés pendant la période, y compris ceux sortis depuis : la couverture
+        # d'une période passée ne dépend pas de l'effectif actuel
+        self.cursor.execute(
+            "SELECT code, code_groupe FROM agents "
+            "WHERE date_entree <= ? AND (date_sortie IS NULL OR date_sortie > ?) ORDER BY code_groupe, code",
+            (date_fin, date_debut)
+        )
+        groupes_agents = dict(self.cursor.fetchall())
+        if not groupes_agents:
+            return {'erreur': 'Aucun agent affecté sur la période.'}
+        shifts = self._shifts_periode(date_debut, date_fin, codes=list(groupes_agents))
+
+        codes = list(shifts)
+        grille = np.frombuffer(
+            ''.join(shifts[code] for code in codes).encode('ascii', 'replace'), dtype=np.uint8
+        ).reshape(len(codes), nb_jours)
+        valeurs_shifts = np.frombuffer(b'123', dtype=np.uint8)
+        valeurs_absences = np.frombuffer(SHIFTS_ABSENCE.encode('ascii'), dtype=np.uint8)
+
+        def compter(lignes):
+            # (jours × shifts) et absences par jour pour un sous-ensemble d'agents
+            bloc = grille[lignes]
+            matrice = (bloc[:, :, None] == valeurs_shifts).sum(axis=0)
+            absences = np.isin(bloc, valeurs_absences).sum(axis=0)
+            return matrice, absences
+
+        jours = [(debut + timedelta(days=i)).isoformat() for i in range(nb_jours)]
+        sous_couverture = []
+
+        def verifier(matrice, minimums_shift, groupe):
+            seuils = np.array([minimums_shift.get(s, 0) for s in '123'])
+            for i_jour, i_shift in zip(*np.nonzero(matrice < seuils)):
+                sous_couverture.append({
+                    'date': jours[i_jour],
+                    'groupe': groupe,
+                    'shift': '123'[i_shift],
+                    'effectif': int(matrice[i_jour, i_shift]),
+                    'minimum': int(seuils[i_shift])
+                })
+
+        matrice, absences = compter(slice(None))
+        verifier(matrice, MINIMUMS_COUVERTURE_DEFAUT if minimums is None else minimums, None)
+        resultat = {
+            'periode': {'debut': date_debut, 'fin': date_fin, 'nb_jours': nb_jours},
+            'jours': jours,
+            'shifts': ['1', '2', '3'],
+            'matrice': matrice.tolist(),
+            'absences': absences.tolist(),
+            'effectif': len(codes)
+        }
+
+        if par_groupe:
+            colonne_groupes = np.array([groupes_agents.get(code) or '' for code in codes])
+            resultat['groupes'] = {}
+            for groupe in sorted(set(colonne_groupes.tolist())):
+                matrice_groupe, absences_groupe = compter(colonne_groupes == groupe)
+                resultat['groupes'][groupe] = {
+                    'matrice': matrice_groupe.tolist(),
+                    'absences': absences_groupe.tolist(),
+                    'effectif': int((colonne_groupes == groupe).sum())
+                }
+                if minimums_groupes and groupe in minimums_groupes:
+                    verifier(matrice_groupe, minimums_groupes[groupe], groupe)
+
+        sous_couverture.sort(key=lambda alerte: (alerte['date'], alerte['groupe'] or '', alerte['shift']))
+        resultat['sous_couverture'] = sous_couverture
+        return resultat
+
+    # =========================================================================
+    # VALIDATION DU PLANNING (REPOS ET FATIGUE)
+    # =========================================================================
+
+    @staticmethod
+    def _suites(masque):
+        """Encodage par plages des valeurs vraies de chaque ligne : (lignes, débuts, longueurs)."""
+        import numpy as np
+
+        borde = np.zeros((masque.shape[0], masque.shape[1] + 2), dtype=np.int8)
+        borde[:, 1:-1] = masque
+        variations = np.diff(borde, axis=1)
+        lignes, debuts = np.nonzero(variations == 1)
+        _, fins = np.nonzero(variations == -1)
+        return lignes, debuts, fins - debuts
+
+    def _violations_grille(self, shifts, debut: date, regles):
+        """Violations des règles sur {code: chaîne de shifts} commençant à `debut`, en une passe numpy."""
+        import numpy as np
+
+        codes = list(shifts)
+        if not codes:
+            return []
+        nb_jours = len(shifts[codes[0]])
+        grille = np.frombuffer(
+            ''.join(shifts[code] for code in codes).encode('ascii', 'replace'), dtype=np.uint8
+        ).reshape(len(codes), nb_jours)
+        travail = np.isin(grille, np.frombuffer(b'123', dtype=np.uint8))
+        jour = lambda i: (debut + timedelta(days=int(i))).isoformat()
+        violations = []
+
+        for (avant, apres) in sorted(regles.get('transitions_interdites') or ()):
+            masque = (grille[:, :-1] == ord(avant)) & (grille[:, 1:] == ord(apres))
+            for ligne, i in zip(*np.nonzero(masque)):
+                violations.append({
+                    'code_agent': codes[ligne], 'regle': 'transition_interdite',
+                    'debut': jour(i), 'fin': jour(i + 1), 'detail': f"{avant} puis {apres}"
+                })
+
+        for regle, masque, maximum in (
+            ('jours_consecutifs', travail, regles.get('max_jours_consecutifs')),
+            ('nuits_consecutives', grille == ord('3'), regles.get('max_nuits_consecutives')),
+        ):
+            if maximum is None:
+                continue
+            lignes, debuts, longueurs = self._suites(masque)
+            for k in np.nonzero(longueurs > maximum)[0]:
+                violations.append({
+                    'code_agent': codes[lignes[k]], 'regle': regle,
+                    'debut': jour(debuts[k]), 'fin': jour(debuts[k] + longueurs[k] - 1),
+                    'detail': f"{int(longueurs[k])} > {maximum}"
+                })
+
+        repos_min = regles.get('repos_hebdomadaire')
+        premier_lundi = (7 - debut.weekday()) % 7
+        nb_semaines = (nb_jours - premier_lundi) // 7
+        if repos_min and nb_semaines > 0:
+            # Semaines ISO complètes et entièrement planifiées seulement
+            fenetre = slice(premier_lundi, premier_lundi + nb_semaines * 7)
+            repos = (~travail[:, fenetre]).reshape(len(codes), nb_semaines, 7).sum(axis=2)
+            planifie = (grille[:, fenetre] != ord('-')).reshape(len(codes), nb_semaines, 7).all(axis=2)
+            for ligne, semaine in zip(*np.nonzero(planifie & (repos < repos_min))):
+                lundi = premier_lundi + semaine * 7
+                violations.append({
+                    'code_agent': codes[ligne], 'regle': 'repos_hebdomadaire',
+                    'debut': jour(lundi), 'fin': jour(lundi + 6),
+                    'detail': f"{int(repos[ligne, semaine])} < {repos_min}"
+                })
+        return violations
+
+    def _marge_validation(self, regles):
+        """Jours lus de part et d'autre d'une période pour juger les suites qui la chevauchent."""
+        return max(regles.get('max_jours_consecutifs') or 0, regles.get('max_nuits_consecutives') or 0, 7) + 1
+
+    def valider_planning(self, date_debut, date_fin, codes=None, regles=None, modifications=None):
+        """Vérifie les règles de repos et de fatigue sur une période, pour tous les agents actifs.
+
+        `regles` surcharge REGLES_PLANNING_DEFAUT. `modifications` ({(code, date): shift})
+        est appliqué aux shifts effectifs avant la vérification, sans rien écrire.
+        Seules les violations qui recoupent la période sont retournées.
+        """
+        regles = {**REGLES_PLANNING_DEFAUT, **(regles or {})}
+        try:
+            debut = date.fromisoformat(date_debut)
+            fin = date.fromisoformat(date_fin)
+            jours_modifies = {jour_date: date.fromisoformat(jour_date) for _, jour_date in (modifications or {})}
+        except (TypeError, ValueError) as e:
+            return {'erreur': f"Date invalide: {e}"}
+        if fin < debut:
+            return {'erreur': "La date de début doit être avant la date de fin."}
+
+        # La lecture couvre la période, sa marge et toutes les dates modifiées
+        marge = timedelta(days=self._marge_validation(regles))
+        debut_lecture = min([debut, *jours_modifies.values()]) - marge
+        fin_lecture = max([fin, *jours_modifies.values()]) + marge
+        shifts = self._shifts_periode(debut_lecture.isoformat(), fin_lecture.isoformat(), codes)
+        if modifications:
+            grilles = {code: list(chaine) for code, chaine in shifts.items()}
+            for (code, jour_date), shift in modifications.items():
+                if code in grilles:
+                    grilles[code][(jours_modifies[jour_date] - debut_lecture).days] = shift
+            shifts = {code: ''.join(grille) for code, grille in grilles.items()}
+
+        violations = [
+            v for v in self._violations_grille(shifts, debut_lecture, regles)
+            if v['fin'] >= date_debut and v['debut'] <= date_fin
+        ]
+        violations.sort(key=lambda v: (v['debut'], v['code_agent'], v['regle']))
+        par_regle = {}
+        for v in violations:
+            par_regle[v['regle']] = par_regle.get(v['regle'], 0) + 1
+        return {
+            'periode': {'debut': date_debut, 'fin': date_fin},
+            'violations': violations,
+            'nb_violations': len(violations),
+            'par_regle': par_regle
+        }
+
+    def _nouvelles_violations(self, modifications, regles=None):
+        """Violations créées par `modifications` ({(code, date): shift}) : pré-contrôle d'une écriture."""
+        jours = sorted(jour_date for _, jour_date in modifications)
+        codes = sorted({code for code, _ in modifications})
+        avant = self.valider_planning(jours[0], jours[-1], codes, regles)
+        apres = self.valider_planning(jours[0], jours[-1], codes, regles, modifications)
+        cle = lambda v: (v['code_agent'], v['regle'], v['debut'], v['fin'])
+        existantes = {cle(v) for v in avant.get('violations', [])}
+        return [v for v in apres.get('violations', []) if cle(v) not in existantes]
+
     # =========================================================================
     #  TOTAL DES JOURS TRAVAILLÉS
     # =========================================================================
 
+    @_format_resultat
     def obtenir_jours_travailles_groupe(self, code_groupe, mois, annee):
         """Retourne le total des jours travaillés pour un groupe spécifique"""
         code_groupe = code_groupe.upper()
@@ -966,6 +2879,7 @@ class GestionAgents:
             'nombre_agents': len(agents)
         }
 
+    @_format_resultat
     def obtenir_jours_travailles_global(self, mois, annee):
         """Retourne le total des jours travaillés pour tous les groupes"""
         groupes = ['A', 'B', 'C', 'D', 'E']
@@ -1014,6 +2928,7 @@ class GestionAgents:
         
         return jours_travailles
 
+    @_ecriture_concurrente
     def enregistrer_absence(self, code_agent, jour_date: str, shift_code):
         """Enregistre une absence pour un agent (C, M, A)."""
         code_agent = code_agent.upper()
@@ -1024,13 +2939,15 @@ class GestionAgents:
         self.cursor.execute("SELECT code FROM agents WHERE code=? AND date_sortie IS NULL", (code_agent,))
         if not self.cursor.fetchone():
             return {'erreur': f"Agent {code_agent} non trouvé ou inactif."}
+        erreur = self._erreur_annee_archivee(jour_date)
+        if erreur:
+            return erreur
 
         try:
-            self.cursor.execute(
-                "INSERT OR REPLACE INTO planning (code_agent, date, shift, origine) VALUES (?, ?, ?, 'ABSENCE')",
-                (code_agent, jour_date, shift_code)
-            )
+            self._ecrire_planning([(code_agent, jour_date, shift_code, 'ABSENCE')])
+            self._journaliser_planning(code_agent, self._mois_periode(jour_date, jour_date))
             self.conn.commit()
+            self._invalider_cache(agents=[code_agent], mois=self._mois_periode(jour_date, jour_date))
             return {
                 'succes': True,
                 'message': f"Absence ({shift_code}) enregistrée pour {code_agent} le {jour_date}."
@@ -1038,8 +2955,13 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'enregistrement de l'absence: {e}"}
 
-    def modifier_shift_ponctuel(self, code_agent, jour_date: str, nouveau_shift):
-        """Modifie le shift ponctuel d'un agent."""
+    @_ecriture_concurrente
+    def modifier_shift_ponctuel(self, code_agent, jour_date: str, nouveau_shift, verifier_regles=False):
+        """Modifie le shift ponctuel d'un agent.
+
+        Avec `verifier_regles`, la modification est refusée si elle crée une violation
+        des règles de repos (voir `valider_planning`).
+        """
         code_agent = code_agent.upper()
         nouveau_shift = nouveau_shift.upper()
         if nouveau_shift not in ['1', '2', '3', 'R', 'C', 'M', 'A']: 
@@ -1048,13 +2970,20 @@ class GestionAgents:
         self.cursor.execute("SELECT code FROM agents WHERE code=? AND date_sortie IS NULL", (code_agent,))
         if not self.cursor.fetchone():
             return {'erreur': f"Agent {code_agent} non trouvé ou inactif."}
+        erreur = self._erreur_annee_archivee(jour_date)
+        if erreur:
+            return erreur
+
+        if verifier_regles:
+            violations = self._nouvelles_violations({(code_agent, jour_date): nouveau_shift})
+            if violations:
+                return {'erreur': "La modification enfreint les règles de repos.", 'violations': violations}
 
         try:
-            self.cursor.execute(
-                "INSERT OR REPLACE INTO planning (code_agent, date, shift, origine) VALUES (?, ?, ?, 'MANUEL')",
-                (code_agent, jour_date, nouveau_shift)
-            )
+            self._ecrire_planning([(code_agent, jour_date, nouveau_shift, 'MANUEL')])
+            self._journaliser_planning(code_agent, self._mois_periode(jour_date, jour_date))
             self.conn.commit()
+            self._invalider_cache(agents=[code_agent], mois=self._mois_periode(jour_date, jour_date))
             return {
                 'succes': True,
                 'message': f"Shift de {code_agent} modifié en '{nouveau_shift}' pour le {jour_date}."
@@ -1062,17 +2991,102 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de la modification du shift: {e}"}
 
-    def echanger_shifts(self, code_agent_a, code_agent_b, jour_date: str):
-        """Échange les shifts entre deux agents pour un jour donné."""
+    @_mise_en_cache(_dependances_jour_adjacent)
+    def index_shifts_jour(self, jour_date: str):
+        """Index des shifts effectifs des agents actifs autour d'un jour, sans rien écrire.
+
+        'voisinage' : {code: shifts de la veille, du jour et du lendemain} ;
+        'par_shift' : {shift du jour: [codes]}.
+        """
+        jour = date.fromisoformat(jour_date)
+        voisinage = self._shifts_periode(
+            (jour - timedelta(days=1)).isoformat(), (jour + timedelta(days=1)).isoformat()
+        )
+        self.cursor.execute("SELECT code, nom, prenom, code_groupe FROM agents WHERE date_sortie IS NULL")
+        agents = {code: (f"{nom} {prenom}", groupe) for code, nom, prenom, groupe in self.cursor.fetchall()}
+        par_shift = {}
+        for code, shifts in voisinage.items():
+            par_shift.setdefault(shifts[1], []).append(code)
+        return {'date': jour_date, 'voisinage': voisinage, 'par_shift': par_shift, 'agents': agents}
+
+    def candidats_echange(self, code_agent, jour_date: str, groupe=None, meme_groupe=False, limite=10):
+        """Agents avec qui `code_agent` peut échanger son shift du `jour_date`, classés.
+
+        Sont exclus : les agents non planifiés, absents ou en congé ce jour, ceux qui ont déjà
+        le même shift, et les échanges créant un enchaînement interdit (TRANSITIONS_INTERDITES)
+        avec la veille ou le lendemain, pour l'un ou l'autre agent. Classement : même groupe
+        d'abord, puis agents en service avant agents au repos.
+        """
+        code_agent = code_agent.upper()
+        try:
+            index = self.index_shifts_jour(jour_date)
+        except ValueError as e:
+            return {'erreur': f"Date invalide: {e}"}
+
+        voisinage = index['voisinage']
+        if code_agent not in voisinage:
+            return {'erreur': f"Agent {code_agent} introuvable ou inactif."}
+        veille_a, shift_a, lendemain_a = voisinage[code_agent]
+        if shift_a == '-':
+            return {'erreur': f"L'agent {code_agent} n'est pas planifié le {jour_date}."}
+        groupe_a = index['agents'][code_agent][1]
+        if meme_groupe:
+            groupe = groupe_a
+
+        def enchainement_interdit(veille, shift, lendemain):
+            return (veille, shift) in TRANSITIONS_INTERDITES or (shift, lendemain) in TRANSITIONS_INTERDITES
+
+        candidats = []
+        for shift_b, codes in index['par_shift'].items():
+            if shift_b in (shift_a, '-') or shift_b in SHIFTS_ABSENCE:
+                continue
+            # Le nouveau shift de l'agent demandeur ne dépend que de shift_b
+            if enchainement_interdit(veille_a, shift_b, lendemain_a):
+                continue
+            for code_b in codes:
+                nom_complet, groupe_b = index['agents'][code_b]
+                if groupe and groupe_b != groupe.upper():
+                    continue
+                veille_b, _, lendemain_b = voisinage[code_b]
+                if enchainement_interdit(veille_b, shift_a, lendemain_b):
+                    continue
+                candidats.append({
+                    'code': code_b,
+                    'nom_complet': nom_complet,
+                    'groupe': groupe_b,
+                    'shift': shift_b,
+                    'veille': veille_b,
+                    'lendemain': lendemain_b
+                })
+
+        candidats.sort(key=lambda c: (c['groupe'] != groupe_a, c['shift'] == 'R', c['code']))
+        return {
+            'code_agent': code_agent,
+            'date': jour_date,
+            'shift': shift_a,
+            'candidats': candidats[:limite] if limite else candidats,
+            'total': len(candidats)
+        }
+
+    @_ecriture_concurrente
+    def echanger_shifts(self, code_agent_a, code_agent_b, jour_date: str, verifier_regles=False):
+        """Échange les shifts entre deux agents pour un jour donné.
+
+        Avec `verifier_regles`, l'échange est refusé s'il crée une violation des règles de repos.
+        """
         code_agent_a = code_agent_a.upper()
         code_agent_b = code_agent_b.upper()
         
         self.cursor.execute("SELECT code FROM agents WHERE code=? OR code=?", (code_agent_a, code_agent_b))
         if len(self.cursor.fetchall()) < 2:
             return {'erreur': "Un ou les deux agents sont introuvables/inactifs."}
+        erreur = self._erreur_annee_archivee(jour_date)
+        if erreur:
+            return erreur
 
-        shift_a = self._get_shift_effectif(code_agent_a, jour_date)
-        shift_b = self._get_shift_effectif(code_agent_b, jour_date)
+        # Lecture seule : seules les deux lignes ECHANGE sont écrites
+        shifts = self._shifts_periode(jour_date, jour_date, codes=[code_agent_a, code_agent_b])
+        shift_a, shift_b = shifts[code_agent_a], shifts[code_agent_b]
         
         if shift_a == '-' or shift_b == '-':
             return {'erreur': "L'un des agents n'est pas planifié à cette date."}
@@ -1080,16 +3094,20 @@ class GestionAgents:
         if shift_a == shift_b:
             return {'message': "Les deux agents ont déjà le même shift. Aucun échange nécessaire."}
 
+        if verifier_regles:
+            violations = self._nouvelles_violations({(code_agent_a, jour_date): shift_b, (code_agent_b, jour_date): shift_a})
+            if violations:
+                return {'erreur': "L'échange enfreint les règles de repos.", 'violations': violations}
+
         try:
-            self.cursor.execute(
-                "INSERT OR REPLACE INTO planning (code_agent, date, shift, origine) VALUES (?, ?, ?, 'ECHANGE')",
-                (code_agent_a, jour_date, shift_b)
-            )
-            self.cursor.execute(
-                "INSERT OR REPLACE INTO planning (code_agent, date, shift, origine) VALUES (?, ?, ?, 'ECHANGE')",
-                (code_agent_b, jour_date, shift_a)
-            )
+            self._ecrire_planning([
+                (code_agent_a, jour_date, shift_b, 'ECHANGE'),
+                (code_agent_b, jour_date, shift_a, 'ECHANGE')
+            ])
+            self._journaliser_planning(code_agent_a, self._mois_periode(jour_date, jour_date))
+            self._journaliser_planning(code_agent_b, self._mois_periode(jour_date, jour_date))
             self.conn.commit()
+            self._invalider_cache(agents=[code_agent_a, code_agent_b], mois=self._mois_periode(jour_date, jour_date))
             return {
                 'succes': True,
                 'message': f"Échange de shifts réussi pour le {jour_date}: {code_agent_a} a pris {shift_b} et {code_agent_b} a pris {shift_a}."
@@ -1097,10 +3115,122 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'échange des shifts: {e}"}
 
+    @_ecriture_concurrente
+    def appliquer_modifications_planning(self, operations, verifier_regles=False):
+        """Applique un lot de modifications du planning en une seule transaction.
+
+        `operations` : liste de (type, code_agent, jour_date, valeur) avec type
+        'shift' (valeur 1, 2, 3, R, C, M ou A), 'absence' (C, M ou A) ou 'echange'
+        (valeur = code de l'autre agent). Les opérations s'appliquent dans l'ordre ;
+        si l'une est invalide, rien n'est écrit. Retourne le résultat de chaque opération
+        et les mois touchés ('AAAA-MM').
+        """
+        self.cursor.execute("SELECT code FROM agents WHERE date_sortie IS NULL")
+        agents_actifs = {code for (code,) in self.cursor.fetchall()}
+
+        # Validation des opérations, sans accès à la base
+        resultats, valides = [], []
+        for index, operation in enumerate(operations):
+            try:
+                type_op, code_agent, jour_date, valeur = operation
+                date.fromisoformat(jour_date)
+                if not isinstance(type_op, str) or not isinstance(code_agent, str):
+                    raise TypeError
+            except (TypeError, ValueError):
+                resultats.append({'index': index, 'erreur': "Opération mal formée (type, agent, date, valeur)."})
+                continue
+            type_op, code_agent, valeur = type_op.lower(), code_agent.upper(), str(valeur).upper()
+            erreur = None
+            if type_op not in ('shift', 'absence', 'echange'):
+                erreur = f"Type d'opération inconnu: {type_op}."
+            elif code_agent not in agents_actifs:
+                erreur = f"Agent {code_agent} non trouvé ou inactif."
+            elif type_op == 'shift' and valeur not in ['1', '2', '3', 'R', 'C', 'M', 'A']:
+                erreur = "Shift invalide. Utilisez 1, 2, 3, R, C, M, ou A."
+            elif type_op == 'absence' and valeur not in ['C', 'M', 'A']:
+                erreur = "Type d'absence invalide. Utilisez C (Congé), M (Maladie) ou A (Autre)."
+            elif type_op == 'echange' and (valeur not in agents_actifs or valeur == code_agent):
+                erreur = f"Agent d'échange {valeur} invalide, non trouvé ou inactif."
+            elif self._annee_archivee(jour_date):
+                erreur = self._erreur_annee_archivee(jour_date)['erreur']
+            if erreur:
+                resultats.append({'index': index, 'erreur': erreur})
+            else:
+                resultats.append({'index': index})
+                valides.append((index, type_op, code_agent, jour_date, valeur))
+
+        if len(valides) < len(resultats):
+            return {'erreur': "Opérations invalides : aucune modification appliquée.", 'resultats': resultats}
+        if not valides:
+            return {'message': "Aucune opération à appliquer.", 'resultats': [], 'mois_affectes': []}
+
+        # Shifts effectifs des agents et dates concernés, mis à jour opération par opération
+        jours = sorted({jour_date for _, _, _, jour_date, _ in valides})
+        codes = sorted({code for _, _, code, _, _ in valides} |
+                       {valeur for _, type_op, _, _, valeur in valides if type_op == 'echange'})
+        debut = date.fromisoformat(jours[0])
+        grilles = self._shifts_periode(jours[0], jours[-1], codes)
+        etat = {}
+        def shift_actuel(code, jour_date):
+            if (code, jour_date) in etat:
+                return etat[(code, jour_date)][0]
+            return grilles[code][(date.fromisoformat(jour_date) - debut).days]
+
+        for index, type_op, code_agent, jour_date, valeur in valides:
+            resultat = resultats[index]
+            if type_op == 'echange':
+                shift_a, shift_b = shift_actuel(code_agent, jour_date), shift_actuel(valeur, jour_date)
+                if shift_a == '-' or shift_b == '-':
+                    resultat['erreur'] = "L'un des agents n'est pas planifié à cette date."
+                elif shift_a == shift_b:
+                    resultat['message'] = "Les deux agents ont déjà le même shift. Aucun échange nécessaire."
+                else:
+                    etat[(code_agent, jour_date)] = (shift_b, 'ECHANGE')
+                    etat[(valeur, jour_date)] = (shift_a, 'ECHANGE')
+                    resultat['succes'] = True
+                    resultat['message'] = f"{code_agent} prend {shift_b} et {valeur} prend {shift_a} le {jour_date}."
+            else:
+                etat[(code_agent, jour_date)] = (valeur, 'MANUEL' if type_op == 'shift' else 'ABSENCE')
+                resultat['succes'] = True
+                resultat['message'] = f"{code_agent} : '{valeur}' le {jour_date}."
+
+        if any('erreur' in resultat for resultat in resultats):
+            return {'erreur': "Opérations invalides : aucune modification appliquée.", 'resultats': resultats}
+
+        if verifier_regles and etat:
+            violations = self._nouvelles_violations({cle: shift for cle, (shift, _) in etat.items()})
+            if violations:
+                return {'erreur': "Le lot enfreint les règles de repos.", 'resultats': resultats,
+                        'violations': violations}
+
+        mois_par_agent = {}
+        for code, jour_date in etat:
+            mois_par_agent.setdefault(code, set()).add((int(jour_date[:4]), int(jour_date[5:7])))
+        mois_affectes = sorted(set().union(*mois_par_agent.values())) if etat else []
+        try:
+            self._ecrire_planning(
+                [(code, jour_date, shift, origine) for (code, jour_date), (shift, origine) in etat.items()]
+            )
+            for code, mois_agent in mois_par_agent.items():
+                self._journaliser_planning(code, sorted(mois_agent))
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            return {'erreur': f"Erreur lors de l'application des modifications: {e}", 'resultats': resultats}
+
+        self._invalider_cache(agents=list(mois_par_agent), mois=mois_affectes)
+        return {
+            'succes': True,
+            'message': f"{len(valides)} opération(s) appliquée(s), {len(etat)} jour(s) modifié(s).",
+            'resultats': resultats,
+            'mois_affectes': [f"{annee}-{mois:02d}" for annee, mois in mois_affectes]
+        }
+
     # =========================================================================
     # GESTION JOURS FÉRIÉS AUTOMATIQUE MAROC
     # =========================================================================
 
+    @_ecriture_concurrente
     def ajouter_jour_ferie(self, jour_date: str, description):
         """Ajoute un jour férié manuellement."""
         try:
@@ -1108,7 +3238,9 @@ class GestionAgents:
                 "INSERT OR REPLACE INTO jours_feries (date, description) VALUES (?, ?)",
                 (jour_date, description)
             )
+            self._journaliser('jour_ferie', jour_date, {'description': description})
             self.conn.commit()
+            self._recalculer_planning_apres_changement_ferie(jour_date)
             return {
                 'succes': True,
                 'message': f"Jour férié '{description}' ajouté le {jour_date}."
@@ -1116,16 +3248,18 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'ajout du jour férié: {e}"}
 
+    @_ecriture_concurrente
     def supprimer_jour_ferie(self, jour_date: str):
         """Supprime un jour férié."""
         try:
             self.cursor.execute("DELETE FROM jours_feries WHERE date=?", (jour_date,))
             if self.cursor.rowcount > 0:
+                self._journaliser('jour_ferie', jour_date, operation='suppression')
                 self.conn.commit()
                 self._recalculer_planning_apres_changement_ferie(jour_date)
                 return {
                     'succes': True,
-                    'message': f"Jour férié du {jour_date} supprimé et planning théorique recalculé."
+                    'message': f"Jour férié du {jour_date} supprimé et statistiques recalculées."
                 }
             else:
                 return {'message': f"Aucun jour férié trouvé à cette date: {jour_date}."}
@@ -1133,12 +3267,22 @@ class GestionAgents:
             return {'erreur': f"Erreur lors de la suppression du jour férié: {e}"}
 
     def _recalculer_planning_apres_changement_ferie(self, jour_date_str):
-        """Efface les shifts théoriques pour un jour donné pour forcer la regénération."""
-        try:
-            self.cursor.execute("DELETE FROM planning WHERE date = ? AND origine = 'THEORIQUE'", (jour_date_str,))
-            self.conn.commit()
-        except Exception:
-            pass
+        """Invalide les agrégats dépendant d'un jour férié (la rotation théorique n'en dépend pas)."""
+        self._invalider_cache(feries=[jour_date_str])
+
+    def _dates_feries(self, date_debut, date_fin):
+        """Retourne l'ensemble des jours fériés (automatiques + manuels) d'une période, en une requête."""
+        self.cursor.execute("SELECT date FROM jours_feries WHERE date BETWEEN ? AND ?", (date_debut, date_fin))
+        feries = {jour_date for (jour_date,) in self.cursor.fetchall()}
+
+        jour = date.fromisoformat(date_debut)
+        fin = date.fromisoformat(date_fin)
+        while jour <= fin:
+            jour_date = jour.isoformat()
+            if self._est_jour_ferie_maroc(jour_date):
+                feries.add(jour_date)
+            jour += timedelta(days=1)
+        return feries
 
     def _est_jour_ferie(self, jour_date: str):
         """Vérifie si une date est un jour férié (automatique Maroc + manuel)."""
@@ -1174,6 +3318,7 @@ class GestionAgents:
         
         return (mois, jour) in jours_feries_fixes
 
+    @_mise_en_cache(_dependances_feries)
     def obtenir_jours_feries(self, annee):
         """Retourne tous les jours fériés (automatiques + manuels) pour une année donnée."""
         from datetime import date
@@ -1220,6 +3365,7 @@ class GestionAgents:
     # GESTION DES CODES PANIQUE
     # =========================================================================
 
+    @_ecriture_concurrente
     def ajouter_modifier_code_panique(self, code_agent, code_panique, poste_nom):
         """Ajoute ou modifie le code panique pour un agent."""
         code_agent = code_agent.upper()
@@ -1228,7 +3374,9 @@ class GestionAgents:
                 "INSERT OR REPLACE INTO codes_panique (code_agent, code_panique, poste_nom) VALUES (?, ?, ?)",
                 (code_agent, code_panique, poste_nom)
             )
+            self._journaliser('code_panique', code_agent, {'code_panique': code_panique, 'poste_nom': poste_nom})
             self.conn.commit()
+            self._invalider_cache(entites=['code_panique'])
             return {
                 'succes': True,
                 'message': f"Code panique pour {code_agent} mis à jour : {code_panique} ({poste_nom})."
@@ -1258,13 +3406,16 @@ class GestionAgents:
         
         return {'codes': liste_codes}
 
+    @_ecriture_concurrente
     def supprimer_code_panique(self, code_agent):
         """Supprime le code panique d'un agent."""
         code_agent = code_agent.upper()
         try:
             self.cursor.execute("DELETE FROM codes_panique WHERE code_agent=?", (code_agent,))
             if self.cursor.rowcount > 0:
+                self._journaliser('code_panique', code_agent, operation='suppression')
                 self.conn.commit()
+                self._invalider_cache(entites=['code_panique'])
                 return {
                     'succes': True,
                     'message': f"Code panique de {code_agent} supprimé."
@@ -1278,6 +3429,7 @@ class GestionAgents:
     # GESTION DU MATÉRIEL RADIO
     # =========================================================================
 
+    @_ecriture_concurrente
     def ajouter_modifier_radio(self, id_radio, modele, statut):
         """Ajoute ou modifie une radio."""
         id_radio = id_radio.upper()
@@ -1290,7 +3442,9 @@ class GestionAgents:
                 "INSERT OR REPLACE INTO radios (id_radio, modele, statut) VALUES (?, ?, ?)",
                 (id_radio, modele, statut)
             )
+            self._journaliser_radio(id_radio)
             self.conn.commit()
+            self._invalider_cache(entites=['radio'])
             return {
                 'succes': True,
                 'message': f"Radio {id_radio} ({modele}) mise à jour. Statut: {statut}."
@@ -1298,6 +3452,7 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'ajout/modification de la radio: {e}"}
 
+    @_ecriture_concurrente
     def attribuer_radio(self, id_radio, code_agent):
         """Attribue une radio à un agent."""
         id_radio = id_radio.upper()
@@ -1319,7 +3474,9 @@ class GestionAgents:
                 "INSERT INTO historique_radio (id_radio, code_agent, date_attribution, date_retour) VALUES (?, ?, ?, NULL)",
                 (id_radio, code_agent, date_attribution)
             )
+            self._journaliser_radio(id_radio)
             self.conn.commit()
+            self._invalider_cache(entites=['radio'])
             return {
                 'succes': True,
                 'message': f"Radio {id_radio} attribuée à l'agent {code_agent} le {date_attribution}."
@@ -1327,6 +3484,7 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'attribution de la radio: {e}"}
 
+    @_ecriture_concurrente
     def enregistrer_retour_radio(self, id_radio):
         """Enregistre le retour d'une radio et la marque comme DISPONIBLE."""
         id_radio = id_radio.upper()
@@ -1348,7 +3506,9 @@ class GestionAgents:
                    WHERE id_radio=? AND date_retour IS NULL""",
                 (date_retour, id_radio)
             )
+            self._journaliser_radio(id_radio)
             self.conn.commit()
+            self._invalider_cache(entites=['radio'])
             return {
                 'succes': True,
                 'message': f"Radio {id_radio} retournée et marquée comme DISPONIBLE le {date_retour}."
@@ -1356,6 +3516,7 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'enregistrement du retour de la radio: {e}"}
 
+    @_format_resultat
     def obtenir_statut_radios(self):
         """Retourne le statut actuel de toutes les radios."""
         self.cursor.execute("""
@@ -1388,18 +3549,287 @@ class GestionAgents:
             
             liste_radios.append(radio_info)
         
-        # Statistiques
-        stats = {
-            'total': len(liste_radios),
-            'disponible': sum(1 for r in liste_radios if r['statut'] == 'DISPONIBLE'),
-            'attribuee': sum(1 for r in liste_radios if r['statut'] == 'ATTRIBUÉE'),
-            'hs': sum(1 for r in liste_radios if r['statut'] == 'HS'),
-            'reparation': sum(1 for r in liste_radios if r['statut'] == 'RÉPARATION')
-        }
-        
         return {
             'radios': liste_radios,
-            'statistiques': stats
+            'statistiques': self._compter_inventaire_radios()
+        }
+
+    def _compter_inventaire_radios(self):
+        """Compte les radios par statut et les attributions en cours, en une requête groupée."""
+        self.cursor.execute("""
+            SELECT r.statut, COUNT(*),
+                   SUM(EXISTS (SELECT 1 FROM historique_radio h
+                               WHERE h.id_radio = r.id_radio AND h.date_retour IS NULL))
+            FROM radios r
+            GROUP BY r.statut
+        """)
+        par_statut = {statut: (nombre, ouvertes) for statut, nombre, ouvertes in self.cursor.fetchall()}
+
+        return {
+            'total': sum(nombre for nombre, _ in par_statut.values()),
+            'disponible': par_statut.get('DISPONIBLE', (0, 0))[0],
+            'attribuee': par_statut.get('ATTRIBUÉE', (0, 0))[0],
+            'hs': par_statut.get('HS', (0, 0))[0],
+            'reparation': par_statut.get('RÉPARATION', (0, 0))[0],
+            'attributions_ouvertes': sum(ouvertes for _, ouvertes in par_statut.values())
+        }
+
+    @_format_resultat
+    def obtenir_inventaire_radios(self):
+        """Retourne uniquement les compteurs de l'inventaire radio (sans la liste détaillée)."""
+        return {'statistiques': self._compter_inventaire_radios()}
+
+    @_ecriture_concurrente
+    def passation_radios(self, retours=(), attributions=(), shift=None, jour_date=None):
+        """Passation de service : retours puis attributions de radios en une seule transaction.
+
+        - retours : identifiants des radios rendues ;
+        - attributions : liste de (id_radio, code_agent) ;
+        - shift : si fourni, attribue d'office une radio DISPONIBLE à chaque agent
+          de ce shift le `jour_date` (par défaut aujourd'hui) qui n'en détient pas déjà une.
+        Les conflits (radio inconnue ou indisponible, agent inconnu...) sont signalés
+        sans bloquer le reste de la passation.
+        """
+        jour_date = jour_date or date.today().isoformat()
+        try:
+            date.fromisoformat(jour_date)
+        except (TypeError, ValueError):
+            return {'erreur': "Format de date invalide. Utilisez AAAA-MM-JJ."}
+        # Une chaîne seule serait parcourue caractère par caractère
+        try:
+            if isinstance(retours, str) or isinstance(attributions, str):
+                raise TypeError
+            retours, attributions = list(retours), list(attributions)
+        except TypeError:
+            return {'erreur': "`retours` et `attributions` doivent être des listes."}
+        conflits = []
+
+        # Préchargement de l'état : radios, attributions ouvertes, agents actifs
+        self.cursor.execute("SELECT id_radio, modele, statut FROM radios")
+        radios = {id_r: {'modele': modele, 'statut': statut} for id_r, modele, statut in self.cursor.fetchall()}
+        self.cursor.execute("SELECT id_radio, code_agent FROM historique_radio WHERE date_retour IS NULL")
+        detenteurs = dict(self.cursor.fetchall())
+        self.cursor.execute("SELECT code FROM agents WHERE date_sortie IS NULL")
+        agents_actifs = {code for (code,) in self.cursor.fetchall()}
+
+        radios_rendues = []
+        for index, id_radio in enumerate(retours):
+            if not isinstance(id_radio, str):
+                conflits.append({'index': index, 'motif': "Retour mal formé (identifiant de radio attendu)."})
+                continue
+            id_radio = id_radio.upper()
+            radio = radios.get(id_radio)
+            if radio is None:
+                conflits.append({'id_radio': id_radio, 'motif': "Radio non trouvée."})
+            elif radio['statut'] != 'ATTRIBUÉE':
+                conflits.append({'id_radio': id_radio, 'motif': f"Radio non attribuée (Statut: {radio['statut']})."})
+            else:
+                radio['statut'] = 'DISPONIBLE'
+                detenteurs.pop(id_radio, None)
+                radios_rendues.append(id_radio)
+
+        radios_attribuees = []
+        # Après les retours : agent -> radio qu'il détient encore
+        agents_equipes = {code_agent: id_radio for id_radio, code_agent in detenteurs.items()}
+        for index, attribution in enumerate(attributions):
+            if not (isinstance(attribution, (list, tuple)) and len(attribution) == 2
+                    and all(isinstance(valeur, str) for valeur in attribution)):
+                conflits.append({'index': index, 'motif': "Attribution mal formée (id_radio, code_agent)."})
+                continue
+            id_radio, code_agent = attribution[0].upper(), attribution[1].upper()
+            radio = radios.get(id_radio)
+            if code_agent not in agents_actifs:
+                conflits.append({'id_radio': id_radio, 'code_agent': code_agent, 'motif': "Agent non trouvé ou inactif."})
+            elif code_agent in agents_equipes:
+                conflits.append({'id_radio': id_radio, 'code_agent': code_agent,
+                                 'motif': f"L'agent détient déjà la radio {agents_equipes[code_agent]}."})
+            elif radio is None:
+                conflits.append({'id_radio': id_radio, 'code_agent': code_agent, 'motif': "Radio non trouvée."})
+            elif radio['statut'] != 'DISPONIBLE':
+                conflits.append({'id_radio': id_radio, 'code_agent': code_agent,
+                                 'motif': f"Radio non DISPONIBLE (Statut: {radio['statut']})."})
+            else:
+                radio['statut'] = 'ATTRIBUÉE'
+                detenteurs[id_radio] = code_agent
+                agents_equipes[code_agent] = id_radio
+                radios_attribuees.append((id_radio, code_agent))
+
+        if shift is not None:
+            # Attribution d'office aux agents du shift qui n'ont pas encore de radio
+            disponibles = sorted(id_r for id_r, radio in radios.items() if radio['statut'] == 'DISPONIBLE')
+            for code_agent, shifts in self._shifts_periode(jour_date, jour_date).items():
+                if shifts != str(shift).upper() or code_agent in agents_equipes:
+                    continue
+                if not disponibles:
+                    conflits.append({'code_agent': code_agent, 'motif': "Aucune radio disponible."})
+                    continue
+                id_radio = disponibles.pop(0)
+                radios[id_radio]['statut'] = 'ATTRIBUÉE'
+                detenteurs[id_radio] = code_agent
+                radios_attribuees.append((id_radio, code_agent))
+
+        try:
+            self.cursor.executemany(
+                "UPDATE historique_radio SET date_retour=? WHERE id_radio=? AND date_retour IS NULL",
+                [(jour_date, id_radio) for id_radio in radios_rendues]
+            )
+            self.cursor.executemany(
+                "INSERT INTO historique_radio (id_radio, code_agent, date_attribution, date_retour) VALUES (?, ?, ?, NULL)",
+                [(id_radio, code_agent, jour_date) for id_radio, code_agent in radios_attribuees]
+            )
+            modifiees = sorted(set(radios_rendues) | {id_radio for id_radio, _ in radios_attribuees})
+            self.cursor.executemany(
+                "UPDATE radios SET statut=? WHERE id_radio=?",
+                [(radios[id_radio]['statut'], id_radio) for id_radio in modifiees]
+            )
+            for id_radio in modifiees:
+                self._journaliser('radio', id_radio, {
+                    'modele': radios[id_radio]['modele'],
+                    'statut': radios[id_radio]['statut'],
+                    'attribue_a': detenteurs.get(id_radio)
+                })
+            self.conn.commit()
+            self._invalider_cache(entites=['radio'])
+        except Exception as e:
+            self.conn.rollback()
+            return {'erreur': f"Erreur lors de la passation des radios: {e}"}
+
+        return {
+            'succes': True,
+            'message': f"Passation du {jour_date}: {len(radios_rendues)} retour(s), {len(radios_attribuees)} attribution(s), {len(conflits)} conflit(s).",
+            'retours': radios_rendues,
+            'attributions': [{'id_radio': id_radio, 'code_agent': code_agent} for id_radio, code_agent in radios_attribuees],
+            'conflits': conflits
+        }
+
+    # Attributions qui recoupent une période [?1, ?2], bornées à la période ;
+    # une attribution en cours compte jusqu'à ?3 (fin de période ou date de référence).
+    # Les deux branches utilisent respectivement idx_historique_radio_retour et idx_historique_radio_ouvert ;
+    # seule la première peut atteindre les archives (attributions rendues).
+    _SQL_ATTRIBUTIONS_PERIODE = """
+        WITH attributions AS (
+            SELECT id, id_radio, code_agent, date_attribution, date_retour,
+                   MAX(date_attribution, ?1) AS debut_effectif,
+                   MIN(date_retour, ?2) AS fin_effective
+            FROM {historique}
+            WHERE date_retour >= ?1 AND date_attribution <= ?2
+            UNION ALL
+            SELECT id, id_radio, code_agent, date_attribution, date_retour,
+                   MAX(date_attribution, ?1), ?3
+            FROM historique_radio
+            WHERE date_retour IS NULL AND date_attribution <= ?2
+        )
+    """
+
+    def analyser_utilisation_radios(self, date_debut, date_fin, seuil_non_retour_jours=30, date_reference=None):
+        """Analyse l'historique radio sur une période, entièrement en SQL.
+
+        Retourne le taux d'utilisation par radio, la détention par agent, la durée
+        moyenne de détention, les radios non rendues depuis plus de
+        `seuil_non_retour_jours` et les chevauchements d'attributions.
+        """
+        try:
+            nb_jours = (date.fromisoformat(date_fin) - date.fromisoformat(date_debut)).days + 1
+        except ValueError as e:
+            return {'erreur': f"Date invalide: {e}"}
+        if nb_jours <= 0:
+            return {'erreur': "La date de début doit être avant la date de fin."}
+
+        date_reference = date_reference or date.today().isoformat()
+        fin_ouverte = min(date_fin, date_reference)
+        parametres = (date_debut, date_fin, fin_ouverte)
+        attributions = self._SQL_ATTRIBUTIONS_PERIODE.format(historique=self._source('historique_radio', date_debut))
+        # Le jour du retour revient au détenteur suivant (fin exclue) ; une attribution
+        # bornée par la période ou la date de référence court jusqu'à ce jour inclus,
+        # comme `nb_jours` : une radio détenue toute la période est utilisée à 100 %.
+        duree = ("MAX(julianday(fin_effective) - julianday(debut_effectif)"
+                 " + (date_retour IS NULL OR date_retour > ?2), 0)")
+
+        # Utilisation par radio (radios jamais attribuées incluses)
+        self.cursor.execute(attributions + f"""
+            SELECT r.id_radio, r.modele, r.statut, COUNT(a.id), COALESCE(SUM({duree}), 0)
+            FROM radios r LEFT JOIN attributions a ON a.id_radio = r.id_radio
+            GROUP BY r.id_radio
+            ORDER BY r.id_radio
+        """, parametres)
+        par_radio = [{
+            'id_radio': id_radio,
+            'modele': modele,
+            'statut': statut,
+            'attributions': nb,
+            'jours_detention': jours,
+            'taux_utilisation': round(jours / nb_jours * 100, 1)
+        } for id_radio, modele, statut, nb, jours in self.cursor.fetchall()]
+
+        # Détention par agent
+        self.cursor.execute(attributions + f"""
+            SELECT a.code_agent, ag.nom, ag.prenom, COUNT(*), SUM({duree}), COUNT(DISTINCT a.id_radio)
+            FROM attributions a LEFT JOIN agents ag ON ag.code = a.code_agent
+            GROUP BY a.code_agent
+            ORDER BY SUM({duree}) DESC, a.code_agent
+        """, parametres)
+        par_agent = [{
+            'code_agent': code,
+            'nom_complet': f"{nom} {prenom}" if nom else code,
+            'attributions': nb,
+            'jours_detention': jours,
+            'radios_distinctes': nb_radios,
+            'duree_moyenne_jours': round(jours / nb, 1) if nb else 0
+        } for code, nom, prenom, nb, jours, nb_radios in self.cursor.fetchall()]
+
+        # Durée moyenne des attributions rendues pendant la période
+        self.cursor.execute(f"""
+            SELECT COUNT(*), AVG(julianday(date_retour) - julianday(date_attribution))
+            FROM {self._source('historique_radio', date_debut, date_fin)}
+            WHERE date_retour BETWEEN ? AND ?
+        """, (date_debut, date_fin))
+        nb_rendues, duree_moyenne = self.cursor.fetchone()
+
+        # Radios non rendues au-delà du seuil
+        self.cursor.execute("""
+            SELECT h.id_radio, h.code_agent, h.date_attribution,
+                   CAST(julianday(?) - julianday(h.date_attribution) AS INTEGER) AS jours
+            FROM historique_radio h
+            WHERE h.date_retour IS NULL AND h.date_attribution <= date(?, ?)
+            ORDER BY h.date_attribution
+        """, (date_reference, date_reference, f"-{int(seuil_non_retour_jours)} days"))
+        non_retournees = [{
+            'id_radio': id_radio, 'code_agent': code, 'date_attribution': date_attr, 'jours': jours
+        } for id_radio, code, date_attr, jours in self.cursor.fetchall()]
+
+        # Chevauchements : même radio (ou même agent) attribuée deux fois en même temps.
+        # Un retour et une attribution le même jour (passation) ne se chevauchent pas.
+        chevauchements = []
+        for colonne, nature in (('id_radio', 'radio'), ('code_agent', 'agent')):
+            self.cursor.execute(attributions + f"""
+                SELECT a1.{colonne}, a1.id, a2.id, a1.id_radio, a2.id_radio, a1.code_agent, a2.code_agent,
+                       MAX(a1.debut_effectif, a2.debut_effectif), MIN(a1.fin_effective, a2.fin_effective)
+                FROM attributions a1 JOIN attributions a2
+                     ON a2.{colonne} = a1.{colonne} AND a2.id > a1.id
+                WHERE a2.date_attribution < COALESCE(a1.date_retour, '9999-12-31')
+                  AND a1.date_attribution < COALESCE(a2.date_retour, '9999-12-31')
+                ORDER BY a1.{colonne}, a1.id
+            """, parametres)
+            for valeur, id1, id2, radio1, radio2, agent1, agent2, debut, fin in self.cursor.fetchall():
+                chevauchements.append({
+                    'type': nature,
+                    colonne: valeur,
+                    'attributions': [
+                        {'id': id1, 'id_radio': radio1, 'code_agent': agent1},
+                        {'id': id2, 'id_radio': radio2, 'code_agent': agent2}
+                    ],
+                    'debut': debut,
+                    'fin': fin
+                })
+
+        return {
+            'periode': {'debut': date_debut, 'fin': date_fin, 'nb_jours': nb_jours},
+            'par_radio': par_radio,
+            'par_agent': par_agent,
+            'attributions_rendues': nb_rendues,
+            'duree_moyenne_jours': round(duree_moyenne, 1) if duree_moyenne is not None else None,
+            'non_retournees': non_retournees,
+            'chevauchements': chevauchements
         }
 
     # =========================================================================
@@ -1435,6 +3865,7 @@ class GestionAgents:
             }
             stats_data.append(row)
             
+        import pandas as pd
         df_stats = pd.DataFrame(stats_data)
 
         try:
@@ -1445,12 +3876,104 @@ class GestionAgents:
                 'fichier': nom_fichier
             }
         except Exception as e:
-            return {'erreur': f"Erreur lors de l'exportation des statistiques en Excel: {e}"}
+            return {'erreur': f"Erreur lors de l'exportation des statistiques en Excel: {e}"}
+
+    COLONNES_PAIE = [
+        ('Shifts Matin (1)', '1'), ('Shifts Après-midi (2)', '2'), ('Shifts Nuit (3)', '3'),
+        ('Repos (R)', 'R'), ('Congés (C)', 'C'), ('Maladie (M)', 'M'), ('Autres (A)', 'A')
+    ]
+
+    def exporter_paie_excel(self, mois_debut, annee_debut, mois_fin, annee_fin, nom_fichier, groupes=None):
+        """Exporte, par agent et par mois, les shifts, fériés travaillés et CPA d'une plage de mois.
+
+        Le planning de toute la plage est lu en une fois (`_shifts_periode`) puis compté en
+        mémoire ; le classeur est écrit en flux (openpyxl en écriture seule) avec une
+        feuille longue (une ligne par agent et par mois) et une feuille pivotée (CPA par mois).
+        Sont inclus les agents affectés pendant la plage, y compris ceux sortis depuis,
+        restreints aux `groupes` demandés le cas échéant.
+        """
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            return {'erreur': "Le module openpyxl est requis pour l'export Excel."}
+
+        if not nom_fichier.lower().endswith('.xlsx'):
+            nom_fichier += '.xlsx'
+        if (annee_fin, mois_fin) < (annee_debut, mois_debut):
+            return {'erreur': "Le mois de fin doit être postérieur ou égal au mois de début."}
+        date_debut = date(annee_debut, mois_debut, 1).isoformat()
+        date_fin = date(annee_fin, mois_fin, monthrange(annee_fin, mois_fin)[1]).isoformat()
+
+        requete = "SELECT code, nom, prenom, code_groupe FROM agents WHERE date_entree <= ? AND (date_sortie IS NULL OR date_sortie > ?)"
+        params = [date_fin, date_debut]
+        if groupes:
+            requete += f" AND code_groupe IN ({', '.join('?' * len(groupes))})"
+            params.extend(groupe.upper() for groupe in groupes)
+        self.cursor.execute(requete + " ORDER BY code_groupe, code", params)
+        agents_info = self.cursor.fetchall()
+        if not agents_info:
+            return {'erreur': 'Aucun agent affecté sur la période.'}
+
+        shifts = self._shifts_periode(date_debut, date_fin, codes=[code for code, _, _, _ in agents_info])
+        feries = self._dates_feries(date_debut, date_fin)
+        # Découpage de l'axe des jours en mois : (étiquette, début, fin, indices des jours fériés)
+        mois_plage = []
+        index = 0
+        for annee, mois in self._mois_periode(date_debut, date_fin):
+            jours_mois = monthrange(annee, mois)[1]
+            indices_feries = [index + j for j in range(jours_mois) if date(annee, mois, j + 1).isoformat() in feries]
+            mois_plage.append((f"{annee}-{mois:02d}", index, index + jours_mois, indices_feries))
+            index += jours_mois
+
+        classeur = Workbook(write_only=True)
+        feuille_longue = classeur.create_sheet("Paie_par_mois")
+        feuille_pivot = classeur.create_sheet("CPA_par_agent")
+        feuille_longue.append(['Code', 'Nom', 'Prénom', 'Groupe', 'Mois'] + [titre for titre, _ in self.COLONNES_PAIE]
+                              + ['Fériés (Crédit Prime)', 'TOTAL SHIFTS OPÉRATIONNELS (CPA)'])
+        feuille_pivot.append(['Code', 'Nom', 'Prénom', 'Groupe'] + [f"CPA {etiquette}" for etiquette, _, _, _ in mois_plage]
+                             + ['Fériés (Crédit Prime)', 'TOTAL CPA'])
+
+        nb_lignes = 0
+        total_cpa = 0
+        for code, nom, prenom, groupe in agents_info:
+            shifts_agent = shifts[code]
+            ligne_pivot = [code, nom, prenom, groupe]
+            feries_agent = cpa_agent = 0
+            for etiquette, debut, fin, indices_feries in mois_plage:
+                shifts_mois = shifts_agent[debut:fin]
+                if shifts_mois.count('-') == len(shifts_mois):
+                    ligne_pivot.append(None)
+                    continue
+                comptes = [shifts_mois.count(shift) for _, shift in self.COLONNES_PAIE]
+                feries_travailles = sum(1 for i in indices_feries if shifts_agent[i] in '123')
+                cpa = sum(comptes[:3]) + (0 if groupe == 'E' else feries_travailles)
+                feuille_longue.append([code, nom, prenom, groupe, etiquette] + comptes + [feries_travailles, cpa])
+                ligne_pivot.append(cpa)
+                feries_agent += feries_travailles
+                cpa_agent += cpa
+                nb_lignes += 1
+            feuille_pivot.append(ligne_pivot + [feries_agent, cpa_agent])
+            total_cpa += cpa_agent
+
+        try:
+            classeur.save(nom_fichier)
+        except Exception as e:
+            return {'erreur': f"Erreur lors de l'exportation de la paie en Excel: {e}"}
+        return {
+            'succes': True,
+            'message': f"Paie de {len(agents_info)} agent(s) sur {len(mois_plage)} mois exportée dans '{nom_fichier}'.",
+            'fichier': nom_fichier,
+            'agents': len(agents_info),
+            'mois': len(mois_plage),
+            'lignes': nb_lignes,
+            'total_cpa': total_cpa
+        }
 
     # =========================================================================
     # GESTION HABILLEMENT
     # =========================================================================
 
+    @_ecriture_concurrente
     def ajouter_modifier_habillement(self, code_agent, habillement_data):
         """Ajoute ou modifie les informations d'habillement d'un agent."""
         code_agent = code_agent.upper()
@@ -1464,7 +3987,11 @@ class GestionAgents:
                  habillement_data['pantalon'][0], habillement_data['pantalon'][1],
                  habillement_data['cravate'][0], habillement_data['cravate'][1])
             )
+            self._journaliser('habillement', code_agent, {
+                article: list(habillement_data[article]) for article in ('chemise', 'jacket', 'pantalon', 'cravate')
+            })
             self.conn.commit()
+            self._invalider_cache(entites=['habillement'])
             return {
                 'succes': True,
                 'message': f"Informations d'habillement pour {code_agent} mises à jour."
@@ -1472,6 +3999,7 @@ class GestionAgents:
         except Exception as e:
             return {'erreur': f"Erreur lors de l'ajout/modification de l'habillement: {e}"}
 
+    @_format_resultat
     def obtenir_rapport_habillement(self):
         """Retourne un rapport global des tailles d'habillement et des dates de fourniture."""
         self.cursor.execute("""
@@ -1505,15 +4033,184 @@ class GestionAgents:
         
         return {'habillement': liste_habillement}
 
+    def _lot_habillement(self, groupe, article, date_reference, limite, apres=None):
+        """Lit un lot du rapport d'habillement, trié par code agent, après le code `apres`."""
+        echeances = ", ".join(
+            f"date(h.{nom}_date, '+{mois} months')" for nom, mois in DUREES_RENOUVELLEMENT_MOIS.items()
+        )
+        conditions, params = ["a.date_sortie IS NULL"], []
+        if groupe:
+            conditions.append("a.code_groupe = ?")
+            params.append(groupe.upper())
+        if article:
+            # Date absente ou illisible : l'article est considéré comme à renouveler
+            conditions.append(
+                f"COALESCE(date(h.{article}_date, '+{DUREES_RENOUVELLEMENT_MOIS[article]} months'), '') <= ?"
+            )
+            params.append(date_reference)
+            if article == 'cravate':
+                conditions.append("UPPER(COALESCE(h.cravate_oui, '')) NOT IN ('NON', 'N')")
+        if apres is not None:
+            conditions.append("a.code > ?")
+            params.append(apres)
+        self.cursor.execute(f"""
+            SELECT a.code, a.nom, a.prenom, a.code_groupe, h.chemise_taille, h.chemise_date,
+                   h.jacket_taille, h.jacket_date, h.pantalon_taille, h.pantalon_date,
+                   h.cravate_oui, h.cravate_date, {echeances}
+            FROM agents a
+            LEFT JOIN habillement h ON a.code = h.code_agent
+            WHERE {' AND '.join(conditions)}
+            ORDER BY a.code
+            LIMIT ?
+        """, params + [limite])
+        return [{
+            'code': row[0],
+            'nom_complet': f"{row[1]} {row[2]}",
+            'groupe': row[3],
+            'chemise': {'taille': row[4], 'date': row[5], 'echeance': row[12]},
+            'jacket': {'taille': row[6], 'date': row[7], 'echeance': row[13]},
+            'pantalon': {'taille': row[8], 'date': row[9], 'echeance': row[14]},
+            'cravate': {'oui_non': row[10], 'date': row[11], 'echeance': row[15]}
+        } for row in self.cursor.fetchall()]
+
+    def _verifier_article(self, article):
+        if article is not None and article not in DUREES_RENOUVELLEMENT_MOIS:
+            raise ValueError(
+                f"Article inconnu: {article} ({', '.join(DUREES_RENOUVELLEMENT_MOIS)})."
+            )
+
+    def page_habillement(self, limite=100, jeton=None, groupe=None, article=None, date_reference=None):
+        """Page du rapport d'habillement (pagination par clé sur le code agent).
+
+        `article` restreint aux agents dont cet article est à renouveler à `date_reference`
+        (aujourd'hui par défaut). `jeton_suivant` vaut None sur la dernière page.
+        """
+        if not isinstance(limite, int) or limite < 1:
+            return {'erreur': "La limite doit être un entier supérieur ou égal à 1."}
+        try:
+            self._verifier_article(article)
+            apres = _decoder_jeton(jeton) if jeton else None
+        except ValueError as e:
+            return {'erreur': str(e)}
+        if apres is not None and not isinstance(apres, str):
+            return {'erreur': "Jeton de continuation invalide."}
+        lignes = self._lot_habillement(groupe, article, date_reference or date.today().isoformat(),
+                                       limite + 1, apres)
+        suite = len(lignes) > limite
+        lignes = lignes[:limite]
+        return {
+            'habillement': lignes,
+            'jeton_suivant': _encoder_jeton(lignes[-1]['code']) if suite else None
+        }
+
+    def iterer_habillement(self, groupe=None, article=None, date_reference=None, taille_lot=500):
+        """Générateur sur le rapport d'habillement, lu par lots de `taille_lot` agents."""
+        self._verifier_article(article)
+        date_reference = date_reference or date.today().isoformat()
+        apres = None
+        while True:
+            lot = self._lot_habillement(groupe, article, date_reference, taille_lot, apres)
+            yield from lot
+            if len(lot) < taille_lot:
+                return
+            apres = lot[-1]['code']
+
+    def prevoir_renouvellements_habillement(self, horizon_mois=6, politique=None, date_reference=None, groupe=None):
+        """Prévoit les renouvellements d'habillement des agents actifs sur `horizon_mois` mois.
+
+        `politique` surcharge DUREES_RENOUVELLEMENT_MOIS (article -> mois, None pour ignorer un
+        article). Les échéances dépassées ou inconnues sont dues le mois de `date_reference`.
+        Retourne le détail par agent et article, et les quantités par article, taille et mois.
+        """
+        politique = {**DUREES_RENOUVELLEMENT_MOIS, **(politique or {})}
+        inconnus = set(politique) - set(DUREES_RENOUVELLEMENT_MOIS)
+        if inconnus:
+            return {'erreur': f"Article inconnu: {', '.join(sorted(inconnus))}."}
+        articles = {article: int(mois) for article, mois in politique.items() if mois is not None}
+        if not articles:
+            return {'erreur': "Aucun article à prévoir."}
+
+        date_reference = date_reference or date.today().isoformat()
+        params = {'reference': date_reference, 'horizon': f"+{int(horizon_mois)} months", 'groupe': groupe}
+        branches = []
+        for article, mois in articles.items():
+            # La cravate n'a pas de taille
+            taille = 'NULL' if article == 'cravate' else f'h.{article}_taille'
+            params[article] = f"-{mois} months"
+            params[f"{article}_duree"] = f"+{mois} months"
+            # Condition écrite sur la colonne brute pour utiliser idx_habillement_<article>_date
+            branches.append(f"""
+                SELECT h.code_agent, '{article}' AS article, {taille} AS taille, h.{article}_date AS derniere,
+                       date(h.{article}_date, :{article}_duree) AS echeance
+                FROM habillement h
+                WHERE (h.{article}_date IS NULL OR h.{article}_date <= date(:reference, :horizon, :{article}))
+                {"AND UPPER(COALESCE(h.cravate_oui, '')) NOT IN ('NON', 'N')" if article == 'cravate' else ''}
+            """)
+        cte = f"""
+            WITH dus AS ({' UNION ALL '.join(branches)}),
+            previsions AS (
+                SELECT dus.*, a.nom, a.prenom, a.code_groupe,
+                       substr(MAX(COALESCE(echeance, :reference), :reference), 1, 7) AS mois,
+                       (echeance IS NULL OR echeance < :reference) AS en_retard
+                FROM dus JOIN agents a ON a.code = dus.code_agent
+                WHERE a.date_sortie IS NULL AND (:groupe IS NULL OR a.code_groupe = UPPER(:groupe))
+            )
+        """
+        self.cursor.execute(cte + """
+            SELECT code_agent, nom, prenom, code_groupe, article, taille, derniere, echeance, mois, en_retard
+            FROM previsions
+            ORDER BY mois, code_agent, article
+        """, params)
+        detail = [{
+            'code_agent': code,
+            'nom_complet': f"{nom} {prenom}",
+            'groupe': code_groupe,
+            'article': article,
+            'taille': taille,
+            'derniere_fourniture': derniere,
+            'echeance': echeance,
+            'mois': mois,
+            'en_retard': bool(en_retard)
+        } for code, nom, prenom, code_groupe, article, taille, derniere, echeance, mois, en_retard
+            in self.cursor.fetchall()]
+
+        self.cursor.execute(cte + """
+            SELECT mois, article, taille, COUNT(*)
+            FROM previsions
+            GROUP BY mois, article, taille
+            ORDER BY mois, article, taille
+        """, params)
+        quantites = [{'mois': mois, 'article': article, 'taille': taille, 'quantite': nb}
+                     for mois, article, taille, nb in self.cursor.fetchall()]
+
+        # Agents actifs sans fiche d'habillement : tailles inconnues, à compléter
+        self.cursor.execute("""
+            SELECT a.code FROM agents a
+            WHERE a.date_sortie IS NULL AND (? IS NULL OR a.code_groupe = UPPER(?))
+              AND NOT EXISTS (SELECT 1 FROM habillement h WHERE h.code_agent = a.code)
+            ORDER BY a.code
+        """, (groupe, groupe))
+        sans_fiche = [code for (code,) in self.cursor.fetchall()]
+
+        return {
+            'date_reference': date_reference,
+            'horizon_mois': int(horizon_mois),
+            'politique': articles,
+            'renouvellements': detail,
+            'quantites': quantites,
+            'agents_sans_fiche': sans_fiche
+        }
+
     # =========================================================================
     # GESTION DES AVERTISSEMENTS
     # =========================================================================
 
+    @_ecriture_concurrente
     def enregistrer_avertissement(self, code_agent, date_av, type_av, description):
         """Enregistre un avertissement disciplinaire pour un agent."""
         code_agent = code_agent.upper()
         type_av = type_av.upper()
-        if type_av not in ['ORAL', 'ECRIT', 'MISE_A_PIED']:
+        if type_av not in TYPES_AVERTISSEMENT:
             return {'erreur': "Type d'avertissement invalide (ORAL, ECRIT, MISE_A_PIED)."}
 
         try:
@@ -1521,7 +4218,11 @@ class GestionAgents:
                 "INSERT INTO avertissements (code_agent, date_avertissement, type_avertissement, description) VALUES (?, ?, ?, ?)",
                 (code_agent, date_av, type_av, description)
             )
+            self._journaliser('avertissement', str(self.cursor.lastrowid), {
+                'code_agent': code_agent, 'date': date_av, 'type': type_av, 'description': description
+            })
             self.conn.commit()
+            self._invalider_cache(entites=['avertissement'])
             return {
                 'succes': True,
                 'message': f"Avertissement ({type_av}) enregistré pour {code_agent} le {date_av}."
@@ -1532,9 +4233,9 @@ class GestionAgents:
     def obtenir_historique_avertissements_agent(self, code_agent):
         """Retourne l'historique des avertissements d'un agent."""
         code_agent = code_agent.upper()
-        self.cursor.execute("""
+        self.cursor.execute(f"""
             SELECT date_avertissement, type_avertissement, description 
-            FROM avertissements 
+            FROM {self._source('avertissements')} 
             WHERE code_agent=? 
             ORDER BY date_avertissement DESC
         """, (code_agent,))
@@ -1553,11 +4254,12 @@ class GestionAgents:
         
         return {'avertissements': liste_avertissements}
 
+    @_format_resultat
     def obtenir_rapport_avertissements(self):
         """Retourne un rapport global de tous les avertissements actifs."""
-        self.cursor.execute("""
+        self.cursor.execute(f"""
             SELECT a.code, a.nom, a.prenom, av.date_avertissement, av.type_avertissement, av.description
-            FROM avertissements av
+            FROM {self._source('avertissements')} av
             JOIN agents a ON av.code_agent = a.code
             WHERE a.date_sortie IS NULL
             ORDER BY av.date_avertissement DESC, a.code
@@ -1578,8 +4280,270 @@ class GestionAgents:
             })
         
         return {'avertissements': liste_avertissements}
+
+    def _lot_avertissements(self, filtres, limite, apres=None):
+        """Lit un lot d'avertissements, du plus récent au plus ancien, après la clé (date, id) `apres`."""
+        date_debut, date_fin, type_av, groupe, code_agent, actifs_seulement = filtres
+        conditions, params = [], []
+        if code_agent:
+            conditions.append("av.code_agent = ?")
+            params.append(code_agent.upper())
+        if date_debut:
+            conditions.append("av.date_avertissement >= ?")
+            params.append(date_debut)
+        if date_fin:
+            conditions.append("av.date_avertissement <= ?")
+            params.append(date_fin)
+        if type_av:
+            conditions.append("av.type_avertissement = ?")
+            params.append(type_av.upper())
+        if groupe:
+            conditions.append("a.code_groupe = ?")
+            params.append(groupe.upper())
+        if actifs_seulement:
+            conditions.append("a.date_sortie IS NULL")
+        if apres is not None:
+            conditions.append("(av.date_avertissement, av.id) < (?, ?)")
+            params.extend(apres)
+        self.cursor.execute(f"""
+            SELECT av.id, av.code_agent, a.nom, a.prenom, a.code_groupe,
+                   av.date_avertissement, av.type_avertissement, av.description
+            FROM {self._source('avertissements', date_debut, date_fin)} av
+            LEFT JOIN agents a ON av.code_agent = a.code
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY av.date_avertissement DESC, av.id DESC
+            LIMIT ?
+        """, params + [limite])
+        return [{
+            'id': id_av,
+            'code_agent': code,
+            'nom_complet': f"{nom} {prenom}" if nom else code,
+            'groupe': groupe_agent,
+            'date': date_av,
+            'type': type_av,
+            'description': description
+        } for id_av, code, nom, prenom, groupe_agent, date_av, type_av, description in self.cursor.fetchall()]
+
+    def page_avertissements(self, limite=100, jeton=None, date_debut=None, date_fin=None, type_av=None,
+                            groupe=None, code_agent=None, actifs_seulement=True):
+        """Page du rapport des avertissements (pagination par clé, sans OFFSET).
+
+        Avec `code_agent` et `actifs_seulement=False`, remplace l'historique d'un agent.
+        `jeton_suivant` vaut None sur la dernière page.
+        """
+        if not isinstance(limite, int) or limite < 1:
+            return {'erreur': "La limite doit être un entier supérieur ou égal à 1."}
+        if type_av and type_av.upper() not in TYPES_AVERTISSEMENT:
+            return {'erreur': "Type d'avertissement invalide (ORAL, ECRIT, MISE_A_PIED)."}
+        try:
+            apres = _decoder_jeton(jeton) if jeton else None
+        except ValueError as e:
+            return {'erreur': str(e)}
+        # Clé (date, id) de la dernière ligne lue
+        if apres is not None and not (isinstance(apres, list) and len(apres) == 2
+                                      and isinstance(apres[0], str) and type(apres[1]) is int):
+            return {'erreur': "Jeton de continuation invalide."}
+        filtres = (date_debut, date_fin, type_av, groupe, code_agent, actifs_seulement)
+        lignes = self._lot_avertissements(filtres, limite + 1, apres)
+        suite = len(lignes) > limite
+        lignes = lignes[:limite]
+        return {
+            'avertissements': lignes,
+            'jeton_suivant': _encoder_jeton([lignes[-1]['date'], lignes[-1]['id']]) if suite else None
+        }
+
+    def iterer_avertissements(self, date_debut=None, date_fin=None, type_av=None, groupe=None,
+                              code_agent=None, actifs_seulement=True, taille_lot=500):
+        """Générateur sur les avertissements filtrés, lus par lots de `taille_lot`.
+
+        Chaque lot est une requête indépendante : la mémoire reste bornée et le
+        générateur peut être entrelacé avec d'autres appels sur la même instance.
+        """
+        filtres = (date_debut, date_fin, type_av, groupe, code_agent, actifs_seulement)
+        apres = None
+        while True:
+            lot = self._lot_avertissements(filtres, taille_lot, apres)
+            yield from lot
+            if len(lot) < taille_lot:
+                return
+            apres = (lot[-1]['date'], lot[-1]['id'])
+
+
+def _copier_base(source, destination):
+    """Copie cohérente d'une base SQLite (API de sauvegarde), même si elle est en cours d'utilisation."""
+    connexion_source = sqlite3.connect(source)
+    copie = sqlite3.connect(destination)
+    try:
+        connexion_source.backup(copie)
+    finally:
+        copie.close()
+        connexion_source.close()
+
+
+def mesurer_demarrage(db_name=None, repetitions=5):
+    """Mesure le démarrage dans des interpréteurs neufs : import du module et construction de GestionAgents.
+
+    La construction est mesurée avec initialisation du schéma (user_version remis à 0)
+    puis avec le raccourci de version. Retourne les médianes en millisecondes. Avec
+    `db_name`, la mesure porte sur une copie temporaire : la base n'est pas modifiée.
+    """
+    import statistics
+    import subprocess
+    import sys
+    import tempfile
+
+    # Chargé depuis son chemin : le nom du fichier n'est pas forcément un identifiant Python
+    chemin = Path(__file__).absolute()
+    script = f"""
+import importlib.util, json, sqlite3, sys, time
+debut = time.perf_counter()
+spec = importlib.util.spec_from_file_location("gestion_agents", {str(chemin)!r})
+module = importlib.util.module_from_spec(spec)
+sys.modules["gestion_agents"] = module
+spec.loader.exec_module(module)
+import_ms = (time.perf_counter() - debut) * 1000
+connexion = sqlite3.connect(sys.argv[1]); connexion.execute("PRAGMA user_version = 0"); connexion.close()
+debut = time.perf_counter()
+module.GestionAgents(sys.argv[1], taille_cache=0).fermer_connexion()
+initialisation_ms = (time.perf_counter() - debut) * 1000
+debut = time.perf_counter()
+module.GestionAgents(sys.argv[1], taille_cache=0).fermer_connexion()
+construction_ms = (time.perf_counter() - debut) * 1000
+print(json.dumps([import_ms, initialisation_ms, construction_ms, 'pandas' in sys.modules]))
+"""
+    with tempfile.TemporaryDirectory() as dossier:
+        base = os.path.join(dossier, "demarrage.db")
+        if db_name:
+            if not os.path.exists(db_name):
+                return {'erreur': f"Base introuvable: {db_name}"}
+            _copier_base(db_name, base)
+        mesures = [
+            json.loads(subprocess.run([sys.executable, "-c", script, base], capture_output=True,
+                                      text=True, check=True).stdout)
+            for _ in range(repetitions)
+        ]
+    return {
+        'import_ms': round(statistics.median(m[0] for m in mesures), 1),
+        'construction_avec_schema_ms': round(statistics.median(m[1] for m in mesures), 2),
+        'construction_ms': round(statistics.median(m[2] for m in mesures), 2),
+        'pandas_importe': any(m[3] for m in mesures)
+    }
+
+
+def _travail_stress_ecritures(db_name, jour_date, code_a, code_b, id_radio, operations):
+    """Processus de `tester_ecritures_concurrentes` : échanges de shifts et attributions de radio."""
+    gestion = GestionAgents(db_name, taille_cache=0)
+    comptes = {'echanges': 0, 'attributions': 0, 'retours': 0, 'doubles_attributions': 0, 'occupee': 0, 'autres': 0}
+    try:
+        for i in range(operations):
+            if i % 2 == 0:
+                resultat, compteur = gestion.echanger_shifts(code_a, code_b, jour_date), 'echanges'
+            elif gestion.attribuer_radio(id_radio, code_a).get('succes'):
+                comptes['attributions'] += 1
+                # Tant que ce processus ne l'a pas rendue, la radio n'a qu'une attribution ouverte
+                gestion.cursor.execute(
+                    "SELECT COUNT(*) FROM historique_radio WHERE id_radio=? AND date_retour IS NULL", (id_radio,)
+                )
+                if gestion.cursor.fetchone()[0] > 1:
+                    comptes['doubles_attributions'] += 1
+                resultat, compteur = gestion.enregistrer_retour_radio(id_radio), 'retours'
+            else:
+                continue
+            if resultat.get('succes'):
+                comptes[compteur] += 1
+            elif 'occupée' in resultat.get('erreur', ''):
+                comptes['occupee'] += 1
+            elif 'erreur' in resultat:
+                comptes['autres'] += 1
+    finally:
+        gestion.fermer_connexion()
+    return comptes
+
+
+def tester_ecritures_concurrentes(db_name=None, nb_processus=4, operations=200, jour_date=None):
+    """Test de charge : plusieurs processus font des lectures-écritures concurrentes sur la même base.
+
+    Chaque processus alterne des échanges de shifts entre deux mêmes agents et des
+    attributions/retours d'une même radio. Vérifie qu'aucune mise à jour n'a été
+    perdue : les shifts finaux correspondent à la parité du nombre d'échanges réussis,
+    la radio n'a jamais eu deux attributions ouvertes et l'historique compte une ligne
+    par attribution réussie. Le test travaille toujours sur une base temporaire :
+    vide sans `db_name`, sinon une copie de `db_name`, qui n'est pas modifiée.
+    """
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    with tempfile.TemporaryDirectory() as dossier:
+        chemin = os.path.join(dossier, "stress.db")
+        if db_name:
+            if not os.path.exists(db_name):
+                return {'erreur': f"Base introuvable: {db_name}"}
+            _copier_base(db_name, chemin)
+        db_name = chemin
+        gestion = GestionAgents(db_name, taille_cache=0)
+        try:
+            gestion.initialiser_agents_test()
+            id_radio = 'STRESS-01'
+            gestion.ajouter_modifier_radio(id_radio, 'Test de charge', 'DISPONIBLE')
+            gestion.cursor.execute("SELECT COUNT(*) FROM historique_radio WHERE id_radio=?", (id_radio,))
+            lignes_avant = gestion.cursor.fetchone()[0]
+
+            # Premier jour où deux agents des groupes A et B ont des shifts travaillés différents
+            jour = date.fromisoformat(jour_date) if jour_date else date.today()
+            code_a, code_b = 'A01', 'B02'
+            for _ in range(60):
+                shifts = gestion._shifts_periode(jour.isoformat(), jour.isoformat(), codes=[code_a, code_b])
+                if shifts[code_a] != shifts[code_b] and shifts[code_a] in '123' and shifts[code_b] in '123':
+                    break
+                jour += timedelta(days=1)
+            else:
+                return {'erreur': "Aucun jour trouvé où les deux agents ont des shifts travaillés différents."}
+            jour_date = jour.isoformat()
+            avant = (shifts[code_a], shifts[code_b])
+        finally:
+            gestion.fermer_connexion()
+
+        debut = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=nb_processus) as executeur:
+            futures = [
+                executeur.submit(_travail_stress_ecritures, db_name, jour_date, code_a, code_b, id_radio, operations)
+                for _ in range(nb_processus)
+            ]
+            comptes = [future.result() for future in futures]
+        duree = time.perf_counter() - debut
+
+        total = {cle: sum(c[cle] for c in comptes) for cle in comptes[0]}
+        gestion = GestionAgents(db_name, taille_cache=0, lecture_seule=True)
+        try:
+            shifts = gestion._shifts_periode(jour_date, jour_date, codes=[code_a, code_b])
+            apres = (shifts[code_a], shifts[code_b])
+            gestion.cursor.execute(
+                "SELECT COUNT(*), SUM(date_retour IS NULL) FROM historique_radio WHERE id_radio=?", (id_radio,)
+            )
+            lignes_radio, ouvertes = gestion.cursor.fetchone()
+        finally:
+            gestion.fermer_connexion()
+
+    attendu = avant if total['echanges'] % 2 == 0 else avant[::-1]
+    radio_coherente = (total['doubles_attributions'] == 0 and (ouvertes or 0) == 0
+                       and lignes_radio - lignes_avant == total['attributions'] == total['retours'])
+    ecritures = total['echanges'] + total['attributions'] + total['retours']
+    return {
+        'succes': apres == attendu and radio_coherente,
+        'processus': nb_processus,
+        'jour': jour_date,
+        'comptes': total,
+        'shifts_avant': avant,
+        'shifts_apres': apres,
+        'echanges_coherents': apres == attendu,
+        'historique_radio_coherent': radio_coherente,
+        'duree_s': round(duree, 3),
+        'ecritures_par_s': round(ecritures / duree, 1) if duree else None
+    }
+
+
 # gestion_agents_stats.py - EXTENSIONS POUR LES STATISTIQUES
-from gestion_agents import GestionAgents
+from gestion_agents import GestionAgents, TYPES_AVERTISSEMENT
 from datetime import datetime, date, timedelta
 
 class GestionAgentsStats(GestionAgents):
@@ -1780,8 +4744,958 @@ class GestionAgentsStats(GestionAgents):
             'nb_mois': nb_mois
         }
 
+    # =========================================================================
+    # ANALYSES PANDAS (DATAFRAMES)
+    # =========================================================================
+    #
+    # Pendants DataFrame des rapports, sans dictionnaire par ligne : le planning
+    # (`_shifts_periode`) est converti d'un bloc en codes catégoriels numpy, les
+    # tables annexes sont lues par pd.read_sql_query. pandas est importé à l'appel.
+    # Les dates invalides lèvent ValueError.
+
+    CATEGORIES_SHIFTS = ('1', '2', '3', 'R', 'C', 'M', 'A', '-')
+
+    def _grille_planning(self, date_debut, date_fin, codes=None):
+        """Retourne (agents, dates, fériés, grille) : grille int8 agents × jours de codes catégoriels (-1 = inconnu)."""
+        import numpy as np
+        import pandas as pd
+
+        dates = pd.date_range(date_debut, date_fin, freq='D')
+        shifts = self._shifts_periode(date_debut, date_fin, codes)
+        agents = pd.read_sql_query("SELECT code, code_groupe AS groupe FROM agents", self.conn, index_col='code')
+        agents = agents.reindex(list(shifts)).rename_axis('code').reset_index()
+
+        table = np.full(256, -1, dtype=np.int8)
+        for i, shift in enumerate(self.CATEGORIES_SHIFTS):
+            table[ord(shift)] = i
+        grille = table[np.frombuffer(''.join(shifts.values()).encode('ascii', 'replace'), dtype=np.uint8)]
+        grille = grille.reshape(len(shifts), len(dates))
+
+        feries = self._dates_feries(date_debut, date_fin)
+        masque_feries = np.array([jour.strftime('%Y-%m-%d') in feries for jour in dates], dtype=bool)
+        return agents, dates, masque_feries, grille
+
+    def planning_dataframe(self, date_debut, date_fin, codes=None, pivot=False):
+        """Planning effectif d'une période en DataFrame.
+
+        Format long (défaut) : une ligne par agent et par jour, colonnes code, groupe,
+        date (datetime64), shift (catégoriel) et ferie. `pivot` : une ligne par agent,
+        une colonne catégorielle par date.
+        """
+        import numpy as np
+        import pandas as pd
+
+        agents, dates, masque_feries, grille = self._grille_planning(date_debut, date_fin, codes)
+        categories = list(self.CATEGORIES_SHIFTS)
+        if pivot:
+            resultat = pd.DataFrame(
+                {j: pd.Categorical.from_codes(grille[:, j], categories=categories) for j in range(len(dates))},
+                index=pd.Index(agents['code'], name='code')
+            )
+            resultat.columns = dates
+            return resultat
+
+        nb_agents, nb_jours = grille.shape
+        lignes_agents = np.repeat(np.arange(nb_agents), nb_jours)
+        return pd.DataFrame({
+            'code': pd.Categorical.from_codes(lignes_agents, categories=agents['code']),
+            'groupe': pd.Categorical(agents['groupe'].to_numpy()[lignes_agents]),
+            'date': np.tile(dates.to_numpy(), nb_agents),
+            'shift': pd.Categorical.from_codes(grille.ravel(), categories=categories),
+            'ferie': np.tile(masque_feries, nb_agents)
+        })
+
+    def statistiques_dataframe(self, date_debut, date_fin, codes=None):
+        """Statistiques par agent et par mois en DataFrame (comptes par shift, fériés travaillés, CPA).
+
+        Mêmes règles que `obtenir_statistiques_agent` ; 'mois' est le premier jour du
+        mois (datetime64). Les mois où l'agent n'est pas affecté sont omis.
+        """
+        import numpy as np
+        import pandas as pd
+
+        agents, dates, masque_feries, grille = self._grille_planning(date_debut, date_fin, codes)
+        debuts_mois = np.flatnonzero(np.r_[True, dates.month[1:] != dates.month[:-1]])
+        colonnes = {}
+        for i, shift in enumerate(self.CATEGORIES_SHIFTS):
+            colonnes[shift] = np.add.reduceat(grille == i, debuts_mois, axis=1, dtype=np.int32)
+        travail = grille <= 2  # codes 0, 1, 2 : shifts '1', '2', '3' (-1 exclu ci-dessous)
+        travail &= grille >= 0
+        colonnes['feries_travailles'] = np.add.reduceat(travail & masque_feries, debuts_mois, axis=1, dtype=np.int32)
+        colonnes['total_shifts'] = colonnes['1'] + colonnes['2'] + colonnes['3']
+        groupe_e = (agents['groupe'] == 'E').to_numpy()[:, None]
+        colonnes['cpa'] = colonnes['total_shifts'] + np.where(groupe_e, 0, colonnes['feries_travailles'])
+
+        nb_agents, nb_mois = colonnes['cpa'].shape
+        lignes_agents = np.repeat(np.arange(nb_agents), nb_mois)
+        resultat = pd.DataFrame({
+            'code': pd.Categorical.from_codes(lignes_agents, categories=agents['code']),
+            'groupe': pd.Categorical(agents['groupe'].to_numpy()[lignes_agents]),
+            'mois': np.tile(dates[debuts_mois].to_numpy(), nb_agents),
+            **{nom: valeurs.ravel() for nom, valeurs in colonnes.items()}
+        })
+        affecte = colonnes['-'].ravel() < np.tile(np.diff(np.r_[debuts_mois, len(dates)]), nb_agents)
+        return resultat[affecte].reset_index(drop=True)
+
+    def _dataframe_sql(self, requete, params, colonnes_dates, colonnes_categories):
+        """Exécute une requête avec pandas puis type les colonnes (datetime64, catégories)."""
+        import pandas as pd
+
+        resultat = pd.read_sql_query(requete, self.conn, params=params)
+        for colonne in colonnes_dates:
+            resultat[colonne] = pd.to_datetime(resultat[colonne], format='%Y-%m-%d', errors='coerce')
+        for colonne, categories in colonnes_categories.items():
+            resultat[colonne] = pd.Categorical(resultat[colonne], categories=categories)
+        return resultat
+
+    def historique_radios_dataframe(self, date_debut=None, date_fin=None):
+        """Attributions de radios (archives comprises) recoupant la période, en DataFrame.
+
+        Colonnes : id, id_radio, modele, code_agent, groupe, date_attribution,
+        date_retour (NaT si la radio n'est pas rendue).
+        """
+        for valeur in (date_debut, date_fin):
+            if valeur is not None:
+                date.fromisoformat(valeur)
+        conditions, params = [], []
+        if date_fin:
+            conditions.append("h.date_attribution <= ?")
+            params.append(date_fin)
+        if date_debut:
+            conditions.append("(h.date_retour IS NULL OR h.date_retour >= ?)")
+            params.append(date_debut)
+        requete = f"""
+            SELECT h.id, h.id_radio, r.modele, h.code_agent, a.code_groupe AS groupe,
+                   h.date_attribution, h.date_retour
+            FROM {self._source('historique_radio', date_debut, date_fin)} h
+            LEFT JOIN radios r ON r.id_radio = h.id_radio
+            LEFT JOIN agents a ON a.code = h.code_agent
+        """ + (" WHERE " + " AND ".join(conditions) if conditions else "") + " ORDER BY h.date_attribution, h.id"
+        return self._dataframe_sql(
+            requete, params, ['date_attribution', 'date_retour'],
+            {'id_radio': None, 'modele': None, 'code_agent': None, 'groupe': None}
+        )
+
+    def avertissements_dataframe(self, date_debut=None, date_fin=None):
+        """Avertissements (archives compris) de la période, en DataFrame.
+
+        Colonnes : id, code_agent, groupe, date (datetime64), type (catégoriel), description.
+        """
+        for valeur in (date_debut, date_fin):
+            if valeur is not None:
+                date.fromisoformat(valeur)
+        conditions, params = [], []
+        if date_debut:
+            conditions.append("av.date_avertissement >= ?")
+            params.append(date_debut)
+        if date_fin:
+            conditions.append("av.date_avertissement <= ?")
+            params.append(date_fin)
+        requete = f"""
+            SELECT av.id, av.code_agent, a.code_groupe AS groupe, av.date_avertissement AS date,
+                   av.type_avertissement AS type, av.description
+            FROM {self._source('avertissements', date_debut, date_fin)} av
+            LEFT JOIN agents a ON a.code = av.code_agent
+        """ + (" WHERE " + " AND ".join(conditions) if conditions else "") + " ORDER BY av.date_avertissement, av.id"
+        return self._dataframe_sql(
+            requete, params, ['date'],
+            {'code_agent': None, 'groupe': None, 'type': TYPES_AVERTISSEMENT}
+        )
+
+# rapports_paralleles.py - GÉNÉRATION PARALLÈLE DES RAPPORTS DE FIN DE MOIS
+import json
+import time
+
+# Méthodes de lecture utilisables dans un travail de rapport (résultat écrit en JSON)
+METHODES_RAPPORT = {
+    'obtenir_planning_mensuel', 'obtenir_planning_groupe', 'obtenir_planning_agent',
+    'obtenir_planning_trimestriel', 'obtenir_statistiques_agent', 'obtenir_statistiques_globales',
+    'obtenir_jours_travailles_groupe', 'obtenir_jours_travailles_global', 'obtenir_jours_feries',
+    'obtenir_stats_detaillees_agent', 'obtenir_classement_groupe', 'obtenir_evolution_mensuelle',
+    'obtenir_statut_radios', 'obtenir_rapport_habillement', 'obtenir_rapport_avertissements'
+}
+
+# Connexion en lecture seule propre à chaque processus de travail
+_gestion_processus = None
+
+
+def _initialiser_processus_rapport(db_name, memoire_max_mo):
+    """Initialise un processus de travail : plafond mémoire et connexion en lecture seule."""
+    global _gestion_processus
+    if memoire_max_mo:
+        try:
+            import resource
+            limite = int(memoire_max_mo) * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+        except (ImportError, ValueError, OSError):
+            # Plateforme sans RLIMIT_AS (Windows) : le travail s'exécute sans plafond
+            pass
+    _gestion_processus = GestionAgentsStats(db_name, lecture_seule=True)
+
+
+def _executer_travail_rapport(travail, dossier_sortie):
+    """Exécute un travail de rapport dans le processus courant et écrit son résultat dans un fichier."""
+    debut = time.perf_counter()
+    methode = travail['methode']
+    args = travail.get('args', [])
+    kwargs = travail.get('kwargs', {})
+    nom = travail.get('nom') or '_'.join([methode] + [str(a) for a in args])
+    resultat = {'nom': nom, 'methode': methode, 'pid': os.getpid()}
+
+    try:
+        if methode in ('exporter_stats_excel', 'exporter_paie_excel'):
+            fichier = os.path.join(dossier_sortie, f"{nom}.xlsx")
+            export = getattr(_gestion_processus, methode)(*args, fichier, **kwargs)
+        elif methode in METHODES_RAPPORT:
+            fichier = os.path.join(dossier_sortie, f"{nom}.json")
+            donnees = getattr(_gestion_processus, methode)(*args, **kwargs)
+            with open(fichier, 'w', encoding='utf-8') as f:
+                json.dump(donnees, f, ensure_ascii=False, indent=2, default=str)
+            export = donnees
+        else:
+            export = {'erreur': f"Méthode '{methode}' non autorisée dans un rapport."}
+
+        if 'erreur' in export:
+            resultat['erreur'] = export['erreur']
+        else:
+            resultat['succes'] = True
+            resultat['fichier'] = fichier
+    except MemoryError:
+        resultat['erreur'] = "Plafond mémoire du processus atteint."
+    except Exception as e:
+        resultat['erreur'] = f"Erreur lors de la génération du rapport: {e}"
+
+    resultat['duree_s'] = round(time.perf_counter() - debut, 3)
+    return resultat
+
+
+def travaux_fin_de_mois(periodes, groupes=('A', 'B', 'C', 'D', 'E')):
+    """Construit les travaux standards de fin de mois pour une liste de (mois, annee).
+
+    Pour chaque mois : grille de planning et jours travaillés par groupe,
+    statistiques globales et export Excel des statistiques.
+    """
+    travaux = []
+    for mois, annee in periodes:
+        suffixe = f"{mois:02d}_{annee}"
+        for groupe in groupes:
+            travaux.append({'nom': f"planning_{groupe}_{suffixe}", 'methode': 'obtenir_planning_groupe', 'args': [groupe, mois, annee]})
+            travaux.append({'nom': f"jours_travailles_{groupe}_{suffixe}", 'methode': 'obtenir_jours_travailles_groupe', 'args': [groupe, mois, annee]})
+        travaux.append({'nom': f"statistiques_{suffixe}", 'methode': 'obtenir_statistiques_globales', 'args': [mois, annee]})
+        travaux.append({'nom': f"stats_{suffixe}", 'methode': 'exporter_stats_excel', 'args': [mois, annee]})
+    return travaux
+
+
+def generer_rapports_paralleles(db_name, travaux, dossier_sortie, nb_processus=None, memoire_max_mo=None,
+                                progression=None):
+    """Répartit des travaux de rapport sur un pool de processus.
+
+    Chaque processus ouvre sa propre connexion en lecture seule sur `db_name` ;
+    les résultats sont écrits dans `dossier_sortie` (JSON, ou .xlsx pour les exports).
+    `memoire_max_mo` plafonne la mémoire virtuelle de chaque processus (Unix).
+    `progression(faits, total, resultat)` est appelé à la fin de chaque travail.
+    Retourne la durée de chaque travail et la durée totale.
+    """
+    # Import différé : inutile au démarrage des autres commandes
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+
+    if not os.path.exists(db_name):
+        return {'erreur': f"La base '{db_name}' est introuvable."}
+
+    os.makedirs(dossier_sortie, exist_ok=True)
+    nb_processus = nb_processus or os.cpu_count() or 1
+    debut = time.perf_counter()
+    resultats = []
+
+    with ProcessPoolExecutor(max_workers=nb_processus, initializer=_initialiser_processus_rapport,
+                             initargs=(db_name, memoire_max_mo)) as pool:
+        futures = {pool.submit(_executer_travail_rapport, travail, dossier_sortie): travail for travail in travaux}
+        for future in as_completed(futures):
+            try:
+                resultats.append(future.result())
+            except BrokenProcessPool as e:
+                travail = futures[future]
+                resultats.append({'nom': travail.get('nom', travail['methode']), 'methode': travail['methode'],
+                                  'erreur': f"Processus de travail interrompu: {e}"})
+            if progression:
+                progression(len(resultats), len(futures), resultats[-1])
+
+    resultats.sort(key=lambda r: r['nom'])
+    erreurs = [r for r in resultats if 'erreur' in r]
+    return {
+        'succes': not erreurs,
+        'travaux': resultats,
+        'nb_erreurs': len(erreurs),
+        'nb_processus': nb_processus,
+        'duree_totale_s': round(time.perf_counter() - debut, 3),
+        'duree_cumulee_s': round(sum(r.get('duree_s', 0) for r in resultats), 3)
+    }
+
+# federation_sites.py - REQUÊTES CONSOLIDÉES MULTI-SITES
+
+
+class FederationSites:
+    """Exécute les requêtes de planning, statistiques, radios et avertissements
+    sur les bases `planning.db` de plusieurs sites, en parallèle.
+
+    Chaque site garde sa propre connexion en lecture seule ; les résultats sont
+    fusionnés et chaque ligne est étiquetée avec le nom du site.
+    """
+
+    def __init__(self, sites, nb_threads=None):
+        """`sites` : dictionnaire {nom_site: chemin_base}."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        introuvables = [chemin for chemin in sites.values() if not os.path.exists(chemin)]
+        if introuvables:
+            raise FileNotFoundError(f"Base(s) de site introuvable(s): {', '.join(introuvables)}")
+
+        self.sites = dict(sites)
+        self._gestions = {nom: GestionAgentsStats(chemin, lecture_seule=True) for nom, chemin in self.sites.items()}
+        self._verrous = {nom: threading.Lock() for nom in self.sites}
+        self._pool = ThreadPoolExecutor(max_workers=nb_threads or len(self.sites) or 1)
+
+    def fermer(self):
+        """Ferme les connexions de tous les sites."""
+        self._pool.shutdown(wait=True)
+        for gestion in self._gestions.values():
+            gestion.fermer_connexion()
+
+    def _executer_site(self, nom_site, methode, args):
+        """Exécute une méthode sur un site et mesure sa durée.
+
+        Retourne (résultat, durée, exception éventuelle sous forme de message).
+        Le cache du site est d'abord resynchronisé sur son journal : les écritures
+        faites dans la base par d'autres processus ne doivent pas être masquées.
+        """
+        debut = time.perf_counter()
+        exception = None
+        with self._verrous[nom_site]:
+            try:
+                gestion = self._gestions[nom_site]
+                gestion.synchroniser_cache()
+                resultat = getattr(gestion, methode)(*args)
+            except Exception as e:
+                exception = f"Erreur sur le site {nom_site}: {e}"
+                resultat = {'erreur': exception}
+        return resultat, round(time.perf_counter() - debut, 3), exception
+
+    def _executer(self, methode, *args):
+        """Exécute une méthode sur tous les sites en parallèle.
+
+        Retourne (résultats par site, durées par site, erreurs par site).
+        """
+        futures = {nom: self._pool.submit(self._executer_site, nom, methode, args) for nom in self.sites}
+        resultats, durees, erreurs = {}, {}, {}
+        for nom, future in futures.items():
+            resultat, duree, _ = future.result()
+            durees[nom] = duree
+            if 'erreur' in resultat:
+                erreurs[nom] = resultat['erreur']
+            resultats[nom] = resultat
+        return resultats, durees, erreurs
+
+    def _lignes_etiquetees(self, resultats, cle):
+        """Fusionne la liste `cle` de chaque site en étiquetant chaque ligne avec le site."""
+        lignes = []
+        for nom, resultat in resultats.items():
+            for ligne in resultat.get(cle, []):
+                lignes.append(dict(ligne, site=nom))
+        return lignes
+
+    def planning_mensuel(self, mois, annee):
+        """Planning mensuel de tous les sites, agents étiquetés par site."""
+        resultats, durees, erreurs = self._executer('obtenir_planning_mensuel', mois, annee)
+        jours = next((r['jours'] for r in resultats.values() if 'jours' in r), [])
+        agents = self._lignes_etiquetees(resultats, 'agents')
+        return {
+            'mois': mois,
+            'annee': annee,
+            'jours': jours,
+            'agents': agents,
+            'total_agents': len(agents),
+            'durees': durees,
+            'erreurs': erreurs
+        }
+
+    def statistiques_globales(self, mois, annee):
+        """Statistiques globales consolidées (sommes) et détail par site."""
+        resultats, durees, erreurs = self._executer('obtenir_statistiques_globales', mois, annee)
+
+        totaux = {}
+        groupes = {}
+        for resultat in resultats.values():
+            for stat in resultat.get('statistiques', []):
+                totaux[stat['description']] = totaux.get(stat['description'], 0) + stat['valeur']
+            for groupe, nombre in resultat.get('groupes', {}).items():
+                groupes[groupe] = groupes.get(groupe, 0) + nombre
+
+        return {
+            'mois': mois,
+            'annee': annee,
+            'statistiques': [{'description': description, 'valeur': valeur} for description, valeur in totaux.items()],
+            'total_operationnels': sum(r.get('total_operationnels', 0) for r in resultats.values()),
+            'groupes': groupes,
+            'total_agents': sum(groupes.values()),
+            'par_site': {nom: r for nom, r in resultats.items() if 'erreur' not in r},
+            'durees': durees,
+            'erreurs': erreurs
+        }
+
+    def classement_cpa(self, mois, annee, groupes=('A', 'B', 'C', 'D', 'E')):
+        """Classement CPA de tous les agents de tous les sites, en un seul appel."""
+        debut = time.perf_counter()
+        futures = {
+            (nom, groupe): self._pool.submit(self._executer_site, nom, 'obtenir_classement_groupe', (groupe, mois, annee))
+            for nom in self.sites for groupe in groupes
+        }
+        classement, durees, erreurs = [], {}, {}
+        for (nom, groupe), future in futures.items():
+            resultat, duree, exception = future.result()
+            durees[nom] = round(durees.get(nom, 0) + duree, 3)
+            # Un groupe vide n'est pas une erreur : seules les exceptions sont remontées
+            if exception:
+                erreurs[nom] = exception
+            for agent in resultat.get('classement', []):
+                classement.append(dict(agent, site=nom, groupe=groupe))
+
+        classement.sort(key=lambda a: a['cpa'], reverse=True)
+        for i, agent in enumerate(classement):
+            agent['rang'] = i + 1
+
+        return {
+            'mois': mois,
+            'annee': annee,
+            'classement': classement,
+            'total_cpa': sum(a['cpa'] for a in classement),
+            'total_agents': len(classement),
+            'durees': durees,
+            'duree_totale_s': round(time.perf_counter() - debut, 3),
+            'erreurs': erreurs
+        }
+
+    def inventaire_radios(self):
+        """Inventaire radio de tous les sites avec compteurs consolidés."""
+        resultats, durees, erreurs = self._executer('obtenir_statut_radios')
+        statistiques = {}
+        for resultat in resultats.values():
+            for cle, valeur in resultat.get('statistiques', {}).items():
+                statistiques[cle] = statistiques.get(cle, 0) + valeur
+        return {
+            'radios': self._lignes_etiquetees(resultats, 'radios'),
+            'statistiques': statistiques,
+            'par_site': {nom: r.get('statistiques', {}) for nom, r in resultats.items()},
+            'durees': durees,
+            'erreurs': erreurs
+        }
+
+    def rapport_avertissements(self):
+        """Avertissements actifs de tous les sites, du plus récent au plus ancien."""
+        resultats, durees, erreurs = self._executer('obtenir_rapport_avertissements')
+        avertissements = self._lignes_etiquetees(resultats, 'avertissements')
+        avertissements.sort(key=lambda a: (a['date'], a['site'], a['code_agent']), reverse=True)
+        return {
+            'avertissements': avertissements,
+            'total': len(avertissements),
+            'durees': durees,
+            'erreurs': erreurs
+        }
+
+# serveur_http.py - API HTTP LOCALE (JSON + ETAG)
+import hashlib
+import queue
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _dependances_periode(self, date_debut, date_fin):
+    """Dépendances d'un résultat portant sur tout l'effectif pour une période."""
+    dependances = [('effectif',)]
+    for annee, mois in self._mois_periode(date_debut, date_fin):
+        dependances.append(('mois', annee, mois))
+    return dependances
+
+
+def _dependances_validation(self, date_debut, date_fin):
+    """Dépendances de `valider_planning` (règles par défaut) : la période et sa marge de lecture."""
+    marge = timedelta(days=self._marge_validation(REGLES_PLANNING_DEFAUT))
+    return _dependances_periode(
+        self, (date.fromisoformat(date_debut) - marge).isoformat(), (date.fromisoformat(date_fin) + marge).isoformat()
+    )
+
+
+def _dependances_entite(entite):
+    """Dépendances d'un rapport portant sur une table annexe."""
+    return lambda self, *args: [('entite', entite)]
+
+
+def _param_mois(valeur):
+    """Paramètre mois (1 à 12) ; ValueError sinon."""
+    mois = int(valeur)
+    if not 1 <= mois <= 12:
+        raise ValueError(valeur)
+    return mois
+
+
+def _param_annee(valeur):
+    """Paramètre année (1 à 9999) ; ValueError sinon."""
+    annee = int(valeur)
+    if not 1 <= annee <= 9999:
+        raise ValueError(valeur)
+    return annee
+
+
+def _param_date(valeur):
+    """Paramètre date AAAA-MM-JJ ; ValueError sinon."""
+    return date.fromisoformat(valeur).isoformat()
+
+
+# Routes : chemin -> (méthode, paramètres (nom, type[, défaut]), dépendances pour l'ETag, rapport lourd)
+ROUTES_API = {
+    '/planning/mensuel': ('obtenir_planning_mensuel', [('mois', _param_mois), ('annee', _param_annee)], _dependances_mois, True),
+    '/planning/groupe': ('obtenir_planning_groupe', [('groupe', str), ('mois', _param_mois), ('annee', _param_annee)], _dependances_groupe_mois, True),
+    '/planning/agent': ('obtenir_planning_agent', [('agent', str), ('mois', _param_mois), ('annee', _param_annee)], _dependances_agent_mois, False),
+    '/planning/compact': ('exporter_planning_compact', [('debut', _param_date), ('fin', _param_date)], _dependances_periode, True),
+    '/statistiques/agent': ('obtenir_statistiques_agent', [('agent', str), ('mois', _param_mois), ('annee', _param_annee)], _dependances_agent_mois, False),
+    '/statistiques/globales': ('obtenir_statistiques_globales', [('mois', _param_mois), ('annee', _param_annee)], _dependances_mois, True),
+    '/statistiques/periode': ('statistiques_periode', [('debut', _param_date), ('fin', _param_date)], _dependances_periode, False),
+    '/jours-travailles/groupe': ('obtenir_jours_travailles_groupe', [('groupe', str), ('mois', _param_mois), ('annee', _param_annee)], _dependances_groupe_mois, True),
+    '/jours-travailles/global': ('obtenir_jours_travailles_global', [('mois', _param_mois), ('annee', _param_annee)], _dependances_mois, True),
+    '/couverture': ('obtenir_couverture', [('debut', _param_date), ('fin', _param_date), ('par_groupe', int, 0)],
+                    lambda self, debut, fin, par_groupe=0: _dependances_periode(self, debut, fin), True),
+    '/echange/candidats': ('candidats_echange', [('agent', str), ('date', _param_date)],
+                           lambda self, code, jour: _dependances_jour_adjacent(self, jour), False),
+    '/planning/validation': ('valider_planning', [('debut', _param_date), ('fin', _param_date)], _dependances_validation, True),
+    '/jours-feries': ('obtenir_jours_feries', [('annee', _param_annee)], _dependances_feries, False),
+    '/radios': ('obtenir_statut_radios', [], _dependances_entite('radio'), False),
+    '/radios/inventaire': ('obtenir_inventaire_radios', [], _dependances_entite('radio'), False),
+    # Dépend de la date du jour (attributions en cours) : pas d'ETag
+    '/radios/utilisation': ('analyser_utilisation_radios', [('debut', _param_date), ('fin', _param_date), ('seuil', int, 30)], None, True),
+    '/habillement': ('obtenir_rapport_habillement', [], _dependances_entite('habillement'), False),
+    '/avertissements': ('obtenir_rapport_avertissements', [], _dependances_entite('avertissement'), False),
+    '/habillement/page': ('page_habillement', [('limite', int, 100), ('jeton', str, None), ('groupe', str, None),
+                                               ('article', str, None), ('date', _param_date, None)],
+                          lambda self, *args: [('entite', 'habillement'), ('effectif',),
+                                               ('jour', date.today().isoformat())], False),
+    '/habillement/prevision': ('prevoir_renouvellements_habillement', [('horizon', int, 6)],
+                               lambda self, *args: [('entite', 'habillement'), ('effectif',),
+                                                    ('jour', date.today().isoformat())], False),
+    '/avertissements/page': ('page_avertissements', [('limite', int, 100), ('jeton', str, None), ('debut', _param_date, None),
+                                                     ('fin', _param_date, None), ('type', str, None), ('groupe', str, None),
+                                                     ('agent', str, None)],
+                             lambda self, *args: [('entite', 'avertissement'), ('effectif',)], False),
+    '/avertissements/agent': ('obtenir_historique_avertissements_agent', [('agent', str)], _dependances_entite('avertissement'), False),
+    '/changements': ('changements_depuis', [('depuis', int, 0), ('limite', int, 500)], None, False),
+}
+
+
+class PoolConnexions:
+    """Pool borné de connexions (instances GestionAgentsStats) partageant un même cache des lectures."""
+
+    def __init__(self, db_name, taille=4, lecture_seule=True, taille_cache=TAILLE_CACHE_DEFAUT):
+        self.cache = CacheResultats(taille_cache)
+        self._libres = queue.Queue()
+        for _ in range(taille):
+            gestion = GestionAgentsStats(db_name, lecture_seule=lecture_seule, taille_cache=0)
+            gestion._cache = self.cache
+            self._libres.put(gestion)
+        # Les versions sont propres au processus : l'identifiant d'instance évite
+        # qu'un ETag émis avant un redémarrage soit pris pour valide.
+        self.instance = uuid.uuid4().hex
+        with self.connexion() as gestion:
+            gestion.synchroniser_cache()
+
+    @contextmanager
+    def connexion(self):
+        """Emprunte une connexion du pool (bloque si toutes sont occupées)."""
+        gestion = self._libres.get()
+        try:
+            yield gestion
+        finally:
+            self._libres.put(gestion)
+
+    def fermer(self):
+        """Ferme toutes les connexions du pool."""
+        while not self._libres.empty():
+            self._libres.get().fermer_connexion()
+
+
+class GestionnaireRequetesAPI(BaseHTTPRequestHandler):
+    """Traite les requêtes GET de l'API : paramètres en query string, réponses JSON."""
+
+    server_version = "GestionAgentsAPI/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.journal_acces:
+            super().log_message(format, *args)
+
+    def _repondre(self, statut, corps=None, entetes=None):
+        donnees = b''
+        if corps is not None:
+            donnees = json.dumps(corps, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(statut)
+        for nom, valeur in (entetes or {}).items():
+            self.send_header(nom, valeur)
+        if corps is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(donnees)))
+        self.end_headers()
+        if donnees and self.command != 'HEAD':
+            self.wfile.write(donnees)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        chemin = url.path.rstrip('/') or '/'
+        pool = self.server.pool
+
+        if chemin == '/sante':
+            with pool.connexion() as gestion:
+                seq = gestion.dernier_seq_journal()
+            self._repondre(200, {'statut': 'ok', 'dernier_seq': seq, 'cache': pool.cache.statistiques()})
+            return
+
+        route = ROUTES_API.get(chemin)
+        if route is None:
+            self._repondre(404, {'erreur': f"Ressource inconnue: {chemin}"})
+            return
+
+        methode, parametres, dependances, lourd = route
+        requete = parse_qs(url.query)
+        # ?format=colonnes : transmis aux API qui l'acceptent, sinon résultat converti par `en_colonnes`
+        format_resultat = requete.get('format', ['lignes'])[0]
+        if format_resultat not in FORMATS_RESULTAT:
+            self._repondre(400, {'erreur': f"Paramètre invalide: format ({', '.join(FORMATS_RESULTAT)})"})
+            return
+        args = []
+        for nom, type_param, *defaut in parametres:
+            if nom not in requete:
+                if defaut:
+                    args.append(defaut[0])
+                    continue
+                self._repondre(400, {'erreur': f"Paramètre manquant: {nom}"})
+                return
+            try:
+                args.append(type_param(requete[nom][0]))
+            except ValueError:
+                self._repondre(400, {'erreur': f"Paramètre invalide: {nom}"})
+                return
+
+        # ETag calculé à partir des versions des données, sans exécuter la requête
+        etag = None
+        try:
+            with pool.connexion() as gestion:
+                gestion.synchroniser_cache()
+                if dependances is not None:
+                    versions = [(d, pool.cache.version(d)) for d in dependances(gestion, *args)]
+                    empreinte = repr((pool.instance, chemin, args, format_resultat, versions)).encode('utf-8')
+                    etag = '"' + hashlib.sha1(empreinte).hexdigest() + '"'
+        except ValueError as e:
+            self._repondre(400, {'erreur': f"Paramètres invalides: {e}"})
+            return
+        except Exception as e:
+            self._repondre(500, {'erreur': f"Erreur interne: {e}"})
+            return
+
+        if etag and etag in [e.strip() for e in self.headers.get('If-None-Match', '').split(',')]:
+            self._repondre(304, entetes={'ETag': etag})
+            return
+
+        if lourd and not self.server.limite_lourds.acquire(timeout=self.server.attente_lourds_s):
+            self._repondre(503, {'erreur': "Serveur occupé, réessayez plus tard."}, {'Retry-After': '2'})
+            return
+        try:
+            with pool.connexion() as gestion:
+                fonction = getattr(gestion, methode)
+                if hasattr(fonction, 'formats_resultat'):
+                    resultat = fonction(*args, format_resultat=format_resultat)
+                else:
+                    resultat = fonction(*args)
+        except Exception as e:
+            self._repondre(500, {'erreur': f"Erreur interne: {e}"})
+            return
+        finally:
+            if lourd:
+                self.server.limite_lourds.release()
+
+        if 'erreur' in resultat:
+            self._repondre(404, resultat)
+        else:
+            if format_resultat == 'colonnes' and not hasattr(fonction, 'formats_resultat'):
+                resultat = en_colonnes(resultat)
+            self._repondre(200, resultat, {'ETag': etag} if etag else None)
+
+
+def creer_serveur_api(db_name="planning.db", hote="127.0.0.1", port=8765, taille_pool=4,
+                      max_rapports_lourds=2, attente_lourds_s=30, journal_acces=False):
+    """Crée le serveur HTTP de l'API (à démarrer avec `serve_forever()`).
+
+    Les rapports lourds (plannings et statistiques de tout l'effectif) sont limités
+    à `max_rapports_lourds` calculs simultanés ; au-delà de `attente_lourds_s`
+    secondes d'attente, la requête reçoit un 503.
+    """
+    serveur = ThreadingHTTPServer((hote, port), GestionnaireRequetesAPI)
+    serveur.daemon_threads = True
+    serveur.pool = PoolConnexions(db_name, taille=taille_pool)
+    serveur.limite_lourds = threading.BoundedSemaphore(max_rapports_lourds)
+    serveur.attente_lourds_s = attente_lourds_s
+    serveur.journal_acces = journal_acces
+    return serveur
+
+# cli.py - LIGNE DE COMMANDE DES TRAITEMENTS PLANIFIÉS
+import argparse
+import sys
+
+
+def _type_mois(valeur):
+    """Argument AAAA-MM -> (mois, annee)."""
+    try:
+        annee, mois = (int(x) for x in valeur.split('-'))
+        date(annee, mois, 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"mois invalide: {valeur} (format AAAA-MM)")
+    return mois, annee
+
+
+def _type_date(valeur):
+    """Argument AAAA-MM-JJ, vérifié et conservé sous forme de chaîne."""
+    try:
+        return date.fromisoformat(valeur).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"date invalide: {valeur} (format AAAA-MM-JJ)")
+
+
+def _periodes_cli(args):
+    """Liste des (mois, annee) de --mois à --jusqua inclus."""
+    mois, annee = args.mois
+    mois_fin, annee_fin = args.jusqua or args.mois
+    periodes = []
+    while (annee, mois) <= (annee_fin, mois_fin):
+        periodes.append((mois, annee))
+        mois, annee = (1, annee + 1) if mois == 12 else (mois + 1, annee)
+    return periodes
+
+
+def _codes_groupes(gestion, groupes):
+    """Codes des agents actifs des groupes demandés (None = tous)."""
+    if not groupes:
+        return None
+    marqueurs = ', '.join('?' * len(groupes))
+    gestion.cursor.execute(
+        f"SELECT code FROM agents WHERE date_sortie IS NULL AND code_groupe IN ({marqueurs}) ORDER BY code_groupe, code",
+        [g.upper() for g in groupes]
+    )
+    return [code for (code,) in gestion.cursor.fetchall()]
+
+
+def _progression_rapports(afficher):
+    if afficher is None:
+        return None
+    def progression(faits, total, resultat):
+        etat = f"ERREUR {resultat['erreur']}" if 'erreur' in resultat else f"{resultat.get('duree_s', 0)} s"
+        afficher(f"[{faits}/{total}] {resultat['nom']} : {etat}")
+    return progression
+
+
+def _cli_import(args, afficher):
+    gestion = GestionAgents(args.db)
+    try:
+        if args.type == 'agents':
+            if args.fichier.lower().endswith('.csv'):
+                return gestion.importer_agents_csv(args.fichier)
+            return gestion.importer_agents_excel(args.fichier)
+
+        # Congés : CSV avec les colonnes code_agent, date_debut, date_fin
+        try:
+            with open(args.fichier, 'r', encoding='utf-8') as f:
+                lignes = list(csv.DictReader(f))
+        except FileNotFoundError:
+            return {'erreur': f"Le fichier '{args.fichier}' est introuvable."}
+        erreurs = []
+        for numero, ligne in enumerate(lignes, start=2):
+            resultat = gestion.ajouter_conge_periode(
+                (ligne.get('code_agent') or ligne.get('code') or '').strip(),
+                (ligne.get('date_debut') or '').strip(), (ligne.get('date_fin') or '').strip()
+            )
+            if 'erreur' in resultat:
+                erreurs.append({'ligne': numero, 'erreur': resultat['erreur']})
+            if afficher and numero % 100 == 0:
+                afficher(f"{numero - 1}/{len(lignes)} congé(s) traité(s)")
+        return {
+            'succes': not erreurs,
+            'message': f"{len(lignes) - len(erreurs)} congé(s) importé(s), {len(erreurs)} erreur(s).",
+            'erreurs': erreurs
+        }
+    finally:
+        gestion.fermer_connexion()
+
+
+def _cli_export(args, afficher):
+    travaux = []
+    if args.type == 'paie':
+        # Un seul travail : la plage entière est calculée en une passe
+        (mois, annee), (mois_fin, annee_fin) = args.mois, args.jusqua or args.mois
+        nom = f"paie_{mois:02d}_{annee}_{mois_fin:02d}_{annee_fin}"
+        if args.groupes:
+            nom += '_' + ''.join(groupe.upper() for groupe in args.groupes)
+        travaux.append({'nom': nom, 'methode': 'exporter_paie_excel', 'args': [mois, annee, mois_fin, annee_fin],
+                        'kwargs': {'groupes': args.groupes}})
+    else:
+        for mois, annee in _periodes_cli(args):
+            suffixe = f"{mois:02d}_{annee}"
+            if args.type == 'stats':
+                travaux.append({'nom': f"stats_{suffixe}", 'methode': 'exporter_stats_excel', 'args': [mois, annee]})
+            elif args.groupes:
+                for groupe in args.groupes:
+                    travaux.append({'nom': f"planning_{groupe.upper()}_{suffixe}", 'methode': 'obtenir_planning_groupe',
+                                    'args': [groupe.upper(), mois, annee]})
+            else:
+                travaux.append({'nom': f"planning_{suffixe}", 'methode': 'obtenir_planning_mensuel', 'args': [mois, annee]})
+    resultat = generer_rapports_paralleles(args.db, travaux, args.sortie, args.processus, args.memoire_max_mo,
+                                           _progression_rapports(afficher))
+    if 'erreur' not in resultat:
+        resultat['message'] = (f"{len(travaux) - resultat['nb_erreurs']}/{len(travaux)} export(s) "
+                               f"dans '{args.sortie}' en {resultat['duree_totale_s']} s.")
+    return resultat
+
+
+def _cli_stats(args, afficher):
+    import tempfile
+
+    travaux = []
+    for mois, annee in _periodes_cli(args):
+        suffixe = f"{mois:02d}_{annee}"
+        travaux.append({'nom': f"statistiques_{suffixe}", 'methode': 'obtenir_statistiques_globales', 'args': [mois, annee]})
+        for groupe in args.groupes or ():
+            travaux.append({'nom': f"jours_travailles_{groupe.upper()}_{suffixe}",
+                            'methode': 'obtenir_jours_travailles_groupe', 'args': [groupe.upper(), mois, annee]})
+    with tempfile.TemporaryDirectory() as dossier:
+        resultat = generer_rapports_paralleles(args.db, travaux, args.sortie or dossier, args.processus,
+                                               args.memoire_max_mo, _progression_rapports(afficher))
+        if 'erreur' in resultat:
+            return resultat
+        donnees = {}
+        for travail in resultat['travaux']:
+            if 'fichier' in travail:
+                with open(travail['fichier'], encoding='utf-8') as f:
+                    donnees[travail['nom']] = json.load(f)
+    resultat['donnees'] = donnees
+    resultat['message'] = f"{len(donnees)}/{len(travaux)} calcul(s) de statistiques en {resultat['duree_totale_s']} s."
+    return resultat
+
+
+def _cli_precalcul(args, afficher):
+    gestion = GestionAgents(args.db)
+    try:
+        resultat = {'succes': True, 'agents': 0, 'cellules_ecrites': 0, 'cellules_conservees': 0}
+        for annee, mois in gestion._mois_periode(args.debut, args.fin):
+            debut = max(args.debut, f"{annee}-{mois:02d}-01")
+            fin = min(args.fin, f"{annee}-{mois:02d}-{monthrange(annee, mois)[1]:02d}")
+            etape = gestion.generer_planning(debut, fin, args.groupes)
+            if 'erreur' in etape:
+                return etape
+            resultat['agents'] = etape['agents']
+            resultat['cellules_ecrites'] += etape['cellules_ecrites']
+            resultat['cellules_conservees'] += etape['cellules_conservees']
+            if afficher:
+                afficher(f"{annee}-{mois:02d} : {etape['cellules_ecrites']} cellule(s) écrite(s)")
+        resultat['message'] = (f"Planning enregistré pour {resultat['agents']} agent(s) : "
+                               f"{resultat['cellules_ecrites']} cellule(s) écrite(s), "
+                               f"{resultat['cellules_conservees']} conservée(s).")
+        return resultat
+    finally:
+        gestion.fermer_connexion()
+
+
+def _cli_validation(args, afficher):
+    gestion = GestionAgentsStats(args.db, lecture_seule=True)
+    try:
+        resultat = gestion.valider_planning(args.debut, args.fin, _codes_groupes(gestion, args.groupes))
+    finally:
+        gestion.fermer_connexion()
+    if 'erreur' not in resultat:
+        resultat['succes'] = resultat['nb_violations'] == 0
+        resultat['message'] = f"{resultat['nb_violations']} violation(s) des règles de repos."
+        if afficher:
+            for v in resultat['violations']:
+                afficher(f"{v['code_agent']} {v['debut']}..{v['fin']} {v['regle']} ({v['detail']})")
+    return resultat
+
+
+def _parseur_cli():
+    parseur = argparse.ArgumentParser(prog='gestion_agents', description="Traitements planifiés du planning CleanCo.")
+    parseur.add_argument('--db', default='planning.db', help="base SQLite (défaut : planning.db)")
+    parseur.add_argument('--json', action='store_true', help="résultat JSON sur la sortie standard")
+    parseur.add_argument('--silencieux', action='store_true', help="pas de progression sur la sortie d'erreur")
+    commandes = parseur.add_subparsers(dest='commande', required=True)
+
+    def options_mois(p):
+        p.add_argument('--mois', type=_type_mois, required=True, help="premier mois (AAAA-MM)")
+        p.add_argument('--jusqua', type=_type_mois, help="dernier mois inclus (AAAA-MM)")
+        p.add_argument('--groupes', nargs='+', help="groupes (A B C D E)")
+        p.add_argument('--processus', type=int, help="nombre de processus (défaut : nombre de CPU)")
+        p.add_argument('--memoire-max-mo', type=int, help="plafond mémoire par processus")
+
+    p = commandes.add_parser('import', help="importer des agents (Excel/CSV) ou des congés (CSV)")
+    p.add_argument('fichier')
+    p.add_argument('--type', choices=['agents', 'conges'], default='agents')
+    p.set_defaults(executer=_cli_import)
+
+    p = commandes.add_parser('export', help="exporter statistiques (Excel), paie (Excel) ou planning (JSON) par mois")
+    p.add_argument('type', choices=['stats', 'paie', 'planning'])
+    options_mois(p)
+    p.add_argument('--sortie', default='.', help="dossier de sortie")
+    p.set_defaults(executer=_cli_export)
+
+    p = commandes.add_parser('stats', help="statistiques globales (et par groupe) des mois demandés")
+    options_mois(p)
+    p.add_argument('--sortie', help="dossier où conserver les résultats JSON")
+    p.set_defaults(executer=_cli_stats)
+
+    for nom, aide, executer in (
+        ('precalcul', "enregistrer le planning théorique d'une période", _cli_precalcul),
+        ('validation', "vérifier les règles de repos sur une période", _cli_validation),
+    ):
+        p = commandes.add_parser(nom, help=aide)
+        p.add_argument('--debut', type=_type_date, required=True)
+        p.add_argument('--fin', type=_type_date, required=True)
+        p.add_argument('--groupes', nargs='+', help="groupes (A B C D E)")
+        p.set_defaults(executer=executer)
+    return parseur
+
+
+def main(argv=None):
+    """Point d'entrée de la ligne de commande ; retourne le code de sortie.
+
+    0 : succès ; 1 : erreur ou résultat en échec (travaux en erreur, violations) ;
+    2 : arguments invalides (argparse).
+    """
+    parseur = _parseur_cli()
+    args = parseur.parse_args(argv)
+    if args.commande == 'export' and args.type == 'stats' and args.groupes:
+        parseur.error("export stats : l'option --groupes n'est pas prise en charge")
+    afficher = None if args.silencieux else (lambda message: print(message, file=sys.stderr, flush=True))
+    if args.commande != 'import' and not os.path.exists(args.db):
+        resultat = {'erreur': f"La base '{args.db}' est introuvable."}
+    else:
+        try:
+            resultat = args.executer(args, afficher)
+        except Exception as e:
+            resultat = {'erreur': f"{type(e).__name__}: {e}"}
+
+    code = 1 if 'erreur' in resultat or resultat.get('succes') is False else 0
+    if args.json:
+        print(json.dumps(resultat, ensure_ascii=False, indent=2, default=str))
+    else:
+        print(resultat.get('erreur') or resultat.get('message') or "Terminé.")
+    return code
+
+
 if __name__ == "__main__":
-    # Test de la classe
-    gestion = GestionAgents()
-    print("✅ Module gestion_agents chargé avec succès!")
+    sys.exit(main())
     
\ No newline at end of file